@@ -0,0 +1,331 @@
+
+##############################################################################
+# AsyncSempHandler
+#   asyncio SEMPv2 protocol handler (uses aiohttp)
+#   Supports GET, POST, PATCH, PUT, DELETE with the same semantics as SempHandler
+#   Many requests can be in flight from a single process and thread.
+#   max_inflight caps the number of concurrent requests to the broker
+#   Crawl bookkeeping is shared with SempHandler (SempCrawler); only the I/O is here
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import pprint
+import json
+import inspect
+import asyncio
+import ssl
+import time
+from collections import deque
+from urllib.parse import unquote # for Python 3.7
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+from common.SempHandler import SempResponse, LazyJson
+from common.SempCrawler import SempCrawler
+from common import SempGovernor
+from common import SempMetrics
+
+pp = pprint.PrettyPrinter(indent=4)
+Verbose = 0
+Cfg = {}
+json_h = JsonHandler.JsonHandler()
+log = None
+
+
+class AsyncSempHandler(SempCrawler):
+    """ Solace SEMPv2 asyncio implementation
+        use as async context manager:
+            async with AsyncSempHandler(cfg, vpn, outdir) as semp_h:
+                resp = await semp_h.http_get(url)
+    """
+
+    def __init__(self, cfg, vpn="default", outdir = "output/default", verbose = 0, max_inflight = 100, checkpoint = None, schema = None, negative_cache = None, scope = None, writer = None, assembler = None, incremental = None):
+        global Verbose, Cfg, log
+        if aiohttp is None:
+            raise RuntimeError('AsyncSempHandler requires aiohttp module (pip install aiohttp)')
+        Verbose = verbose
+        log = cfg['log_handler'].get()
+        Cfg = cfg
+        self.rtr_cfg = cfg["router"] # broker of this handler (Cfg is shared by handlers of all brokers)
+        self.max_inflight = max_inflight
+        # crawl state and page bookkeeping (SempCrawler)
+        self.init_crawl(cfg, vpn, outdir, verbose, checkpoint, schema, negative_cache, scope, writer, assembler, incremental)
+        self.session = None
+        self.inflight = None
+        self.governor = SempGovernor.get_governor(cfg, verbose) # shared per broker with SempHandlers
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        """ create pooled aiohttp session for the broker """
+        rtr_cfg = self.rtr_cfg
+        sess_cfg = Cfg["system"]["semp"].get("session", {})
+        if rtr_cfg.get("sslVerify", False):
+            ssl_ctx = ssl.create_default_context(cafile=rtr_cfg.get("caBundle"))
+        else:
+            ssl_ctx = ssl.create_default_context()
+            ssl_ctx.check_hostname = False
+            ssl_ctx.verify_mode = ssl.CERT_NONE
+        connector = aiohttp.TCPConnector(limit=self.max_inflight, ssl=ssl_ctx,
+                                         force_close=not sess_cfg.get("keepAlive", True))
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            auth=aiohttp.BasicAuth(rtr_cfg["sempUser"], rtr_cfg["sempPassword"]),
+            headers={"content-type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=sess_cfg.get("timeout")))
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, verb, url, params=None, json_data=None):
+        """ send one request and read the whole body while holding an in-flight slot
+            goes thru the broker governor like SempHandler.request (adaptive cap, retry with backoff)
+        """
+        data = json.dumps(json_data) if json_data != None else None
+        attempt = 0
+        async with self.inflight:
+            while True:
+                await self.governor.acquire_async()
+                start = time.monotonic()
+                try:
+                    async with self.session.request(verb, url, params=params, data=data) as r:
+                        body = await r.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    latency = time.monotonic() - start
+                    timeout = isinstance(e, asyncio.TimeoutError)
+                    self.governor.release(latency, congested=timeout)
+                    SempMetrics.Metrics.record(self.rtr_cfg["label"], verb, url, latency, 0, type(e).__name__)
+                    if not self.governor.should_retry(attempt, verb, timeout=timeout,
+                                                      connect_error=isinstance(e, aiohttp.ClientConnectorError)):
+                        raise
+                    reason = type(e).__name__
+                    delay = self.governor.backoff(attempt)
+                else:
+                    latency = time.monotonic() - start
+                    congested = r.status in self.governor.retry_status
+                    self.governor.release(latency, congested)
+                    SempMetrics.Metrics.record(self.rtr_cfg["label"], verb, url, latency, len(body), r.status)
+                    if not (congested and self.governor.should_retry(attempt, verb, r.status)):
+                        return SempResponse(r.status, body, r.headers, r.charset)
+                    reason = r.status
+                    delay = self.governor.backoff(attempt, r.headers.get('Retry-After'))
+                attempt += 1
+                log.info('SEMP {} {} failed ({}). retry {} in {:.2f}s'.format(verb.upper(), url, reason, attempt, delay))
+                if Verbose:
+                    print ('   ! {} {} failed ({}). retry {} in {:.2f}s'.format(verb.upper(), unquote(url), reason, attempt, delay))
+                await asyncio.sleep(delay)
+
+    #-------------------------------------------------------------
+    # http_get
+    #
+    async def http_get(self, url, params=None):
+        if Verbose > 2:
+            print ("Entering {}:{} url: {} params: {}".format( __class__.__name__, inspect.stack()[0][3], url, params))
+        log.info('SEMP GET url: {}'.format(url))
+        resp = await self.request('get', url, params=params)
+        log.info ('SEMP GET returned: {}'.format(resp))
+        if Verbose > 2:
+            print ('http_get returned: {}'.format(json.dumps(resp.json(), indent=4, sort_keys=True)))
+        return resp
+
+    #-------------------------------------------------------------
+    # http_post
+    # returns "OK" or SEMP error status (eg: ALREADY_EXISTS) like SempHandler.http_post
+    #
+    async def http_post(self, url, json_data):
+        if Verbose > 2:
+            print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
+        log.info('SEMP POST url: {}'.format(url))
+        log.debug ('SEMP posting json-data: %s', LazyJson(json_data))
+        resp = await self.request('post', url, json_data=json_data)
+        log.info ('SEMP POST returned: {} {}'.format(resp, resp.error.get('status', 'OK')))
+        log.debug ('SEMP POST response: %s', LazyJson(resp.json()))
+
+        if resp.response_code == 200:
+            if Verbose:
+                print (' http_post returned ', resp.response_code)
+            return "OK"
+        else:
+            print ("         http_post retunred {} ({})".format(resp.response_code, resp.error['status']))
+            if Verbose:
+                print (resp.error['description'])
+            return resp.error['status']
+
+    #-------------------------------------------------------------
+    # http_patch
+    #
+    async def http_patch (self, url, json_data):
+        if Verbose > 2:
+            print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
+        log.info('SEMP PATCH url: {}'.format(url))
+        log.debug ('SEMP patching json-data: %s', LazyJson(json_data))
+        resp = await self.request('patch', url, json_data=json_data)
+        log.info ('SEMP PATCH returned: {} {}'.format(resp, resp.error.get('status', 'OK')))
+        log.debug ('SEMP PATCH response: %s', LazyJson(resp.json()))
+
+        if resp.response_code == 200:
+            if Verbose:
+                print (' http_patch returned ', resp.response_code)
+        else:
+            print ("         http_patch retunred {} ({}) : {}".format(resp.response_code,
+                                                          resp.error['status'],
+                                                          resp.error['description']))
+        return resp
+
+    #-------------------------------------------------------------
+    # http_put
+    #
+    async def http_put(self, url, json_data):
+        if Verbose > 2:
+            print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
+        log.info('SEMP PUT url: {}'.format(url))
+        log.debug('SEMP putting json-data: %s', LazyJson(json_data))
+        resp = await self.request('put', url, json_data=json_data)
+        log.info ('SEMP PUT returned: {}'.format(resp))
+        log.debug ('SEMP PUT response: %s', LazyJson(resp.json()))
+        return resp
+
+    #-------------------------------------------------------------
+    # http_delete
+    #
+    async def http_delete (self, url):
+        if Verbose > 2:
+            print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
+        ignore_status = ['INVALID_PATH']
+        log.info('SEMP DELETE url: {}'.format(url))
+        if Verbose:
+            print("   DELETE URL {} ({})".format(unquote(url), self.rtr_cfg["sempUser"]))
+        resp = await self.request('delete', url)
+        log.info ('SEMP DELETE returned: {}'.format(resp))
+        if (resp.status_code != 200):
+            print ('Non-200 Response text: {}'.format(resp.text))
+            status = resp.error['status']
+            if status in ignore_status:
+                print (f'Ignoring non success status {status}')
+        return resp
+
+    #-------------------------------------------------------------
+    # Higer order functions for get
+    #-------------------------------------------------------------
+
+    async def get_config_json (self, url, collections=False, paging=True, select=None, where=None):
+        """ get vpn object config json (see SempHandler.get_config_json) """
+        if Verbose > 2:
+            print ('Entering {}::{} url = {}'.format(__class__.__name__, inspect.stack()[0][3], url))
+        u_url = unquote(url)
+        resp = await self.http_get(url, self.get_params(url, collections, paging, select, where))
+
+        if (resp.status_code != 200):
+            # failures are summarized at the end of the run (see NegativeCache)
+            log.info(f'**** Get URL {u_url} failed ({resp.status_code}) ****')
+            if Verbose:
+                print(f'**** Get URL {u_url} failed ****')
+                print(resp.text)
+        return resp.json()
+
+    async def process_page_links (self, json_data):
+        """ given json data, traverse thru all links concurrently
+            each link (with its nextPageUri chain) runs as one task, in page order
+        """
+        if Verbose > 2:
+            print ("Entering {}::{}".format( __class__.__name__, inspect.stack()[0][3]))
+        pending = set()
+        for link_url in self.get_page_links(json_data):
+            pending.add(asyncio.create_task(self.get_link_chain(link_url)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                for link_url in t.result():
+                    pending.add(asyncio.create_task(self.get_link_chain(link_url)))
+
+    async def get_link_chain (self, url):
+        """ process one link url and its nextPageUri chain in order (see SempHandler.get_link_chain)
+            returns list of links found on all the pages
+        """
+        if self.skip_link(url):
+            return []
+        # links of leaf collections (object uri only) are not followed
+        leaf = self.schema.is_leaf(url)
+        # a first page saved by the run being resumed is read back: no cheap pass
+        page = self.open_page (url)
+        # incremental capture: pages of the collection rebuilt from the last snapshot (empty: fetch them)
+        pages = deque([] if page[2] else await self.get_incremental_pages (url) or [])
+        json_data = await self.get_page_data (url, True, json_data=pages.popleft() if pages else None, page=page)
+        link_urls = [] if leaf else self.get_page_links (json_data)
+        next_page_uri = self.next_page (json_data)
+        while next_page_uri:
+            json_data = await self.get_page_data (next_page_uri, False, False, pages.popleft() if pages else None)
+            if not leaf:
+                link_urls.extend(self.get_page_links (json_data))
+            next_page_uri = self.next_page (json_data)
+        return link_urls
+
+    async def get_incremental_pages (self, url):
+        """ cheap pass of collection url (see SempHandler.get_incremental_pages)
+            objects with a changed fingerprint are refetched concurrently
+        """
+        select = self.incremental_select (url)
+        if select is None:
+            return None
+        cheap_pages = [await self.get_config_json (url, True, True, select)]
+        next_page_uri = self.next_cheap_page (cheap_pages)
+        while next_page_uri:
+            cheap_pages.append(await self.get_config_json (next_page_uri))
+            next_page_uri = self.next_cheap_page (cheap_pages)
+        if cheap_pages[-1].get('meta', {}).get('responseCode') != 200:
+            return None
+        # snapshot objects are read off the event loop
+        rebuilt = await asyncio.to_thread(self.incremental.rebuild, url, cheap_pages, select)
+        if rebuilt is None:
+            return None
+        pages, changed = rebuilt
+        responses = await asyncio.gather(*(self.get_config_json (uri) for _, _, uri in changed))
+        return self.incremental.complete(url, pages, changed, responses)
+
+    async def get_page_data (self, url, collection, paging=True, json_data=None, page=None):
+        """ get one page of link url and save it under out_dir
+            json_data: page already at hand (incremental capture), saved without a GET
+            page: open_page() of url, if the caller already has it
+        """
+        obj, outfile, resumed = page or self.open_page (url)
+        if resumed:
+            json_data = await asyncio.to_thread(json_h.read_json_file, unquote(outfile))
+            self.add_page (url, outfile, json_data)
+            return json_data
+
+        if json_data is None:
+            select, where = self.page_query (url, obj, collection)
+            json_data = await self.get_config_json (url, collection, paging, select, where)
+            if not self.page_fetched (url, outfile, json_data):
+                return json_data
+        elif not self.keep_page (url, outfile, json_data):
+            return json_data
+
+        on_done = self.on_saved (url, outfile, json_data)
+        if self.writer:
+            # checkpoint is marked by the writer once the file is on disk
+            if not self.writer.write (outfile, json_data, on_done, block=False):
+                # queue full: wait for room off the event loop
+                await asyncio.to_thread(self.writer.write, outfile, json_data, on_done)
+        else:
+            # file i/o off the event loop
+            await asyncio.to_thread(json_h.save_config_json, outfile, json_data)
+            if on_done:
+                on_done()
+        self.add_page (url, outfile, json_data)
+        return json_data
@@ -0,0 +1,174 @@
+##############################################################################
+# CaptureOutput
+#   Output formats for VPN captures (get-vpn-config)
+#   Page format (set before the crawl):
+#     json    - one pretty printed, key sorted file per page (default)
+#     compact - one compact file per page
+#     ndjson  - after the crawl, pages are folded into one .ndjson file per
+#               object type (eg: queues.subscriptions.ndjson), one SEMP
+#               object per line, and the page files are removed
+#   Archive (after the vpn is parsed): the vpn output dir is streamed into
+#   one zip / tar.gz / tar.zst file next to it and the dir is removed
+#   extract_archive() unpacks one for rebuild-vpn-config
+#   clear_capture() empties the vpn output dir before a new (not resumed) crawl
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import json
+import shutil
+import tarfile
+import inspect
+from zipfile import ZipFile, ZIP_DEFLATED
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+from common.CrawlCheckpoint import read_manifest
+from common.SempSchema import url_segments
+from common.ConfigParser import PageFile
+
+Verbose = 0
+Formats = ['json', 'compact', 'ndjson']
+Archives = {'none': None, 'zip': '.zip', 'tgz': '.tar.gz', 'tzst': '.tar.zst'}
+
+def set_page_format(fmt):
+    """ how crawled pages are written (JsonHandler.save_config_json). ndjson pages are staged compact """
+    if fmt == 'json':
+        JsonHandler.JsonHandler.DumpArgs = {'indent': 4, 'sort_keys': True}
+    else:
+        JsonHandler.JsonHandler.DumpArgs = {'separators': (',', ':'), 'sort_keys': True}
+
+def check_archive(kind):
+    """ raise if archive kind needs a module that is not installed """
+    if kind == 'tzst' and zstandard is None:
+        raise RuntimeError('tzst archive requires zstandard module (pip install zstandard)')
+
+
+def page_order(files):
+    """ page files in SEMP order: collections as first crawled (manifest order), pages of one
+        collection by page number (queues.json, queues-1.json, ..., queues-10.json)
+    """
+    dirs = {}
+    for page_file in files:
+        dirs.setdefault(os.path.dirname(page_file), len(dirs))
+    def key(page_file):
+        m = PageFile.match(os.path.basename(page_file))
+        return dirs[os.path.dirname(page_file)], int(m.group(2) or 0) if m else 0
+    return sorted(files, key=key)
+
+def clear_capture(out_dir):
+    """ remove what an earlier capture left in the vpn output dir
+        pages it had and this run doesn't save again would be read as part of this capture
+    """
+    if not os.path.isdir(out_dir):
+        return
+    n = 0
+    with os.scandir(out_dir) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+            n += 1
+    if n:
+        print ('   Removed {} files / dirs of the last capture in {}'.format(n, out_dir))
+
+def write_ndjson(out_dir, manifest_file, verbose=0):
+    """ fold captured pages of a vpn into one ndjson file per object type. returns list of files written
+        pages are taken from the crawl manifest (see CrawlCheckpoint), so only this run's pages are used
+    """
+    global Verbose
+    Verbose = verbose
+    if Verbose > 2:
+        print ('Entering {} out_dir: {}'.format(inspect.stack()[0][3], out_dir))
+    json_h = JsonHandler.JsonHandler()
+    types = {}   # object type path -> page files
+    for url, entry in read_manifest(manifest_file).items():
+        segs = url_segments(url)
+        if entry['status'] != 'done' or not segs or not os.path.exists(entry['file']):
+            continue  # vpn.json (no segments) stays as is
+        types.setdefault('.'.join(segs[0::2]), []).append(entry['file'])
+
+    ndjson_files = []
+    for obj_type, files in sorted(types.items()):
+        ndjson_file = '{}/{}.ndjson'.format(out_dir, obj_type)
+        n = 0
+        with open(ndjson_file, 'w') as fp:
+            for page_file in page_order(files):
+                for obj in json_h.read_json_file(page_file).get('data', []):
+                    fp.write(json.dumps(obj, separators=(',', ':'), sort_keys=True))
+                    fp.write('\n')
+                    n += 1
+        print ('   + Writing {} ({} objects from {} pages)'.format(ndjson_file, n, len(files)))
+        ndjson_files.append(ndjson_file)
+
+    # page files (and the dirs they leave empty) are no longer needed
+    for files in types.values():
+        for page_file in files:
+            os.remove(page_file)
+    for root, dirs, files in os.walk(out_dir, topdown=False):
+        if root != out_dir and not os.listdir(root):
+            os.rmdir(root)
+    return ndjson_files
+
+
+def archive_dir(out_dir, kind):
+    """ stream out_dir into one archive next to it (<out_dir>.zip / .tar.gz / .tar.zst) and remove out_dir
+        returns archive file name
+    """
+    ext = Archives[kind]
+    archive_file = out_dir.rstrip('/') + ext
+    arc_root = os.path.basename(out_dir.rstrip('/'))
+    tmp_file = archive_file + '.tmp'
+    if kind == 'zip':
+        with ZipFile(tmp_file, 'w', ZIP_DEFLATED) as zf:
+            for root, dirs, files in os.walk(out_dir):
+                dirs.sort()
+                for fname in sorted(files):
+                    path = os.path.join(root, fname)
+                    zf.write(path, os.path.join(arc_root, os.path.relpath(path, out_dir)))
+    elif kind == 'tgz':
+        with tarfile.open(tmp_file, 'w|gz') as tf:
+            tf.add(out_dir, arcname=arc_root)
+    else:
+        check_archive(kind)
+        with open(tmp_file, 'wb') as fp:
+            with zstandard.ZstdCompressor().stream_writer(fp) as zw:
+                with tarfile.open(fileobj=zw, mode='w|') as tf:
+                    tf.add(out_dir, arcname=arc_root)
+    os.replace(tmp_file, archive_file)
+    shutil.rmtree(out_dir)
+    print ('   + Archived {} to {}'.format(out_dir, archive_file))
+    return archive_file
+
+
+def extract_archive(archive_file, dest_dir):
+    """ unpack a capture archive made by archive_dir into dest_dir. returns the vpn dir in it """
+    if archive_file.endswith('.zip'):
+        with ZipFile(archive_file) as zf:
+            zf.extractall(dest_dir)
+    elif archive_file.endswith('.tar.zst'):
+        check_archive('tzst')
+        with open(archive_file, 'rb') as fp:
+            with zstandard.ZstdDecompressor().stream_reader(fp) as zr:
+                with tarfile.open(fileobj=zr, mode='r|') as tf:
+                    extract_tar(tf, dest_dir)
+    else:
+        with tarfile.open(archive_file, 'r|*') as tf:
+            extract_tar(tf, dest_dir)
+    dirs = [d for d in os.listdir(dest_dir) if os.path.isdir(os.path.join(dest_dir, d))]
+    if len(dirs) != 1:
+        raise RuntimeError('{} is not a vpn capture archive'.format(archive_file))
+    return os.path.join(dest_dir, dirs[0])
+
+def extract_tar(tf, dest_dir):
+    # data filter (python 3.11.4+) refuses links / paths outside dest_dir
+    if hasattr(tarfile, 'data_filter'):
+        tf.extractall(dest_dir, filter='data')
+    else:
+        tf.extractall(dest_dir)
@@ -0,0 +1,164 @@
+##############################################################################
+# ConfigAssembler
+#   Builds the consolidated VPN config (<vpn>-all.json) from pages as they
+#   are crawled, so get-vpn-config doesn't read the output tree back from disk
+#   (see ConfigParser for that). Pages are kept per collection path in page
+#   order; assemble() then follows the links from the vpn object down:
+#   all pages of an object type (eg: subscriptions of every queue) are merged
+#   into one {data, links} node under the node of its parent type
+#   stream mode keeps only the links and page file of each page: data is read
+#   back one page at a time by save_config(), so memory stays bounded on very
+#   large vpns
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import json
+import inspect
+import threading
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.abspath("."))
+from common.SempSchema import SempSchema, url_segments
+from common.JsonHandler import load_json_file
+
+Verbose = 0
+
+class PageList():
+    """ data of one object type in stream mode: pages in order, each an in memory
+        data list or a page file that is read when iterated
+    """
+
+    def __init__(self):
+        self.pages = []
+
+    def add(self, page):
+        self.pages.append(page)
+
+    def __iter__(self):
+        for page in self.pages:
+            if 'file' in page:
+                data = load_json_file(page['file']).get('data')
+            else:
+                data = page['data']
+            yield from data or []
+
+def dumps(value, level):
+    """ json.dumps(indent=4, sort_keys=True) of value nested at level """
+    text = json.dumps(value, indent=4, sort_keys=True)
+    return text.replace('\n', '\n' + '    ' * level) if level else text
+
+def write_value(fp, value, level):
+    """ write value as json.dump(indent=4, sort_keys=True) would. PageList data is written one object at a time """
+    if isinstance(value, dict) and value:
+        sep = '{'
+        for key in sorted(value):
+            fp.write('{}\n{}{}: '.format(sep, '    ' * (level+1), json.dumps(key)))
+            write_value(fp, value[key], level+1)
+            sep = ','
+        fp.write('\n{}}}'.format('    ' * level))
+    elif isinstance(value, PageList):
+        sep = '['
+        for obj in value:
+            fp.write('{}\n{}{}'.format(sep, '    ' * (level+1), dumps(obj, level+1)))
+            sep = ','
+        fp.write('[]' if sep == '[' else '\n{}]'.format('    ' * level))
+    else:
+        fp.write(dumps(value, level))
+
+def save_config(outfile, cfg):
+    """ save consolidated config (same file as JsonHandler.save_json_file) without building it as one string """
+    outfile = unquote(outfile)
+    if os.path.exists(outfile):
+        print ("   Overwriting {}".format( outfile))
+    else:
+        print ("   + Writing to {}".format(outfile))
+    with open(outfile, 'w') as fp:
+        write_value(fp, cfg, 0)
+
+
+class ConfigAssembler():
+    """ In memory consolidated VPN config fed by the crawler """
+
+    def __init__(self, cfg, verbose=0, stream=False, schema=None):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} stream: {}'.format(__class__.__name__, inspect.stack()[0][3], stream))
+        # SEMP object tree: which collections are leaves
+        if schema is None:
+            schema = SempSchema(cfg["system"]["semp"].get("schemaFile"), verbose)
+        self.schema = schema
+        self.stream = stream
+        self.pages = {}   # collection path segments -> [{data | file, links}] in page order
+        self.reused = None  # incremental capture: snapshot the reused pages come from
+        self.lock = threading.Lock()
+
+    def add_page(self, url, json_data, outfile=None):
+        """ keep page of collection url saved in outfile. pages of one collection must come in page order """
+        if json_data.get('meta', {}).get('responseCode') != 200:
+            return
+        key = tuple(url_segments(url))
+        if self.stream and outfile:
+            page = {'file': unquote(outfile), 'links': json_data.get('links')}
+        else:
+            page = {'data': json_data.get('data'), 'links': json_data.get('links')}
+        if json_data['meta'].get('reused'):
+            page['reused'] = json_data['meta']['reused']
+        with self.lock:
+            self.pages.setdefault(key, []).append(page)
+
+    def assemble(self, vpn_data):
+        """ return consolidated config of vpn ({data, links} of vpn.json) with all collected pages """
+        if Verbose > 2:
+            print ('Entering {}::{} pages: {}'.format(__class__.__name__, inspect.stack()[0][3], len(self.pages)))
+        cfg = {'data': vpn_data['data'], 'links': vpn_data.get('links')}
+        self.add_links(cfg, cfg['links'])
+        self.pages = {}
+        self.mark_reused(cfg)
+        return cfg
+
+    def mark_reused(self, cfg):
+        """ meta.incremental of consolidated config with pages rebuilt from a snapshot (not read from the broker) """
+        if self.reused:
+            cfg['meta'] = {'incremental': self.reused}
+        self.reused = None
+
+    def get_pages(self, segs):
+        """ pages of collection path segments, in page order """
+        return self.pages.get(tuple(segs))
+
+    def add_links(self, node, links):
+        if not links:
+            return
+        for link_dict in (links if type(links) is list else [links]):
+            self.add_link_dict(node, link_dict)
+
+    def add_link_dict(self, node, link_dict):
+        """ merge pages of the collections in the links of one object into node """
+        for name, link in link_dict.items():
+            # self link of the object. the other links are its collections
+            if name == 'uri':
+                continue
+            segs = url_segments(link)
+            pages = self.get_pages(segs)
+            if not pages:
+                continue
+            obj_type = segs[-1]
+            # objects of leaf collections (eg: subscriptions) have nothing below them
+            leaf = self.schema.is_leaf(link)
+            for page in pages:
+                if page.get('reused'):
+                    self.reused = dict(page['reused'], reusedPages=(self.reused or {}).get('reusedPages', 0) + 1)
+                if obj_type not in node:
+                    if Verbose:
+                        print ('   > Creating {} {} in config'.format(segs[-2] if len(segs) > 1 else '', obj_type))
+                    # own list: page data may still be queued for the writer
+                    node[obj_type] = {'data': PageList() if self.stream else [], 'links': page['links']}
+                if self.stream:
+                    node[obj_type]['data'].add(page)
+                else:
+                    node[obj_type]['data'].extend(page['data'] or [])
+                if not leaf:
+                    self.add_links(node[obj_type], page['links'])
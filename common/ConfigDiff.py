@@ -0,0 +1,129 @@
+##############################################################################
+# ConfigDiff
+#   Compare two consolidated VPN configs (<vpn>-all.json / ConfigParser output)
+#   Every object is keyed by its SEMP identity: the key attributes of its type
+#   and of its parent types (from semp-schema.yaml, eg: queueName +
+#   subscriptionTopic for queues/subscriptions), indexed per object type and
+#   compared in one pass. Differences are yielded one object at a time:
+#     {op: added | removed | changed, type, id, object | attrs: {attr: [old, new]}}
+#   Attributes in ignore (eg: msgVpnName, to compare DEV and PROD vpns) are
+#   left out of identities and comparisons
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import json
+import inspect
+
+sys.path.insert(0, os.path.abspath("."))
+from common.SnapshotStore import VpnKey
+
+Verbose = 0
+
+def walk_types(cfg, type_path=()):
+    """ yield (type path, objects) for every object type in consolidated config node, parents first """
+    for name in sorted(cfg):
+        node = cfg[name]
+        if name in ('data', 'links', 'meta') or not isinstance(node, dict):
+            continue
+        yield type_path + (name,), node.get('data') or []
+        yield from walk_types(node, type_path + (name,))
+
+
+class ConfigDiff():
+    """ Identity indexed diff of consolidated VPN configs """
+
+    def __init__(self, schema, ignore=None, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} ignore: {}'.format(__class__.__name__, inspect.stack()[0][3], ignore))
+        self.schema = schema
+        self.ignore = set(ignore or [])
+        self.keys = {}    # type path -> key attributes per level (None: not in schema)
+        self.counts = {}  # type -> {added, removed, changed}
+
+    def level_keys(self, type_path):
+        if type_path not in self.keys:
+            self.keys[type_path] = [self.schema.key(type_path[:i+1]) for i in range(len(type_path))]
+        return self.keys[type_path]
+
+    def identity(self, type_path, obj):
+        """ queues/Q1/subscriptions/a/> style identity of obj """
+        parts = []
+        used = set(self.ignore)
+        for name, key in zip(type_path, self.level_keys(type_path)):
+            if key is None:
+                # type not in schema: name attributes not used by the parents
+                key = sorted(a for a in obj if a.endswith('Name') and a not in used)
+            used.update(key)
+            if key:
+                value = ','.join(str(obj.get(a, '')) for a in key)
+            else:
+                value = json.dumps({a: v for a, v in obj.items() if a not in self.ignore}, sort_keys=True)
+            parts += [name, value]
+        return '/'.join(parts)
+
+    def index(self, type_path, objects):
+        """ identity -> object """
+        index = {}
+        for obj in objects:
+            obj_id = self.identity(type_path, obj)
+            if obj_id in index:
+                # same identity twice (key guessed for a type not in schema). keep both
+                n = 2
+                while '{}#{}'.format(obj_id, n) in index:
+                    n += 1
+                obj_id = '{}#{}'.format(obj_id, n)
+            index[obj_id] = obj
+        return index
+
+    def changed_attrs(self, old, new):
+        """ {attr: [old, new]} of attributes that differ (None: attribute not there) """
+        if old == new:
+            return {}
+        return {a: [old.get(a), new.get(a)] for a in sorted(set(old) | set(new))
+                if a not in self.ignore and old.get(a) != new.get(a)}
+
+    def count(self, type_name, op):
+        counts = self.counts.setdefault(type_name, {'added': 0, 'removed': 0, 'changed': 0})
+        counts[op] += 1
+
+    def diff(self, old_cfg, new_cfg):
+        """ yield differences between two consolidated configs, by object type, in identity order """
+        attrs = self.changed_attrs(old_cfg.get('data') or {}, new_cfg.get('data') or {})
+        if attrs:
+            self.count(VpnKey, 'changed')
+            yield {'op': 'changed', 'type': VpnKey, 'id': VpnKey, 'attrs': attrs}
+
+        old_types = dict(walk_types(old_cfg))
+        new_types = dict(walk_types(new_cfg))
+        for type_path in sorted(set(old_types) | set(new_types)):
+            type_name = '/'.join(type_path)
+            old_index = self.index(type_path, old_types.get(type_path, []))
+            new_index = self.index(type_path, new_types.get(type_path, []))
+            if Verbose:
+                print ('   {}: {} -> {} objects'.format(type_name, len(old_index), len(new_index)))
+            for obj_id in sorted(set(old_index) | set(new_index)):
+                old = old_index.get(obj_id)
+                new = new_index.get(obj_id)
+                if old is None:
+                    self.count(type_name, 'added')
+                    yield {'op': 'added', 'type': type_name, 'id': obj_id, 'object': new}
+                elif new is None:
+                    self.count(type_name, 'removed')
+                    yield {'op': 'removed', 'type': type_name, 'id': obj_id, 'object': old}
+                else:
+                    attrs = self.changed_attrs(old, new)
+                    if attrs:
+                        self.count(type_name, 'changed')
+                        yield {'op': 'changed', 'type': type_name, 'id': obj_id, 'attrs': attrs}
+
+    def summary(self):
+        lines = ['   {:<56} {:>8} {:>8} {:>8}'.format('type', 'added', 'removed', 'changed')]
+        for type_name, counts in sorted(self.counts.items()):
+            lines.append('   {:<56} {:>8} {:>8} {:>8}'.format(type_name, counts['added'], counts['removed'], counts['changed']))
+        totals = [sum(c[op] for c in self.counts.values()) for op in ('added', 'removed', 'changed')]
+        lines.append('   {:<56} {:>8} {:>8} {:>8}'.format('total', *totals))
+        return '\n'.join(lines)
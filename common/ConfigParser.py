@@ -1,167 +1,160 @@
 ###########################################################################################
 # ConfigParser
 #    Solace Config Parser implementation
+#    Builds the consolidated VPN config (<vpn>-all.json) from a captured output tree.
+#    The tree is indexed once (one os.scandir walk: dir -> page files in page order)
+#    and links are resolved against the index, so no file is looked for that isn't there
+#    Only the pages the crawl manifest (CrawlCheckpoint) has as done are indexed, when there is one
+#    Merging is done as in ConfigAssembler (same result as building it during the crawl)
+#    stream mode keeps only the links of each page; data is read again by save_config()
+#    With procs > 1 page files are decoded by a process pool (one task per collection,
+#    so pages stay in order) before the walk. orjson is used when installed
 #
 # Ramesh Natarajan (nram@nram.dev)
 ###########################################################################################
 
 import sys, os
-import argparse
+import re
 import pprint
-import json
-import requests
 import inspect
-import shutil
-import urllib
-import pathlib
-from requests.auth import HTTPBasicAuth
-from zipfile import ZipFile
-# from os.path import basename
-from datetime import datetime
-from urllib.parse import unquote # for Python 3.7
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.insert(0, os.path.abspath("."))
 from common import JsonHandler
+from common.ConfigAssembler import ConfigAssembler
+from common.CrawlCheckpoint import read_manifest
+from common.SempSchema import url_segments
 
 
 Verbose = 0
 Cfg = {}
-
-class ConfigParser:
+pp = pprint.PrettyPrinter(indent=4)
+PageFile = re.compile(r'^(.*?)(?:-(\d+))?\.json$') # queues.json, queues-1.json, ...
+
+def manifest_pages(manifest_file):
+    """ page files (relative to the vpn output dir) the crawl manifest has as done. None without a manifest
+        the vpn object page (vpn.json) is in the vpn output dir, which may have been moved since (archive)
+    """
+    if not os.path.exists(manifest_file):
+        return None
+    entries = [e for e in read_manifest(manifest_file).values() if e['status'] == 'done']
+    vpn_dir = next((os.path.dirname(e['file']) for e in entries if not url_segments(e['url'])), None)
+    if vpn_dir is None:
+        return None
+    return set(os.path.relpath(e['file'], vpn_dir) for e in entries)
+
+def index_capture(base_path, page_files=None):
+    """ walk capture dir once. returns {dir relative to base_path: {obj_type: [page files in page order]}}
+        page files of a collection are <obj_type>.json, <obj_type>-1.json, ... in the collection dir
+        page_files: page files to index (manifest_pages()). files not in it are left by another capture
+    """
+    index = {}
+    dirs = ['']
+    while dirs:
+        rel_dir = dirs.pop()
+        pages = {}
+        with os.scandir(os.path.join(base_path, rel_dir)) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(os.path.join(rel_dir, entry.name))
+                    continue
+                m = PageFile.match(entry.name)
+                if m is None or m.group(1) != os.path.basename(rel_dir):
+                    continue
+                if page_files is not None and os.path.join(rel_dir, entry.name) not in page_files:
+                    if Verbose:
+                        print ('   Skipping {} (not in crawl manifest)'.format(entry.path))
+                    continue
+                pages.setdefault(m.group(1), []).append((int(m.group(2) or 0), entry.path))
+        if pages:
+            index[rel_dir] = {obj_type: [f for _, f in sorted(files)] for obj_type, files in pages.items()}
+    return index
+
+
+def read_pages(files, stream=False):
+    """ decode page files of one collection (runs in pool workers too)
+        returns [(file, {data | file, links})], page is None if file has no data
+    """
+    pages = []
+    for json_file in files:
+        page = JsonHandler.load_json_file(json_file)
+        if 'data' not in page:
+            pages.append((json_file, None))
+            continue
+        if stream:
+            entry = {'file': json_file, 'links': page.get('links')}
+        else:
+            entry = {'data': page['data'], 'links': page.get('links')}
+        # page rebuilt from a snapshot by an incremental capture
+        if (page.get('meta') or {}).get('reused'):
+            entry['reused'] = page['meta']['reused']
+        pages.append((json_file, entry))
+    return pages
+
+
+class ConfigParser (ConfigAssembler):
     """ Solace Config Parser implementation """
 
-    def __init__(self, cfg, verbose = 0):
+    def __init__(self, cfg, verbose = 0, stream = False, procs = 1):
         global Verbose
         global Cfg
         Verbose = verbose
         Cfg = cfg
         if Verbose > 2:
             print ('Entering {}::{}'.format(__class__.__name__, inspect.stack()[0][3]))
-        self.json_h = JsonHandler.JsonHandler()
+        ConfigAssembler.__init__(self, cfg, verbose, stream)
+        self.index = {}
+        self.procs = procs
+        self.decoded = {}  # (dir, obj_type) -> read_pages() result from the process pool
+        self.n_files = 0
 
     def cfg_parse (self, obj, path, cfg) :
-        """ parse cfg recursively """
+        """ add config of all links in cfg (eg: {data, links} of vpn.json) from the capture in dir path """
 
         if 'links' not in cfg:
             print ("No links to process in cfg")
             return cfg
-        links = cfg['links']
         if Verbose > 2:
             print ("Entering {}::{} obj = {} path = {}".format( __class__.__name__, inspect.stack()[0][3], obj, path))
-
+        manifest_file = os.path.join(path, Cfg.get('system', {}).get('system', {}).get('checkpointFile', 'crawl-checkpoint.jsonl'))
+        self.index = index_capture(path, manifest_pages(manifest_file))
+        if Verbose:
+            print ('Indexed {} collection dirs in {}'.format(len(self.index), path))
+        if self.procs > 1:
+            self.decode_all()
+        self.add_links(cfg, cfg['links'])
+        self.decoded = {}
+        self.mark_reused(cfg)
         if Verbose:
-            print ('Processing object {} path: {}'. format(obj, path))
-            print ('Number of links: {}'. format(len(links)))
-        # loop thru link and parse recursively
-        if links:
-            if Verbose > 2:
-                print("cfg_parse: Processing Links {}".format(links))
-            if type(links) is list:
-                for link in links:
-                    self.parse_links ( obj,path, link, cfg)
-            else:
-                self.parse_links (obj, path, links, cfg)
+            print ('Read {} json files for {}'.format(self.n_files, obj))
         return cfg
 
-
-    def parse_links (self, base_obj, base_path, links, cfg):
-        """ parse list of links to broker with corresponding json payload """
-
-        if Verbose > 2:
-            print ("Entering {}::{} obj = {} path = {} ".format( __class__.__name__, inspect.stack()[0][3], base_obj, base_path))
-        if Verbose > 2:
-            print ('Processing Links'); pp.pprint(links)
-
-        for _, link in links.items():
-            #op, obj_type = os.path.split(link)
-            a = link.split('/')
-            obj_type = unquote(a[len(a)-1])
-            obj = unquote(a[len(a)-2])
-            link = unquote(link)
-            #print ('parse_links:Processing object: {} ({}) Link: {}'.format(obj, obj_type, link))
-
-            # base path: ../out/json/localhost/test-vpn
-            # link: http://localhost:8080/SEMP/v2/config/msgVpns/test-vpn/aclProfiles/#acl-profile/clientConnectExceptions
-            # obj_type: clientConnectExceptions
-            # obj: #acl-profile (can also be "test-vpn" in top level see HACK below)
-
-            sys_cfg = Cfg["system"]
-            # TODO: This endsup looking for far too many json files that will never be found
-            # some of them leading to invalid path. 
-            # fix to prevent that -- need more tighter control.
-            if obj in sys_cfg["semp"]['leafNode']:
-                if Verbose:
-                    print ('Leaf object {}. skip'.format(obj))
-                return
-
-            if Verbose:
-                print ('Parsing object: {} {}'.format(obj, obj_type))
-                print ('link: {} base_bath: {}'.format(link, base_path))
-
-            #if obj in SysCfg['skipObjects']:
-            #    print ('   - Skipping object:  {}'.format(obj))
-            #    continue
-            path="{}/{}".format(base_path, obj_type)
-
-            #json_file = unquote("{}/{}.json".format(path, obj))
-            if Verbose > 2:
-                print ('<1> Looking for <{}*.json> files in {} obj: {} type: {}'.format(obj_type, path, obj, obj_type))
-            try:
-                json_files = list(pathlib.Path(path).glob('{}*.json'.format(obj_type)))
-
-                # HACK - try one level below
-                if len(json_files) == 0:
-                    path="{}/{}/{}".format(base_path, obj, obj_type)
-                    if Verbose > 2:
-                        print ('<2> Looking for <{}*.json> files in {} obj: {} type: {}'.format(obj_type, path, obj, obj_type))
-
-            # protect agains unparsable path
-            except Exception as e:
-                print ()
-                print ("#################################################################################")
-                print ('### Unable to read json files in {}'.format(path))
-                print ('### Exception: {}'.format(e))
-                print ("#################################################################################")
-                return
-            
-            # files read .. process them
-            json_files = list(pathlib.Path(path).glob('{}*.json'.format(obj_type)))
-
+    def decode_all (self):
+        """ decode every indexed collection across a process pool """
+        keys = [(rel_dir, obj_type) for rel_dir, types in self.index.items() for obj_type in types]
+        file_lists = [self.index[rel_dir][obj_type] for rel_dir, obj_type in keys]
+        # small collections (eg: subscriptions of one queue) are sent to workers in batches
+        chunksize = max(1, len(keys) // (self.procs * 8))
+        with ProcessPoolExecutor(max_workers=self.procs) as pool:
+            results = pool.map(read_pages, file_lists, repeat(self.stream), chunksize=chunksize)
+            self.decoded = dict(zip(keys, results))
+
+    def get_pages (self, segs):
+        """ pages of collection path segments from the capture """
+        rel_dir = os.path.join(*segs) if segs else ''
+        obj_type = segs[-1] if segs else ''
+        files = self.index.get(rel_dir, {}).get(obj_type, [])
+        decoded = self.decoded.pop((rel_dir, obj_type), None)
+        if decoded is None:
+            decoded = read_pages(files, self.stream)
+        pages = []
+        for json_file, page in decoded:
             if Verbose:
-                print ('Found {} {}/*.json files in {}'.format (len(json_files), obj_type, path))
-            if Verbose > 2:
-                print ('List of json files :'); pp.pprint(json_files)
-            
-            for json_file in sorted(json_files):
-                if Verbose:
-                    print ('   Reading file {} ({})'.format(json_file, obj))
-                this_obj = self.json_h.read_json_data(json_file)
-
-                # add this object to base object
-                if Verbose > 2:
-                    print('cfg keys: ', cfg.keys())
-                    #print ('JSON:'); pp.pprint(cfg)
-                if obj_type in cfg:
-                    if Verbose:
-                        print ('   + Adding {} {} to config'.format(obj, obj_type))
-                    #pp.pprint(cfg[obj])
-                    for d in this_obj['data']:
-                        cfg[obj_type]['data'].append(d)
-                    #for l in this_obj['links']:
-                    #    cfg[obj_type]['links'].append(l)
-                else:
-                    if Verbose:
-                        print ('   > Creating {} {} in config'.format(obj, obj_type))
-                    cfg[obj_type] = this_obj
-
-                if Verbose > 2:
-                    print('... This object'); pp.pprint(this_obj)
-                    #print('--- cfg: '); pp.pprint(cfg)
-
-                if len(this_obj['data']) == 0 and len(this_obj['links']) == 0:
-                    if Verbose:
-                        print ('No data or links in {}'.format(json_file))
-                    continue
-                self.cfg_parse (base_obj, path, this_obj)
-            #else:
-            #    log.info("No JSON file %s", json_file)
\ No newline at end of file
+                print ('   Reading file {}'.format(json_file))
+            self.n_files += 1
+            if page is None:
+                print ("ERROR: Invalid json file: {}".format(json_file))
+                continue
+            pages.append(page)
+        return pages
@@ -0,0 +1,93 @@
+##############################################################################
+# CrawlCheckpoint
+#   Append-only checkpoint manifest for SEMP config crawl
+#   One json line per captured page: url -> output file, status
+#   Page files are written atomically (JsonHandler), so a page marked done is complete
+#   A resumed crawl reads captured pages back from disk instead of GETing them again
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import os
+import json
+import inspect
+import threading
+from urllib.parse import unquote
+
+Verbose = 0
+
+def read_manifest(manifest_file):
+    """ read manifest: url -> entry. last entry for an url wins. ignores a partly written last line """
+    pages = {}
+    with open(manifest_file, 'r') as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            pages[entry['url']] = entry
+    return pages
+
+
+class CrawlCheckpoint():
+    """ Crawl checkpoint manifest """
+
+    def __init__(self, manifest_file, resume=False, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} file: {} resume: {}'.format(__class__.__name__, inspect.stack()[0][3], manifest_file, resume))
+        self.manifest_file = manifest_file
+        self.pages = {}   # url -> manifest entry
+        self.lock = threading.Lock()
+        self.n_resumed = 0
+        self.n_saved = 0
+
+        path = os.path.dirname(manifest_file)
+        if path:
+            os.makedirs(path, exist_ok=True)
+        if resume and os.path.exists(manifest_file):
+            self.load()
+            print ("   Resuming crawl from checkpoint {} ({} pages)".format(manifest_file, len(self.pages)))
+        mode = 'a' if resume else 'w'
+        self.fp = open(manifest_file, mode)
+        # terminate a partly written last line left by a crashed run
+        if resume and self.fp.tell() > 0:
+            with open(manifest_file, 'rb') as fp:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    self.fp.write('\n')
+
+    def load(self):
+        self.pages = read_manifest(self.manifest_file)
+
+    def is_done(self, url, outfile):
+        """ true if url was captured to outfile by an earlier run and the file is still there """
+        entry = self.pages.get(url)
+        if entry is None or entry['status'] != 'done':
+            return False
+        if entry['file'] != unquote(outfile) or not os.path.exists(entry['file']):
+            return False
+        with self.lock:
+            self.n_resumed += 1
+        return True
+
+    def mark(self, url, outfile, json_data):
+        """ record captured page. non-200 pages are marked failed and fetched again on resume """
+        meta_data = json_data.get('meta', {})
+        entry = {
+            'url': url,
+            'file': unquote(outfile),
+            'status': 'done' if meta_data.get('responseCode') == 200 else 'failed',
+        }
+        with self.lock:
+            self.pages[url] = entry
+            self.fp.write(json.dumps(entry) + '\n')
+            self.fp.flush()
+            self.n_saved += 1
+
+    def close(self):
+        self.fp.close()
+
+    def summary(self):
+        return 'Checkpoint: {} pages resumed from disk, {} pages fetched'.format(self.n_resumed, self.n_saved)
@@ -0,0 +1,180 @@
+##############################################################################
+# CrawlScope
+#   Include / exclude filters for SEMP config crawl
+#   Filters are object types (collection names) with optional object name
+#   globs, eg: "queues", "queues:ORDERS.*", "aclProfiles:app-*"
+#   Checked before a request is sent, so out of scope subtrees are never
+#   fetched. Name globs are also sent as SEMP where= conditions on the
+#   collection GET where they map (eg: queueName==ORDERS*), so out of scope
+#   objects are not fetched either. Globs that can't be sent (?, [...], more
+#   than one include) are applied to the collection pages before they are saved
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import inspect
+import threading
+from fnmatch import fnmatchcase
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.abspath("."))
+from common.SempSchema import url_segments
+
+Verbose = 0
+
+def parse_filters(specs):
+    """ ["queues:ORDERS.*,aclProfiles", "queues:PAY.*"] -> {queues: [ORDERS.*, PAY.*], aclProfiles: [*]}
+        an object type given without a name glob matches all its objects
+    """
+    filters = {}
+    for spec in specs or []:
+        for item in str(spec).split(','):
+            item = item.strip()
+            if not item:
+                continue
+            obj_type, _, name = item.partition(':')
+            globs = filters.setdefault(obj_type, [])
+            if not name:
+                globs.append('*')
+            elif name not in globs:
+                globs.append(name)
+    return filters
+
+def match_name(globs, name):
+    return any(fnmatchcase(name, g) for g in globs)
+
+def semp_glob(glob):
+    """ True if name glob can be a SEMP where value: only * wildcards (no ?, [...]) """
+    return glob != '*' and not any(c in glob for c in '?[]')
+
+
+class CrawlScope():
+    """ Crawl include / exclude filters
+        include: object types directly under the VPN to crawl (with their subtree). empty = all
+        exclude: object types to skip at any depth (with their subtree)
+    """
+
+    def __init__(self, include=None, exclude=None, verbose=0):
+        global Verbose
+        Verbose = verbose
+        self.include = parse_filters(include)
+        self.exclude = parse_filters(exclude)
+        if Verbose > 2:
+            print ('Entering {}::{} include: {} exclude: {}'.format(__class__.__name__, inspect.stack()[0][3], self.include, self.exclude))
+        self.skipped = {}  # reason -> count
+        self.lock = threading.Lock()
+
+    def is_set(self):
+        return bool(self.include or self.exclude)
+
+    def reason(self, segs):
+        """ return reason string if path segments [collection, object, ...] are out of scope, None if in scope """
+        if not segs:
+            return None
+        if self.include:
+            globs = self.include.get(segs[0])
+            if globs is None:
+                return 'not included {}'.format(segs[0])
+            if len(segs) > 1 and not match_name(globs, segs[1]):
+                return 'not included {}:{}'.format(segs[0], segs[1])
+        for i in range(0, len(segs), 2):
+            globs = self.exclude.get(segs[i])
+            if globs is None:
+                continue
+            if i + 1 >= len(segs):
+                if '*' in globs:
+                    return 'excluded {}'.format(segs[i])
+            elif match_name(globs, segs[i+1]):
+                return 'excluded {}:{}'.format(segs[i], segs[i+1])
+        return None
+
+    def check(self, url):
+        """ return reason string if url must not be requested, None if ok """
+        if not self.is_set():
+            return None
+        reason = self.reason(url_segments(url))
+        if reason:
+            # count by object type, not by object name
+            key = reason.partition(':')[0]
+            with self.lock:
+                self.skipped[key] = self.skipped.get(key, 0) + 1
+            if Verbose > 1:
+                print ('   - Scope skip {} ({})'.format(unquote(url), reason))
+        return reason
+
+    def where(self, url, schema):
+        """ SEMP where conditions doing the name globs of collection url on the broker ([] if none)
+            needs a single attribute key in schema. objects are still checked by check()
+        """
+        segs = url_segments(url)
+        if not self.is_set() or len(segs) % 2 == 0:
+            return []
+        key = schema.key(segs[0::2])
+        if not key or len(key) != 1:
+            return []
+        conds = []
+        # where conditions are and-ed: only a single include glob can be sent
+        globs = self.include.get(segs[0], []) if len(segs) == 1 else []
+        if len(globs) == 1 and semp_glob(globs[0]):
+            conds.append('{}=={}'.format(key[0], globs[0]))
+        for glob in self.exclude.get(segs[-1], []):
+            if semp_glob(glob):
+                conds.append('{}!={}'.format(key[0], glob))
+        return conds
+
+    def applies(self, url):
+        """ true if name globs select objects of collection url (its pages must be filtered) """
+        segs = url_segments(url)
+        if not self.is_set() or len(segs) % 2 == 0:
+            return False
+        if len(segs) == 1 and self.include.get(segs[0], ['*']) != ['*']:
+            return True
+        return any(g != '*' for g in self.exclude.get(segs[-1], []))
+
+    def filter_page(self, url, json_data, schema):
+        """ drop out of scope objects (and their links) from a page of collection url
+            returns the number of objects dropped
+        """
+        data = json_data.get('data')
+        if not isinstance(data, list) or not self.applies(url):
+            return 0
+        segs = url_segments(url)
+        links = json_data.get('links')
+        if isinstance(links, list) and len(links) == len(data) and all(isinstance(l, dict) and l.get('uri') for l in links):
+            keep = [self.reason(url_segments(l['uri'])) is None for l in links]
+        else:
+            # no self links: object name from its key attribute
+            key = schema.key(segs[0::2])
+            if not key or len(key) != 1:
+                return 0
+            keep = [self.reason(segs + [str(obj.get(key[0]))]) is None for obj in data]
+        if all(keep):
+            return 0
+        json_data['data'] = [obj for obj, k in zip(data, keep) if k]
+        if isinstance(links, list) and len(links) == len(data):
+            json_data['links'] = [link for link, k in zip(links, keep) if k]
+        n = len(keep) - sum(keep)
+        with self.lock:
+            self.skipped['filtered'] = self.skipped.get('filtered', 0) + n
+        if Verbose > 1:
+            print ('   - Scope filtered {} objects from {}'.format(n, unquote(url)))
+        return n
+
+    def allows_type(self, path):
+        """ true if schema path (eg: queues/*/subscriptions) can have objects in scope """
+        segs = path.split('/')
+        if self.include and segs[0] not in self.include:
+            return False
+        # a type excluded for all names is out of scope with its subtree
+        return not any('*' in self.exclude.get(seg, []) for seg in segs[0::2])
+
+    def summary(self):
+        skipped = {k: v for k, v in self.skipped.items() if k != 'filtered'}
+        n = sum(skipped.values())
+        s = 'Scope: {} requests not sent'.format(n)
+        if n:
+            s = '{} ({})'.format(s, ', '.join('{}: {}'.format(k, v) for k, v in sorted(skipped.items())))
+        if self.skipped.get('filtered'):
+            s = '{}, {} objects filtered from pages'.format(s, self.skipped['filtered'])
+        return s
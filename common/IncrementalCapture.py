@@ -0,0 +1,188 @@
+##############################################################################
+# IncrementalCapture
+#   Incremental re-capture against the last snapshot (get-vpn-config --incremental)
+#   SEMP objects have no change stamp, so each collection is first listed with
+#   a select= projection of its key attributes (semp-schema.yaml) and a few
+#   attributes that commonly change (system.incremental.fingerprint), which is
+#   a fraction of the full pages. If the collection has the same objects as in
+#   the latest snapshot run of the vpn (SnapshotStore), its full pages are
+#   rebuilt from the stored objects and the links of the cheap pass. Objects
+#   whose fingerprint attributes differ are refetched one by one (up to
+#   maxRefetch, else the whole collection). Collections with objects added or
+#   removed are fetched in full, except for key only objects (eg:
+#   subscriptions) where the cheap pass already is the full page
+#   Changes to other attributes are not seen by the cheap pass: rebuilt pages
+#   carry a meta.reused marker, the vpn object itself is always fetched and a
+#   full capture is made once the last one is older than maxAge
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import time
+import inspect
+import threading
+
+sys.path.insert(0, os.path.abspath("."))
+from common.SempSchema import url_segments
+from common.SnapshotStore import object_key, collection_key
+
+Verbose = 0
+VpnNameAttr = 'msgVpnName'  # on every object below the vpn
+
+def run_time(run_id):
+    """ epoch secs of snapshot run id (LogHandler.ts(): yyyymmdd-HHMMSS[-n]) """
+    return time.mktime(time.strptime(run_id[:15], '%Y%m%d-%H%M%S'))
+
+def drop_select(uri):
+    """ uri without the select= query parameter of the cheap pass """
+    base, _, query = uri.partition('?')
+    params = [p for p in query.split('&') if p and not p.startswith('select=')]
+    return '{}?{}'.format(base, '&'.join(params)) if params else base
+
+def full_page(page, data, reused=None):
+    """ cheap pass page with full object data. meta reads as if fetched without select=
+        reused: marker of the snapshot the objects come from (meta.reused)
+    """
+    meta = dict(page.get('meta') or {})
+    if reused:
+        meta['reused'] = reused
+    if 'paging' in meta:
+        meta['paging'] = dict(meta['paging'], nextPageUri=drop_select(meta['paging']['nextPageUri']))
+    if 'uri' in (meta.get('request') or {}):
+        meta['request'] = dict(meta['request'], uri=drop_select(meta['request']['uri']))
+    return {'data': data, 'links': page.get('links'), 'meta': meta}
+
+
+class IncrementalCapture():
+    """ Decides per collection if its pages can be rebuilt from the last snapshot """
+
+    def __init__(self, store, router, vpn, max_age, fingerprint=None, max_refetch=10, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} {}/{} max age: {}'.format(__class__.__name__, inspect.stack()[0][3], router, vpn, max_age))
+        self.store = store
+        self.run = None       # snapshot run compared against. None: full capture
+        self.fingerprint = fingerprint or {}  # collection name -> attributes compared with the snapshot
+        self.max_refetch = max_refetch        # changed objects refetched one by one. more: whole collection
+        self.key_only = {}    # type path -> objects have key attributes only
+        self.counts = {'reused': 0, 'pages': 0, 'objects': 0, 'cheap': 0, 'refetched': 0}
+        self.lock = threading.Lock()
+        run = store.latest_run(router, vpn)
+        if run is None:
+            print ('   No snapshot of {} ({}). Full capture'.format(vpn, router))
+        elif 'collections' not in run:
+            print ('   Snapshot {} has no collection index. Full capture'.format(run['run']))
+        elif time.time() - run_time(run.get('fullRun') or run['run']) > max_age:
+            print ('   Last full capture {} is older than {} secs. Full capture'.format(run.get('fullRun') or run['run'], max_age))
+        else:
+            print ('   Incremental capture against snapshot {} (full capture {})'.format(run['run'], run.get('fullRun') or run['run']))
+            self.run = run
+
+    def is_active(self):
+        return self.run is not None
+
+    def marker(self):
+        """ reused marker of page meta / run / consolidated config. None for a full capture """
+        if self.run is None:
+            return None
+        return {'snapshot': self.run['run'], 'fullRun': self.run.get('fullRun') or self.run['run']}
+
+    def select_for(self, url, schema):
+        """ key and fingerprint attributes to list collection url with. None if it has to be fetched in full """
+        if self.run is None or collection_key(url) not in self.run['collections']:
+            return None
+        type_path = url_segments(url)[0::2]
+        select = [VpnNameAttr]
+        for i in range(len(type_path)):
+            key = schema.key(type_path[:i+1])
+            if not key:
+                return None
+            select += [a for a in key if a not in select]
+        select += [a for a in self.fingerprint.get(type_path[-1]) or [] if a not in select]
+        return select
+
+    def rebuild(self, url, cheap_pages, select):
+        """ full pages of collection url from the cheap pass pages, None if it has changed
+            returns (pages, changed): objects in changed [(page, index, uri)] have a different
+            fingerprint and are put in the pages by complete() once the handler refetched them
+        """
+        prev_keys = self.run['collections'][collection_key(url)]
+        objects = self.run['objects']
+        page_keys = []
+        for page in cheap_pages:
+            data = page.get('data') or []
+            links = page.get('links') or []
+            # identities come from the self links
+            if len(links) != len(data) or not all(isinstance(l, dict) and l.get('uri') for l in links):
+                return self.refetch(url, 'no object links')
+            page_keys.append([object_key(link, url, n) for n, link in enumerate(links)])
+
+        try:
+            if sorted(k for keys in page_keys for k in keys) == sorted(prev_keys):
+                pages = []
+                changed = []
+                for p, (page, keys) in enumerate(zip(cheap_pages, page_keys)):
+                    data = []
+                    for i, (cheap_obj, link, k) in enumerate(zip(page['data'], page['links'], keys)):
+                        obj = self.store.get(objects[k])
+                        if any(obj.get(a) != cheap_obj.get(a) for a in select):
+                            changed.append((p, i, link['uri']))
+                        data.append(obj)
+                    pages.append(full_page(page, data, self.marker()))
+                if len(changed) > self.max_refetch:
+                    return self.refetch(url, '{} objects changed (maxRefetch {})'.format(len(changed), self.max_refetch))
+                return pages, changed
+            if self.is_key_only(url, prev_keys, select):
+                self.count('cheap')
+                return [full_page(page, page.get('data') or []) for page in cheap_pages], []
+        except (OSError, KeyError, ValueError) as e:
+            # object pruned from the store / unreadable
+            return self.refetch(url, 'snapshot object: {}'.format(e))
+        return self.refetch(url, 'objects added or removed')
+
+    def complete(self, url, pages, changed, responses):
+        """ pages of rebuild() with the changed objects from their SEMP responses (in changed order)
+            None if a refetch failed
+        """
+        for (p, i, uri), json_data in zip(changed, responses):
+            if (json_data.get('meta') or {}).get('responseCode') != 200 or not isinstance(json_data.get('data'), dict):
+                return self.refetch(url, 'object refetch failed')
+            if Verbose:
+                print ('   * Refetched {} (fingerprint changed)'.format(uri))
+            pages[p]['data'][i] = json_data['data']
+        if pages and pages[0]['meta'].get('reused'):
+            self.count('reused')
+            self.count('pages', len(pages))
+            self.count('objects', len(changed))
+            if Verbose:
+                print ('   = Rebuilt {} from snapshot ({} objects, {} refetched)'.format(
+                    '/'.join(url_segments(url)), sum(len(page['data']) for page in pages), len(changed)))
+        return pages
+
+    def is_key_only(self, url, prev_keys, select):
+        """ true if objects of the type of url have no attributes besides select """
+        type_path = tuple(url_segments(url)[0::2])
+        if type_path not in self.key_only:
+            if not prev_keys or prev_keys[0] not in self.run['objects']:
+                return False
+            obj = self.store.get(self.run['objects'][prev_keys[0]])
+            self.key_only[type_path] = set(obj) <= set(select)
+        return self.key_only[type_path]
+
+    def refetch(self, url, reason):
+        self.count('refetched')
+        if Verbose:
+            print ('   * Refetching {} ({})'.format('/'.join(url_segments(url)), reason))
+        return None
+
+    def count(self, what, n=1):
+        with self.lock:
+            self.counts[what] += n
+
+    def summary(self):
+        if self.run is None:
+            return 'Incremental: full capture'
+        return 'Incremental: {} collections rebuilt from snapshot {} ({} objects refetched), {} complete from select pass, {} refetched'.format(
+            self.counts['reused'], self.run['run'], self.counts['objects'], self.counts['cheap'], self.counts['refetched'])
@@ -9,16 +9,36 @@ import sys, os
 import json
 import pprint
 import inspect
+import threading
 #import pathlib
 from urllib.parse import unquote
+try:
+    import orjson # optional faster json decoder
+except ImportError:
+    orjson = None
 
 pp = pprint.PrettyPrinter(indent=4)
 Verbose = 0
+
+def load_json_file(file):
+    """ read json file with the fastest decoder available (orjson if installed, else json) """
+    with open(file, 'rb') as fp:
+        text = fp.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass # eg: NaN or integers beyond 64 bit. json module takes those
+    return json.loads(text)
+
 class JsonHandler():
     """ JSON handling functions """
 
     # class /static vars
     ObjMap = {} # static map used to get unique file-names
+    ObjMapLock = threading.Lock() # ObjMap is shared by parallel crawl workers
+    MadeDirs = set() # output dirs created in this run (set.add is thread safe)
+    DumpArgs = {'indent': 4, 'sort_keys': True} # page file format (see CaptureOutput.set_page_format)
 
     def __init__(self, verbose=0):
         global Verbose
@@ -33,18 +53,24 @@ class JsonHandler():
         outfile = unquote(outfile)
         if Verbose > 2:
             print ("Entering {}::{}  file: {}". format (__class__.__name__, inspect.stack()[0][3], outfile))
-        if os.path.exists(outfile):
-            print ("   - Skiping {} (file exists)".format( outfile))
-            return
         path,fname = os.path.split(outfile)
-        if not os.path.exists(path):
+        # dirs already created in this run are not checked again
+        if path not in JsonHandler.MadeDirs:
             if Verbose > 2:
                 print ('outfile: {} path: {} fname: {}'. format(outfile, path, fname))
                 print ("makedir: {}".format(path))
-            os.makedirs(path)
-        print ("   + Writing to {}".format(outfile))
-        with open(outfile, 'w') as fp:
-            json.dump(json_data, fp, indent=4, sort_keys=True)
+            os.makedirs(path, exist_ok=True) # another worker may create it first
+            JsonHandler.MadeDirs.add(path)
+        # a file left by the interrupted run (--resume): a page not marked done is fetched and saved again
+        if os.path.exists(outfile):
+            print ("   Overwriting {}".format(outfile))
+        else:
+            print ("   + Writing to {}".format(outfile))
+        # written to a temp file and renamed: a crash never leaves a truncated page behind
+        tmp_file = '{}.{}.tmp'.format(outfile, threading.get_ident())
+        with open(tmp_file, 'w') as fp:
+            json.dump(json_data, fp, **JsonHandler.DumpArgs)
+        os.replace(tmp_file, outfile)
 
     def get_unique_fname (self,path,obj):
         """ helper fn to get a unique file name (eg: queue-1.json, queue-2.json) """   
@@ -52,11 +78,12 @@ class JsonHandler():
         #obj1=urllib.parse.unquote(obj)
         obj1=unquote(obj)
         key=path+"/"+obj1
-        if key not in JsonHandler.ObjMap:
-            JsonHandler.ObjMap[key] = 0
-            return "{}.json".format(obj1)
-        JsonHandler.ObjMap[key] = JsonHandler.ObjMap[key]+1
-        return ("{}-{}.json".format(obj1,JsonHandler.ObjMap[key]))
+        with JsonHandler.ObjMapLock:
+            if key not in JsonHandler.ObjMap:
+                JsonHandler.ObjMap[key] = 0
+                return "{}.json".format(obj1)
+            JsonHandler.ObjMap[key] = JsonHandler.ObjMap[key]+1
+            return ("{}-{}.json".format(obj1,JsonHandler.ObjMap[key]))
 
     def read_json_file(self,file):
         """ read json file and return data """
@@ -64,9 +91,7 @@ class JsonHandler():
 
         if Verbose > 2 :
             print ("Entering {}::{}  file: {}".format(__class__.__name__, inspect.stack()[0][3], file))
-        with open(file, "r") as fp:
-            data = json.load(fp)
-        return data
+        return load_json_file(file)
 
     def read_json_data (self, json_file) :
         """ parse json data & return parts """
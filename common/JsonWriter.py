@@ -0,0 +1,86 @@
+##############################################################################
+# JsonWriter
+#   Background writer stage for the SEMP config crawl
+#   The crawler queues fetched pages and goes on with the next request;
+#   writer threads serialize and save them (JsonHandler.save_config_json),
+#   so disk i/o overlaps network latency. The queue is bounded, so a slow
+#   disk slows the crawl down instead of holding every page in memory
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import queue
+import inspect
+import threading
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+
+Verbose = 0
+
+class JsonWriter():
+    """ Bounded queue of (outfile, json_data) drained by writer threads """
+
+    def __init__(self, queue_size=256, threads=1, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} queue_size: {} threads: {}'.format(__class__.__name__, inspect.stack()[0][3], queue_size, threads))
+        self.json_h = JsonHandler.JsonHandler()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.n_written = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, name='json-writer-{}'.format(i), daemon=True)
+                        for i in range(max(1, threads))]
+        for t in self.threads:
+            t.start()
+
+    def write(self, outfile, json_data, on_done=None, block=True):
+        """ queue page for writing. on_done() is called after the file is saved (eg: checkpoint mark)
+            returns False if block is False and the queue is full
+        """
+        if self.error:
+            raise self.error
+        try:
+            self.queue.put((outfile, json_data, on_done), block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                outfile, json_data, on_done = item
+                if self.error is None:
+                    self.json_h.save_config_json(outfile, json_data)
+                    if on_done:
+                        on_done()
+                    with self.lock:
+                        self.n_written += 1
+            except Exception as e:
+                # keep draining so producers don't block. error is raised to the crawler
+                print ('**** Writer failed on {}: {} ****'.format(item[0], e))
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """ wait until every queued page is on disk """
+        self.queue.join()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        """ flush and stop writer threads """
+        self.queue.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        if self.error:
+            raise self.error
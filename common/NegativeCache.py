@@ -0,0 +1,181 @@
+##############################################################################
+# NegativeCache
+#   Persistent cache of SEMP GET endpoints a broker doesn't support, per vpn
+#   Keyed by endpoint pattern (object names replaced by *) or exact path,
+#   plus broker SEMP version. Entries expire after ttl seconds.
+#   Only "not supported" failures are cached (NOT_SUPPORTED, INVALID_PATH,
+#   400 on a collection below an object). Auth errors (401 / 403) and top
+#   level collections are never cached: they are about the user, not the broker
+#   Cached failures are short-circuited without a network round trip and
+#   reported once in the run summary instead of once per object
+#   Not supported endpoints are expected (unsupported()), other failures are
+#   gaps in the capture (missing())
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import json
+import time
+import inspect
+import threading
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.abspath("."))
+from common.SempSchema import url_segments
+
+Verbose = 0
+NotSupported = ('NOT_SUPPORTED', 'INVALID_PATH')  # SEMP error status of endpoints the broker doesn't have
+
+def endpoint_pattern(segs):
+    """ [queues, q1, subscriptions] -> queues/*/subscriptions """
+    return '/'.join('*' if i % 2 == 1 else seg for i, seg in enumerate(segs))
+
+def is_transient(response_code):
+    """ throttling / server errors may succeed next time. never cached """
+    return response_code in (408, 429) or response_code >= 500
+
+def is_not_supported(segs, response_code, status):
+    """ true if the failure says the broker doesn't have this endpoint (cached) """
+    if response_code in (401, 403) or len(segs) < 3:
+        return False
+    if status in NotSupported:
+        return True
+    # eg: aclProfiles/*/publishExceptions on a broker without it
+    return response_code == 400
+
+
+class NegativeCache():
+    """ Negative result cache for failing SEMP endpoints """
+
+    def __init__(self, cache_file, ttl=604800, threshold=3, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} file: {}'.format(__class__.__name__, inspect.stack()[0][3], cache_file))
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.threshold = threshold   # not supported failures with no success before a pattern is short-circuited in this run
+        self.semp_version = None
+        self.entries = {}   # key -> {kind, path, version, status, responseCode, expires}
+        self.stats = {}     # pattern -> {ok, failed, notSupported, short, status, responseCode, paths}
+        self.lock = threading.Lock()
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'r') as fp:
+                self.entries = json.load(fp).get('entries', {})
+            # auth errors cached by earlier versions
+            self.entries = {k: e for k, e in self.entries.items() if e.get('responseCode') not in (401, 403)}
+            if Verbose:
+                print ('   Loaded {} negative cache entries from {}'.format(len(self.entries), cache_file))
+
+    def set_version(self, semp_version):
+        self.semp_version = semp_version
+
+    def key(self, kind, path):
+        return '{}|{}|{}'.format(self.semp_version, kind, path)
+
+    def pattern_stats(self, pattern):
+        if pattern not in self.stats:
+            self.stats[pattern] = {'ok': 0, 'failed': 0, 'notSupported': 0, 'short': 0, 'status': None, 'responseCode': None, 'paths': set()}
+        return self.stats[pattern]
+
+    def check(self, url):
+        """ return cached failure status if url is known to fail, None otherwise """
+        segs = url_segments(url)
+        if not segs:
+            return None
+        path = '/'.join(segs)
+        pattern = endpoint_pattern(segs)
+        now = time.time()
+        with self.lock:
+            st = self.pattern_stats(pattern)
+            status = None
+            for k in [self.key('pattern', pattern), self.key('path', path)]:
+                entry = self.entries.get(k)
+                if entry and entry['expires'] > now:
+                    status = entry['status']
+                    st['status'] = status
+                    st['responseCode'] = entry['responseCode']
+                    break
+            # learnt in this run: every request of this pattern was not supported so far
+            if status is None and st['ok'] == 0 and st['notSupported'] >= self.threshold:
+                status = st['status']
+            if status is not None:
+                st['short'] += 1
+        if status is not None and Verbose > 1:
+            print ('   - Negative cache skip {} ({})'.format(unquote(url), status))
+        return status
+
+    def record(self, url, json_data):
+        """ record result of a GET. returns True if the request failed """
+        meta_data = json_data.get('meta', {}) if isinstance(json_data, dict) else {}
+        response_code = meta_data.get('responseCode', 0)
+        segs = url_segments(url)
+        pattern = endpoint_pattern(segs)
+        with self.lock:
+            st = self.pattern_stats(pattern)
+            if response_code == 200:
+                st['ok'] += 1
+                return False
+            st['failed'] += 1
+            st['status'] = meta_data.get('error', {}).get('status', str(response_code))
+            st['responseCode'] = response_code
+            # throttling / server errors may succeed next time: a gap, never cached
+            if not is_transient(response_code) and is_not_supported(segs, response_code, st['status']):
+                st['notSupported'] += 1
+                st['paths'].add('/'.join(segs))
+        return True
+
+    def save(self):
+        """ persist not supported failures of this run. a pattern that never succeeded is cached
+            as a whole, otherwise only the failing paths are cached
+        """
+        if not self.cache_file:
+            return
+        now = time.time()
+        with self.lock:
+            entries = {k: e for k, e in self.entries.items() if e['expires'] > now}
+            for pattern, st in self.stats.items():
+                if st['notSupported'] == 0:
+                    continue
+                if st['ok'] == 0 and st['notSupported'] == st['failed']:
+                    targets = [('pattern', pattern)]
+                else:
+                    targets = [('path', path) for path in st['paths']]
+                for kind, path in targets:
+                    entries[self.key(kind, path)] = {
+                        'kind': kind,
+                        'path': path,
+                        'version': self.semp_version,
+                        'status': st['status'],
+                        'responseCode': st['responseCode'],
+                        'expires': now + self.ttl,
+                    }
+            self.entries = entries
+            path = os.path.dirname(self.cache_file)
+            if path:
+                os.makedirs(path, exist_ok=True)
+            with open(self.cache_file, 'w') as fp:
+                json.dump({'entries': entries}, fp, indent=4, sort_keys=True)
+
+    def missing(self):
+        """ endpoint patterns with objects not captured in this run because a request failed
+            (not supported endpoints, requested or skipped, are expected: see unsupported())
+        """
+        return sorted(pattern for pattern, st in self.stats.items() if st['failed'] > st['notSupported'])
+
+    def unsupported(self):
+        """ endpoint patterns the broker doesn't support for the vpn (requested or skipped from the cache) """
+        return sorted(pattern for pattern, st in self.stats.items() if st['notSupported'] or st['short'])
+
+    def summary(self):
+        """ one line per failing endpoint pattern """
+        lines = []
+        for pattern, st in sorted(self.stats.items()):
+            if st['failed'] == 0 and st['short'] == 0:
+                continue
+            lines.append('   {} : {} ({}) - {} failed, {} skipped from negative cache'.format(
+                pattern, st['status'], st['responseCode'], st['failed'], st['short']))
+        if not lines:
+            return 'Failed SEMP requests: none'
+        return '\n'.join(['Failed SEMP requests:'] + lines)
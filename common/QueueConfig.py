@@ -1,16 +1,24 @@
 #####################################################################
 # QueueConfig
 # Implement Queue provisioning functions
+# Queues are provisioned concurrently (workers). Steps of one queue
+# (create / patch / subscriptions) stay in order, and queues used as
+# deadMsgQueue by other queues of the input are provisioned first
+# In patch mode existing queues are read up front (paged GETs) so each
+# row is created or patched without a POST to find out
 #
 # Ramesh Natarajan 
 # Solace PSG
 #####################################################################
 
 import sys, os
-import json
-from urllib.parse import unquote, quote
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 import pprint
 
+sys.path.insert(0, os.path.abspath("."))
+from common.SempCrawler import query_params
+
 # Globals
 pp = pprint.PrettyPrinter(indent=4)
 Verbose = 0
@@ -18,7 +26,7 @@ log = None
 
 class Queues():
 
-    def __init__(self, semp_h, cfg, input_df, verbose = 0):
+    def __init__(self, semp_h, cfg, input_df, verbose = 0, workers = 1):
         global Verbose
         global log
         Verbose = verbose
@@ -26,17 +34,129 @@ class Queues():
         self.semp_h = semp_h
         self.cfg = cfg
         self.input_df = input_df
+        self.workers = workers # queues provisioned at the same time
+        self.msg_vpn_name = cfg['vpn']['msgVpnNames'][0]
+        self.semp_config_url = '{}/{}/msgVpns'.format(cfg['router']['sempUrl'], cfg['system']['semp']['configUrl'])
+        self.semp_queue_config_url = f"{self.semp_config_url}/{self.msg_vpn_name}/queues"
+        self.inventory = None  # queueName -> attributes of existing queues (see load_inventory)
+
+    #--------------------------------------------------------------------
+    # load_inventory
+    # Get existing queues of the VPN with paged GETs (select= queueName and
+    # the template attributes) into self.inventory: queueName -> attributes
+    # If the GET fails inventory stays None and each queue is POSTed first
+    #--------------------------------------------------------------------
+    def load_inventory (self, template):
+
+        select = ['queueName'] + [k for k in template if k not in ('queueName', 'subscriptionTopic')]
+        params = query_params(self.cfg['system']['semp']['pageSize'], select)
+        inventory = {}
+        url = self.semp_queue_config_url
+        while url:
+            resp = self.semp_h.http_get (url, params)
+            if resp.response_code != 200:
+                log.info ('Get existing queues failed: {} {}'.format(resp, resp.error.get('status')))
+                print (f"Get existing queues failed ({resp.response_code}). Queues are POSTed first")
+                self.inventory = None
+                return
+            for qdata in resp.data:
+                inventory[qdata['queueName']] = qdata
+            # next page uri has count and select
+            url = resp.paging.get('nextPageUri')
+            params = None
+        log.info ('{} existing queues in VPN: {}'.format(len(inventory), self.msg_vpn_name))
+        print (f"{len(inventory)} existing queues in VPN {self.msg_vpn_name}")
+        self.inventory = inventory
+
+    #--------------------------------------------------------------------
+    # exists
+    # True if queue is in the inventory. None if there is no inventory
+    #--------------------------------------------------------------------
+    def exists (self, queue):
+
+        if self.inventory is None:
+            return None
+        return queue in self.inventory
+
+    #--------------------------------------------------------------------
+    # dmq_waves
+    # Group queue jobs [(queue, data, ...)] in waves that run one after another
+    # A queue used as deadMsgQueue by another queue of the jobs is in an
+    # earlier wave than that queue: wave(job) = max(wave of the last job of
+    # its deadMsgQueue + 1, wave of the previous job of the queue + 1)
+    # Repeated rows of a queue are in successive waves, so they are applied
+    # in input order. A deadMsgQueue loop is cut where it closes
+    #--------------------------------------------------------------------
+    def dmq_waves (self, jobs):
+
+        rows = {}   # queue name -> index of its jobs, in input order
+        for i, job in enumerate(jobs):
+            rows.setdefault(job[0], []).append(i)
+
+        def dmqs (queue):
+            # deadMsgQueues of queue that are in the jobs
+            return iter([d for d in (jobs[i][1].get('deadMsgQueue') for i in rows[queue]) if d in rows and d != queue])
+
+        # queues in dependency order (deadMsgQueues first). explicit stack, no recursion
+        order = []
+        seen = set()
+        for root in rows:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, dmqs(root))]
+            while stack:
+                queue, deps = stack[-1]
+                dmq = next(deps, None)
+                if dmq is None:
+                    stack.pop()
+                    order.append(queue)
+                elif dmq not in seen:
+                    seen.add(dmq)
+                    stack.append((dmq, dmqs(dmq)))
+
+        ranks = [0] * len(jobs)
+        last = {}   # queue name -> rank of its last job
+        for queue in order:
+            rank = -1
+            for i in rows[queue]:
+                dmq = jobs[i][1].get('deadMsgQueue')
+                rank = max(rank + 1, last[dmq] + 1 if dmq in last else 0)
+                ranks[i] = rank
+            last[queue] = rank
+        waves = [[] for _ in range(max(ranks) + 1)] if ranks else []
+        for job, rank in zip(jobs, ranks):
+            waves[rank].append(job)
+        return waves
+
+    #--------------------------------------------------------------------
+    # run_waves
+    # Run func(*job) for every job. Waves run one after another, jobs of a
+    # wave on self.workers threads. An exception of a job is raised once
+    # its wave is done
+    #--------------------------------------------------------------------
+    def run_waves (self, waves, func):
+
+        for w, wave in enumerate(waves):
+            if Verbose and len(waves) > 1:
+                print (f"\nWave {w+1}/{len(waves)}: {len(wave)} queues")
+            if self.workers <= 1:
+                for job in wave:
+                    func(*job)
+                continue
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(func, *job) for job in wave]
+            for f in futures:
+                f.result()
     #--------------------------------------------------------------------
     # get_topic_list
     # Get list of topics from SEMP response
     #--------------------------------------------------------------------
     def get_topic_list (self, resp):
 
-        resp_json = json.loads(resp.text)
         topic_list = []
-        if 'data' in resp_json:
-            for sub in resp_json['data']:
-                topic_list.append(sub['subscriptionTopic'])
+        for sub in resp.data:
+            topic_list.append(sub['subscriptionTopic'])
         return topic_list
 
     #--------------------------------------------------------------------
@@ -50,9 +170,7 @@ class Queues():
     #--------------------------------------------------------------------
     def create_or_update_queue (self, patch_it):
 
-        semp_h = self.semp_h
         cfg = self.cfg
-        sys_cfg = cfg['system']
         input_df = self.input_df
 
         if patch_it:
@@ -61,9 +179,6 @@ class Queues():
             log.info ('Creating Queues in VPN: {} on router: {}'.format(cfg['vpn']['msgVpnNames'][0], cfg['router']['sempUrl']))
 
         # Loop through each row and generate obj for SEMP Req
-        msg_vpn_name = cfg['vpn']['msgVpnNames'][0]
-        semp_config_url = '{}/{}/msgVpns'.format(cfg['router']['sempUrl'], sys_cfg['semp']['configUrl'])
-        semp_queue_config_url = f"{semp_config_url}/{msg_vpn_name}/queues"
         num_queues = len(input_df.index)
         n = 0
 
@@ -77,6 +192,7 @@ class Queues():
         if Verbose > 2:
             print ('Tags:', queue_props)    
         
+        jobs = []
         for index, qdata in input_df.iterrows():
             n = n + 1
             #print ('data read', d)
@@ -85,7 +201,6 @@ class Queues():
             data=cfg['templates']['queue'].copy()
             #data['messageVpn'] = msg_vpn_name
             queue = qdata['queueName'].strip()
-            log.info ('Processing queue: {} (Patch: {})'.format(queue, patch_it))
             for prop in queue_props:
                 if prop in qdata:
                     if isinstance(qdata[prop], str) and qdata[prop].strip() != "":
@@ -100,47 +215,73 @@ class Queues():
             # remove subscriptionTopic
             sub_topic_saved = data['subscriptionTopic']
             data.pop('subscriptionTopic', None)
-            ###################################################
-            # post to router - create queue
-            #
-            print (f"\n{n:2}/{num_queues:3} ) Creating queue: <{queue}>")
+            jobs.append((queue, data, sub_topic_saved, f"{n:2}/{num_queues:3}", patch_it))
+
+        if patch_it and jobs:
+            self.load_inventory (cfg['templates']['queue'])
+
+        # queues used as deadMsgQueue by other queues in the input go first
+        self.run_waves (self.dmq_waves(jobs), self.provision_queue)
+
+    #--------------------------------------------------------------------
+    # provision_queue
+    # Create or update one queue and its subscriptions, in order
+    # Runs on worker threads: no state is shared with other queues
+    #--------------------------------------------------------------------
+    def provision_queue (self, queue, data, sub_topic_saved, seq, patch_it):
+
+        semp_h = self.semp_h
+        msg_vpn_name = self.msg_vpn_name
+        semp_config_url = self.semp_config_url
+        semp_queue_config_url = self.semp_queue_config_url
+        log.info ('Processing queue: {} (Patch: {})'.format(queue, patch_it))
+
+        ###################################################
+        # post to router - create queue
+        #
+        if patch_it and self.exists(queue):
+            # known from the inventory. no POST
+            print (f"\n{seq} ) Updating queue: <{queue}>")
+            resp = 'ALREADY_EXISTS'
+        else:
+            print (f"\n{seq} ) Creating queue: <{queue}>")
             resp = semp_h.http_post (semp_queue_config_url, data)
-            if patch_it and resp == 'ALREADY_EXISTS':
-                #---------------------------------------------------
-                # If Queue exists, patch it
-                #
-                log.info (f'Queue {queue} exists. Disable and patch it')
-                # disable queue first
-                data0 = {}
-                data0['queueName'] = queue
-                data0['msgVpnName'] = msg_vpn_name
-                data0['egressEnabled'] = False
-                #data0['ingressEnabled'] = False
-                semp_h.http_patch (f"{semp_queue_config_url}/{queue}", data0)
-                # Patch with new values and enable
-                semp_h.http_patch (f"{semp_queue_config_url}/{queue}", data)
-
-            if patch_it:
-                # remove subscriptions first
-                log.info (f'Reapplying subscriptions on Queue {queue} (PATCH)')
+        if patch_it and resp == 'ALREADY_EXISTS':
+            #---------------------------------------------------
+            # If Queue exists, patch it
+            #
+            log.info (f'Queue {queue} exists. Disable and patch it')
+            # disable queue first
+            data0 = {}
+            data0['queueName'] = queue
+            data0['msgVpnName'] = msg_vpn_name
+            data0['egressEnabled'] = False
+            #data0['ingressEnabled'] = False
+            semp_h.http_patch (f"{semp_queue_config_url}/{queue}", data0)
+            # Patch with new values and enable
+            semp_h.http_patch (f"{semp_queue_config_url}/{queue}", data)
+
+        if patch_it:
+            # remove subscriptions first
+            log.info (f'Reapplying subscriptions on Queue {queue} (PATCH)')
+            semp_queue_sub_config_url = f"{semp_config_url}/{msg_vpn_name}/queues/{queue}/subscriptions"
+            resp = semp_h.http_get(semp_queue_sub_config_url)
+            for topic in self.get_topic_list (resp):
+                log.info (f'Deleting subscription topic: [{topic}]')
+                semp_queue_sub_delete_url = f"{semp_config_url}/{msg_vpn_name}/queues/{queue}/subscriptions/{quote(topic, safe='')}"
+                log.info(f'SEMP post url: {semp_queue_sub_delete_url}')
+                semp_h.http_delete (semp_queue_sub_delete_url)
+        # now add subscription topics
+        for topics in sub_topic_saved.split(':'):
+            topic = topics.strip()
+            if topic != "":
+                data = {}
+                data['msgVpnName'] = msg_vpn_name
+                data['queueName'] = queue
+                data['subscriptionTopic'] = topic
+                log.info (f'Adding subscription topic: [{topic}] on queue {queue}')
                 semp_queue_sub_config_url = f"{semp_config_url}/{msg_vpn_name}/queues/{queue}/subscriptions"
-                resp = semp_h.http_get(semp_queue_sub_config_url)
-                for topic in self.get_topic_list (resp):
-                    log.info (f'Deleting subscription topic: [{topic}]')
-                    semp_queue_sub_delete_url = f"{semp_config_url}/{msg_vpn_name}/queues/{queue}/subscriptions/{quote(topic, safe='')}"
-                    log.info(f'SEMP post url: {semp_queue_sub_delete_url}')
-                    semp_h.http_delete (semp_queue_sub_delete_url)
-            # now add subscription topics
-            for topics in sub_topic_saved.split(':'):
-                topic = topics.strip()
-                if topic != "":
-                    data = {}
-                    data['msgVpnName'] = msg_vpn_name
-                    data['queueName'] = queue
-                    data['subscriptionTopic'] = topic
-                    log.info (f'Adding subscription topic: [{topic}] on queue {queue}')
-                    semp_queue_sub_config_url = f"{semp_config_url}/{msg_vpn_name}/queues/{queue}/subscriptions"
-                    semp_h.http_post (semp_queue_sub_config_url, data)
+                semp_h.http_post (semp_queue_sub_config_url, data)
 
 
     #--------------------------------------------------------------------
@@ -154,9 +295,7 @@ class Queues():
     #--------------------------------------------------------------------
     def create_or_update_dmqueue (self, patch_it):
 
-        semp_h = self.semp_h
         cfg = self.cfg
-        sys_cfg = cfg['system']
         input_df = self.input_df
         if patch_it:
             log.info ('Patching DMQueues in VPN: {} on router: {}'.format(cfg['vpn']['msgVpnNames'][0], cfg['router']['sempUrl'])) 
@@ -164,9 +303,7 @@ class Queues():
             log.info ('Creating DMQueues in VPN: {} on router: {}'.format(cfg['vpn']['msgVpnNames'][0], cfg['router']['sempUrl']))
 
         # Loop through each row and generate obj for SEMP Req
-        msg_vpn_name = cfg['vpn']['msgVpnNames'][0]
-        semp_config_url = '{}/{}/msgVpns'.format(cfg['router']['sempUrl'], sys_cfg['semp']['configUrl'])
-        semp_queue_config_url = f"{semp_config_url}/{msg_vpn_name}/queues"
+        msg_vpn_name = self.msg_vpn_name
         num_queues = len(input_df.index)
         n = 0
 
@@ -180,6 +317,7 @@ class Queues():
         if Verbose > 2:
             print ('Tags:', queue_props)
         
+        jobs = []
         for index, qdata in input_df.iterrows():
             n = n + 1
             #print ('data read', d)
@@ -188,7 +326,6 @@ class Queues():
             data=cfg['templates']['dmqueue'].copy()
             #data['messageVpn'] = msg_vpn_name
             queue = qdata['queueName'].strip()
-            log.info ('Processing DMQ queue: {} (Patch: {})'.format(queue, patch_it))
 
             # enable queues
             data['egressEnabled'] = True
@@ -196,17 +333,38 @@ class Queues():
             data['msgVpnName'] = msg_vpn_name
             data['queueName'] = queue
             data.pop('subscriptionTopic', None)
+            jobs.append((queue, data, f"{n:2}/{num_queues:3}", patch_it))
 
-            ###################################################
-            # post to router - create queue
-            #
-            print (f"\n{n:2}/{num_queues:3} ) Creating queue: <{queue}>")
+        if patch_it and jobs:
+            self.load_inventory (cfg['templates']['dmqueue'])
+
+        self.run_waves (self.dmq_waves(jobs), self.provision_dmqueue)
+
+    #--------------------------------------------------------------------
+    # provision_dmqueue
+    # Create or update one DMQ
+    #--------------------------------------------------------------------
+    def provision_dmqueue (self, queue, data, seq, patch_it):
+
+        semp_h = self.semp_h
+        semp_queue_config_url = self.semp_queue_config_url
+        log.info ('Processing DMQ queue: {} (Patch: {})'.format(queue, patch_it))
+
+        ###################################################
+        # post to router - create queue
+        #
+        if patch_it and self.exists(queue):
+            # known from the inventory. no POST
+            print (f"\n{seq} ) Updating queue: <{queue}>")
+            resp = 'ALREADY_EXISTS'
+        else:
+            print (f"\n{seq} ) Creating queue: <{queue}>")
             resp = semp_h.http_post (semp_queue_config_url, data)
-            if patch_it and resp == 'ALREADY_EXISTS':
-                #---------------------------------------------------
-                # If Queue exists, patch it
-                #
-                log.info (f'Queue {queue} exists. Disable and patch it')
-
-                # Patch with new values and enable
-                semp_h.http_patch (f"{semp_queue_config_url}/{queue}", data)
\ No newline at end of file
+        if patch_it and resp == 'ALREADY_EXISTS':
+            #---------------------------------------------------
+            # If Queue exists, patch it
+            #
+            log.info (f'Queue {queue} exists. Disable and patch it')
+
+            # Patch with new values and enable
+            semp_h.http_patch (f"{semp_queue_config_url}/{queue}", data)
@@ -0,0 +1,230 @@
+##############################################################################
+# SempCrawler
+#   Crawl bookkeeping shared by SempHandler (requests, threads) and
+#   AsyncSempHandler (aiohttp, asyncio): which links are requested, with which
+#   query params, into which page file, and what is recorded for each page
+#   (negative cache, checkpoint, assembler, incremental capture)
+#   Handlers inherit it and only do the I/O (GET, file read / write)
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import inspect
+from urllib.parse import unquote # for Python 3.7
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+from common import VisitedIndex
+from common import SempSchema
+
+Verbose = 0
+json_h = JsonHandler.JsonHandler()
+
+
+def query_params(count=None, select=None, where=None):
+    """ build SEMP GET query params. select / where can be a list or a comma separated string """
+    params = {}
+    if count:
+        params['count'] = count
+    if select:
+        params['select'] = select if isinstance(select, str) else ','.join(select)
+    if where:
+        params['where'] = where if isinstance(where, str) else ','.join(where)
+    return params
+
+
+def merge_where(where, conds):
+    """ user where conditions (list or comma separated string) plus conds """
+    if not conds:
+        return where
+    if not where:
+        return conds
+    return (where.split(',') if isinstance(where, str) else list(where)) + conds
+
+
+class SempCrawler():
+    """ Crawl state and page bookkeeping. no I/O here """
+
+    def init_crawl(self, cfg, vpn, outdir, verbose, checkpoint, schema, negative_cache, scope, writer, assembler, incremental):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} vpn: {} outdir: {}'.format(__class__.__name__, inspect.stack()[0][3], vpn, outdir))
+        self.vpn = vpn
+        self.out_dir = outdir
+        self.checkpoint = checkpoint # CrawlCheckpoint (optional)
+        self.visited = VisitedIndex.VisitedIndex() # urls fetched in this crawl
+        # SEMP object tree. decides paging and which links are never requested
+        if schema is None:
+            schema = SempSchema.SempSchema(cfg["system"]["semp"].get("schemaFile"), verbose)
+        self.schema = schema
+        self.negative_cache = negative_cache # NegativeCache (optional)
+        self.scope = scope # CrawlScope include / exclude filters (optional)
+        self.writer = writer # JsonWriter background writer (optional). pages are saved inline without it
+        self.assembler = assembler # ConfigAssembler (optional). builds <vpn>-all.json from crawled pages
+        self.incremental = incremental # IncrementalCapture (optional). unchanged collections are rebuilt from the last snapshot
+        crawl_cfg = cfg.get("crawl") or {}
+        self.select = crawl_cfg.get("select") or {} # collection -> attributes to fetch
+        self.where = crawl_cfg.get("where") or {}   # collection -> filter conditions
+        self.page_size = cfg["system"]["semp"]["pageSize"]
+        self.no_paging = cfg["system"]["semp"]["noPaging"]
+
+    def get_params (self, url, collections=False, paging=True, select=None, where=None):
+        """ query params of a GET of url (None if there are none)
+            collections get count= unless the schema / noPaging says the broker rejects it
+        """
+        u_url = unquote(url)
+        count = None
+        if collections:
+            if int(self.page_size) == 0:
+                paging = False
+            # some elements throw 400 not supported if page count is sent
+            if self.schema.paging(url) is False or os.path.split(url)[1] in self.no_paging:
+                paging = False
+                if Verbose:
+                    print ("Skipping paging for element {}".format(os.path.split(u_url)[1]))
+            if paging :
+                count = self.page_size
+            if Verbose:
+                print("   Get URL {}{} (*)".format(u_url, " [{}]".format(self.page_size) if count else ""))
+        else:
+            # No paging for non-collection objects
+            if Verbose:
+                print("   Get URL {}".format(u_url))
+        params = query_params(count, select, where)
+        if Verbose and (select or where):
+            print("      select: {} where: {}".format(params.get('select'), params.get('where')))
+        return params if params else None
+
+    def get_page_links (self, json_data):
+        """ return list of non-uri link urls in json data """
+        link_urls = []
+        if 'links' not in json_data:
+            return link_urls
+        if type(json_data['links']) is list:
+            link_lists = json_data['links']
+        else:
+            link_lists = [json_data['links']]
+        for link_list in link_lists:
+            for link_key, link_url in link_list.items():
+                if link_key != 'uri':
+                    link_urls.append(link_url)
+        return link_urls
+
+    def skip_link (self, url):
+        """ true if link url is out of scope, never requested (schema, negative cache) or already visited """
+        if self.scope and self.scope.check(url):
+            return True
+        if self.schema.check(url):
+            return True
+        if self.negative_cache and self.negative_cache.check(url):
+            return True
+        if not self.visited.add(url):
+            if Verbose > 1:
+                print ("   = Skipping duplicate link {}".format(unquote(url)))
+            return True
+        return False
+
+    def next_page (self, json_data):
+        """ nextPageUri of page json_data, None on the last page or if it was already visited """
+        if 'paging' not in json_data['meta']:
+            return None
+        next_page_uri = json_data['meta']['paging']['nextPageUri']
+        if not self.visited.add(next_page_uri):
+            return None
+        if Verbose > 1:
+            print ("Processig Next Page URI : {}".format(unquote(next_page_uri)))
+        return next_page_uri
+
+    def page_file (self, url):
+        """ (collection / object name, page file) of link url
+            file name is picked before the GET so a resumed crawl maps pages to the same files
+            names are numbered per vpn output dir, so vpns crawled together get the same names
+        """
+        p = url.partition(self.vpn)
+        path=p[2]
+        if path.rfind('?')>0:
+            path=path[:path.rfind('?')]
+        _,obj = os.path.split(path)
+        fname = json_h.get_unique_fname(self.out_dir + path, obj)
+        if Verbose > 2:
+            print ('fname: {} path: {} outdir: {}'.format(fname, path, self.out_dir))
+        return obj, '{}/{}/{}'.format(self.out_dir,path,fname)
+
+    def is_resumed (self, url, outfile):
+        """ true if the page was saved by the run being resumed """
+        if not (self.checkpoint and self.checkpoint.is_done(url, outfile)):
+            return False
+        if Verbose > 1:
+            print ("   = Resuming {} from checkpoint".format(unquote(outfile)))
+        return True
+
+    def open_page (self, url):
+        """ (collection / object name, page file, resumed) of link url. see page_file() / is_resumed() """
+        obj, outfile = self.page_file (url)
+        return obj, outfile, self.is_resumed (url, outfile)
+
+    def page_query (self, url, obj, collection):
+        """ (select, where) of the first page of a collection
+            per collection projection / filter from user config (next pages carry them in nextPageUri)
+        """
+        if Verbose > 1:
+            print ("Processing link {}".format(url))
+        if not collection:
+            return None, None
+        select = self.select.get(unquote(obj))
+        where = self.where.get(unquote(obj))
+        if self.scope:
+            # scope name globs are filtered on the broker too
+            where = merge_where(where, self.scope.where(url, self.schema))
+        return select, where
+
+    def page_fetched (self, url, outfile, json_data):
+        """ record a fetched page. returns False for an error page (nothing to save) """
+        if self.negative_cache:
+            self.negative_cache.record (url, json_data)
+        return self.keep_page (url, outfile, json_data)
+
+    def keep_page (self, url, outfile, json_data):
+        """ false for an error page: it has no config and isn't written to disk
+            out of scope objects the broker returned (globs not sent as where=) are dropped
+        """
+        if json_data.get('meta', {}).get('responseCode') == 200:
+            if self.scope:
+                self.scope.filter_page (url, json_data, self.schema)
+            if Verbose > 1:
+                print ("Save json to file: {}".format (outfile))
+            return True
+        if self.checkpoint:
+            self.checkpoint.mark (url, outfile, json_data)
+        return False
+
+    def on_saved (self, url, outfile, json_data):
+        """ callback once the page file is on disk (checkpoint). None without a checkpoint """
+        if not self.checkpoint:
+            return None
+        return lambda: self.checkpoint.mark (url, outfile, json_data)
+
+    def add_page (self, url, outfile, json_data):
+        if self.assembler:
+            self.assembler.add_page (url, json_data, outfile)
+
+    def incremental_select (self, url):
+        """ select= of the cheap pass of collection url. None if it is fetched in full """
+        if not self.incremental:
+            return None
+        segs = SempSchema.url_segments(url)
+        # collections with a user projection / filter are fetched as configured
+        if not segs or self.select.get(segs[-1]) or self.where.get(segs[-1]):
+            return None
+        if self.scope and self.scope.applies(url):
+            return None
+        return self.incremental.select_for(url, self.schema)
+
+    def next_cheap_page (self, cheap_pages):
+        """ nextPageUri of the cheap pass, None when it is complete or failed """
+        meta = cheap_pages[-1].get('meta', {})
+        if meta.get('responseCode') == 200 and 'paging' in meta:
+            return meta['paging']['nextPageUri']
+        return None
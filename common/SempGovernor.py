@@ -0,0 +1,162 @@
+##############################################################################
+# SempGovernor
+#   Per broker SEMP traffic governor shared by all SempHandlers
+#   Caps requests in flight to the broker and adapts the cap AIMD style:
+#   +1 per round of fast successful requests, halved on 429 / 503 /
+#   timeouts / slow responses. Retryable failures are retried with
+#   exponential backoff and full jitter
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import time
+import random
+import asyncio
+import inspect
+import threading
+
+Verbose = 0
+Governors = {}   # one governor per broker (see get_governor)
+GovernorLock = threading.Lock()
+SafeVerbs = ('get',)          # retried on any retryable failure
+UnsafeRetryStatus = (429, 503) # the broker refused the request. it was not applied
+
+def get_governor(cfg, verbose=0):
+    """ return governor for the broker in cfg['router'] (shared per sempUrl, sempUser like http sessions) """
+    rtr_cfg = cfg["router"]
+    key = (rtr_cfg["sempUrl"], rtr_cfg["sempUser"])
+    with GovernorLock:
+        if key not in Governors:
+            Governors[key] = SempGovernor(rtr_cfg["label"], cfg["system"]["semp"].get("governor", {}), verbose)
+        return Governors[key]
+
+def wake(waiter):
+    """ end the wait of a task in acquire_async (runs on its event loop) """
+    if not waiter.done():
+        waiter.set_result(None)
+
+def governor_summaries():
+    with GovernorLock:
+        return [g.summary() for g in Governors.values()]
+
+
+class SempGovernor():
+    """ Adaptive in-flight cap, retry and backoff policy for one broker """
+
+    def __init__(self, label, gov_cfg, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} broker: {} cfg: {}'.format(__class__.__name__, inspect.stack()[0][3], label, gov_cfg))
+        self.label = label
+        self.min_inflight = gov_cfg.get("minInflight", 1)
+        self.max_inflight = gov_cfg.get("maxInflight", 16)
+        self.limit = float(min(self.max_inflight, gov_cfg.get("initialInflight", 4)))
+        self.slow_latency = gov_cfg.get("slowLatency", 5.0)   # seconds. slower responses count as congestion
+        self.decrease = gov_cfg.get("decreaseFactor", 0.5)
+        self.retries = gov_cfg.get("retries", 4)
+        self.backoff_base = gov_cfg.get("backoffBase", 0.5)
+        self.backoff_max = gov_cfg.get("backoffMax", 30)
+        self.retry_status = gov_cfg.get("retryStatus", [429, 502, 503, 504])
+        self.inflight = 0
+        self.last_decrease = 0
+        self.cond = threading.Condition()
+        self.waiters = [] # (event loop, future) of tasks waiting in acquire_async
+        self.stats = {'requests': 0, 'retries': 0, 'congested': 0, 'decreases': 0,
+                      'peak': 0, 'low': self.limit}
+
+    #-------------------------------------------------------------
+    # in-flight cap
+    #
+    def try_acquire(self):
+        """ take an in-flight slot if one is free """
+        with self.cond:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            self.stats['requests'] += 1
+            self.stats['peak'] = max(self.stats['peak'], self.inflight)
+            return True
+
+    def acquire(self):
+        """ wait for an in-flight slot """
+        with self.cond:
+            self.cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+            self.stats['requests'] += 1
+            self.stats['peak'] = max(self.stats['peak'], self.inflight)
+
+    async def acquire_async(self):
+        """ wait for an in-flight slot without blocking the event loop
+            slots are shared with threads, so release() wakes waiting tasks through their loop
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if self.try_acquire():
+                    return
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self.cond:
+                    if (loop, waiter) in self.waiters:
+                        self.waiters.remove((loop, waiter))
+
+    def release(self, latency, congested=False):
+        """ give back the slot and adapt the cap from the outcome of the request """
+        with self.cond:
+            self.inflight -= 1
+            if congested or latency > self.slow_latency:
+                self.stats['congested'] += 1
+                # decrease at most once per round trip, not once per failed request in flight
+                now = time.monotonic()
+                if now - self.last_decrease > max(latency, 0.1):
+                    self.limit = max(self.min_inflight, self.limit * self.decrease)
+                    self.last_decrease = now
+                    self.stats['decreases'] += 1
+                    self.stats['low'] = min(self.stats['low'], self.limit)
+                    if Verbose:
+                        print ('   ! {}: SEMP congestion. in-flight cap now {}'.format(self.label, int(self.limit)))
+            else:
+                self.limit = min(self.max_inflight, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+            for loop, waiter in self.waiters:
+                loop.call_soon_threadsafe(wake, waiter)
+            self.waiters = []
+
+    #-------------------------------------------------------------
+    # retry policy
+    #
+    def should_retry(self, attempt, verb=None, status_code=None, timeout=False, connect_error=False):
+        """ true if the request can be sent again
+            only GET is idempotent. other verbs (POST, action PUTs like copyMsgFromQueue, ...)
+            are retried only if the broker never got them (connect failure) or refused them
+            (429 / 503): a timeout or a 502 / 504 after the request was sent may have been applied
+        """
+        if attempt >= self.retries:
+            return False
+        if status_code is not None:
+            if verb not in SafeVerbs and status_code not in UnsafeRetryStatus:
+                return False
+            return status_code in self.retry_status
+        if connect_error:
+            return True
+        return timeout and verb in SafeVerbs
+
+    def backoff(self, attempt, retry_after=None):
+        """ seconds to wait before retry attempt (0 based). full jitter, Retry-After header wins """
+        with self.cond:
+            self.stats['retries'] += 1
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def summary(self):
+        st = self.stats
+        return '{}: {} requests, {} retries, {} congested, in-flight cap {} (low {}, peak in flight {})'.format(
+            self.label, st['requests'], st['retries'], st['congested'], int(self.limit), int(st['low']), st['peak'])
@@ -3,46 +3,239 @@
 # SempHandler
 #   Simmplified SEMPv2 protocol handler
 #   Supports GET, POST, PATCH, PUT, DELETE
-#   This has no paging support
+#   Crawl follows nextPageUri paging iteratively (no recursion)
+#   All requests go over a pooled keep-alive http session per broker
+#   and thru the broker governor (in-flight cap, retry with backoff)
+#   Every request is timed and counted in SempMetrics
 #
 # Ramesh Natarajan (nram@nram.dev)
 ##############################################################################
 
 import sys, os
-import argparse
 import pprint
 import json
 import requests
 import inspect
-import shutil
-import urllib
-import pathlib
+import ssl
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from requests.auth import HTTPBasicAuth
-from zipfile import ZipFile
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 # from os.path import basename
-from datetime import datetime
 from urllib.parse import unquote # for Python 3.7
 
 sys.path.insert(0, os.path.abspath("."))
 from common import JsonHandler
+from common import SempGovernor
+from common import SempMetrics
+from common.SempCrawler import SempCrawler
 
 pp = pprint.PrettyPrinter(indent=4)
 Verbose = 0
 Cfg = {}
 json_h = JsonHandler.JsonHandler()
 log = None
-
-
-class SempHandler:
+Sessions = {}   # pooled http sessions, one per broker (see get_session)
+SessionLock = threading.Lock()
+
+
+class SempHttpAdapter(HTTPAdapter):
+    """ HTTPAdapter that hands the same SSL context to every pooled connection """
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def get_session(cfg):
+    """ return pooled http session for the broker in cfg['router']
+        sessions are cached per broker (sempUrl, sempUser) and shared by all SempHandlers
+    """
+    rtr_cfg = cfg["router"]
+    sess_cfg = cfg["system"]["semp"].get("session", {})
+    key = (rtr_cfg["sempUrl"], rtr_cfg["sempUser"])
+    with SessionLock:
+        if key in Sessions:
+            return Sessions[key]
+
+        # build TLS context once per broker. verify is off by default (self-signed broker certs)
+        verify = rtr_cfg.get("sslVerify", False)
+        if verify:
+            ssl_ctx = ssl.create_default_context(cafile=rtr_cfg.get("caBundle"))
+        else:
+            ssl_ctx = ssl.create_default_context()
+            ssl_ctx.check_hostname = False
+            ssl_ctx.verify_mode = ssl.CERT_NONE
+
+        adapter = SempHttpAdapter(ssl_context=ssl_ctx,
+                                  pool_connections=sess_cfg.get("poolConnections", 4),
+                                  pool_maxsize=sess_cfg.get("poolMaxSize", 16),
+                                  pool_block=sess_cfg.get("poolBlock", False))
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.auth = HTTPBasicAuth(rtr_cfg["sempUser"], rtr_cfg["sempPassword"])
+        session.headers.update({"content-type": "application/json"})
+        if not sess_cfg.get("keepAlive", True):
+            session.headers.update({"Connection": "close"})
+        session.verify = rtr_cfg.get("caBundle", True) if verify else False
+        Sessions[key] = session
+        return session
+
+
+class SempResponse():
+    """ SEMP http response returned by all verbs
+        body is decoded from json once, on first use. meta / data / links / paging read the decoded body
+    """
+
+    NotDecoded = object()
+
+    def __init__(self, status_code, content, headers=None, encoding=None):
+        self.status_code = status_code
+        self.content = content    # raw body bytes
+        self.headers = headers if headers is not None else {}
+        self.encoding = encoding or 'utf-8'
+        self._json = SempResponse.NotDecoded
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.content.decode(self.encoding, errors='replace')
+        return self._text
+
+    def json(self):
+        """ decoded body (cached). raises ValueError if body is not json """
+        if self._json is SempResponse.NotDecoded:
+            self._json = json.loads(self.content)
+        return self._json
+
+    @property
+    def meta(self):
+        body = self.json()
+        return body.get('meta', {}) if isinstance(body, dict) else {}
+
+    @property
+    def data(self):
+        return self.json().get('data', [])
+
+    @property
+    def links(self):
+        return self.json().get('links', [])
+
+    @property
+    def paging(self):
+        return self.meta.get('paging', {})
+
+    @property
+    def response_code(self):
+        return self.meta.get('responseCode', self.status_code)
+
+    @property
+    def error(self):
+        """ meta.error: {status, description, code} ({} on success) """
+        return self.meta.get('error', {})
+
+    def __repr__(self):
+        return '<SempResponse [{}]>'.format(self.status_code)
+
+
+class LazyJson():
+    """ pretty json for log records. formatted only if the record is emitted (log.debug('%s', LazyJson(data))) """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, indent=4, sort_keys=True)
+
+
+def is_connect_error(e):
+    """ true if the request never reached the broker (connection not made). not if it was cut after sending """
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = e.args[0] if e.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)
+
+def close_sessions():
+    """ close all pooled http sessions """
+    with SessionLock:
+        for session in Sessions.values():
+            session.close()
+        Sessions.clear()
+
+
+class SempHandler(SempCrawler):
     """ Solace SEMPv2 Parser implementation """
-    
-    def __init__(self, cfg, vpn="default", outdir = "output/default", verbose = 0):
+
+    def __init__(self, cfg, vpn="default", outdir = "output/default", verbose = 0, checkpoint = None, schema = None, negative_cache = None, scope = None, writer = None, assembler = None, incremental = None):
         global Verbose, Cfg, log
         Verbose = verbose
         log = cfg['log_handler'].get()
         Cfg = cfg
-        self.vpn = vpn
-        self.out_dir = outdir
+        self.rtr_cfg = cfg["router"] # broker of this handler (Cfg is shared by handlers of all brokers)
+        # crawl state and page bookkeeping (SempCrawler)
+        self.init_crawl(cfg, vpn, outdir, verbose, checkpoint, schema, negative_cache, scope, writer, assembler, incremental)
+        self.session = get_session(cfg)
+        self.timeout = cfg["system"]["semp"].get("session", {}).get("timeout")
+        self.governor = SempGovernor.get_governor(cfg, verbose) # shared per broker
+
+
+    #-------------------------------------------------------------
+    # request
+    #   every verb goes thru the broker governor: waits for an in-flight slot,
+    #   retries throttled / timed out requests with backoff
+    #
+    def request(self, verb, url, params=None, data=None):
+        attempt = 0
+        while True:
+            self.governor.acquire()
+            start = time.monotonic()
+            try:
+                resp = self.session.request(verb, url, params=params, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                latency = time.monotonic() - start
+                timeout = isinstance(e, requests.Timeout)
+                self.governor.release(latency, congested=timeout)
+                SempMetrics.Metrics.record(self.rtr_cfg["label"], verb, url, latency, 0, type(e).__name__)
+                # a request cut after it was sent (eg: RemoteDisconnected) may have been applied
+                if verb in SempGovernor.SafeVerbs:
+                    connect_error = isinstance(e, requests.ConnectionError)
+                else:
+                    connect_error = is_connect_error(e)
+                if not self.governor.should_retry(attempt, verb, timeout=timeout, connect_error=connect_error):
+                    raise
+                reason = type(e).__name__
+                delay = self.governor.backoff(attempt)
+            else:
+                latency = time.monotonic() - start
+                congested = resp.status_code in self.governor.retry_status
+                self.governor.release(latency, congested)
+                SempMetrics.Metrics.record(self.rtr_cfg["label"], verb, url, latency, len(resp.content), resp.status_code)
+                if not (congested and self.governor.should_retry(attempt, verb, resp.status_code)):
+                    return SempResponse(resp.status_code, resp.content, resp.headers, resp.encoding)
+                reason = resp.status_code
+                delay = self.governor.backoff(attempt, resp.headers.get('Retry-After'))
+            attempt += 1
+            log.info('SEMP {} {} failed ({}). retry {} in {:.2f}s'.format(verb.upper(), url, reason, attempt, delay))
+            if Verbose:
+                print ('   ! {} {} failed ({}). retry {} in {:.2f}s'.format(verb.upper(), unquote(url), reason, attempt, delay))
+            time.sleep(delay)
 
 
     #-------------------------------------------------------------  
@@ -56,28 +249,10 @@ class SempHandler:
         if Verbose > 2:
             print ('SEMP GET url: {}'.format(url))
         verb = 'get'
-        semp_user = Cfg["router"]["sempUser"]
-        semp_pass = Cfg["router"]["sempPassword"]
-        hdrs = {"content-type": "application/json"}
-        auth = HTTPBasicAuth(semp_user, semp_pass)
-        if params:
-            resp = getattr(requests, verb)(url, 
-                headers=hdrs,
-                auth=auth,
-                params=params,
-                data=None,
-                verify=False)
-        else:
-            resp = getattr(requests, verb)(url, 
-                headers=hdrs,
-                auth=auth,
-                data=None,
-                verify=False)
+        resp = self.request(verb, url, params=params)
         log.info ('SEMP GET returned: {}'.format(resp))
-
-        #log.info ('SEMP GET returned: {}'.format(json.dump(resp, indent=4, sort_keys=True)))
         if Verbose > 2:
-            print ('http_get returned: {}'.format(json.dump(resp, indent=4, sort_keys=True)))
+            print ('http_get returned: {}'.format(json.dumps(resp.json(), indent=4, sort_keys=True)))
 
         return resp
 
@@ -88,32 +263,26 @@ class SempHandler:
         if Verbose > 2:
             print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
         log.info('SEMP POST url: {}'.format(url))
-        log.info ('SEMP posting json-data: {}'.format (json.dumps(json_data, indent=4, sort_keys=True)))
+        log.debug ('SEMP posting json-data: %s', LazyJson(json_data))
         verb = 'post'
-        semp_user = Cfg["router"]["sempUser"]
-        semp_pass = Cfg["router"]["sempPassword"]
-        resp = getattr(requests, verb)(url, 
-            headers={"content-type": "application/json"},
-            auth=(semp_user, semp_pass),
-            data=(json.dumps(json_data) if json_data != None else None),
-            verify=False)
+        resp = self.request(verb, url,
+            data=(json.dumps(json_data) if json_data != None else None))
         if Verbose > 2:
             print ('http_post resp : {}'.format(resp))
-            print ("     resp text :"); pp.pprint (json.loads(resp.text))
-        json_resp = json.loads(resp.text)
+            print ("     resp text :"); pp.pprint (resp.json())
 
-        log.info ('SEMP POST returned: {}'.format(json.dumps(json_resp, indent=4, sort_keys=True)))
+        log.info ('SEMP POST returned: {} {}'.format(resp, resp.error.get('status', 'OK')))
+        log.debug ('SEMP POST response: %s', LazyJson(resp.json()))
 
-        if json_resp['meta']['responseCode'] == 200:
+        if resp.response_code == 200:
             if Verbose:
-                print (' http_post returned ', json_resp['meta']['responseCode'])
+                print (' http_post returned ', resp.response_code)
             return "OK"          
         else:
-            print ("         http_post retunred {} ({})".format(json_resp['meta']['responseCode'],
-                                            json_resp['meta']['error']['status']))
+            print ("         http_post retunred {} ({})".format(resp.response_code, resp.error['status']))
             if Verbose:
-                print (json_resp['meta']['error']['description'])
-            return json_resp['meta']['error']['status']
+                print (resp.error['description'])
+            return resp.error['status']
 
         #return resp
     
@@ -124,34 +293,27 @@ class SempHandler:
         if Verbose > 2:
             print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
         log.info('SEMP PATCH url: {}'.format(url))
-        log.info ('SEMP patching json-data: {}'.format(json.dumps(json_data, indent=4, sort_keys=True)))
+        log.debug ('SEMP patching json-data: %s', LazyJson(json_data))
         if Verbose > 2:
             print ('patching json-data:\n', json.dumps(json_data, indent=4, sort_keys=True))
 
         verb = 'patch'
-        semp_user = Cfg["router"]["sempUser"]
-        semp_pass = Cfg["router"]["sempPassword"]
-        resp = getattr(requests, verb)(url, 
-            headers={"content-type": "application/json"},
-            auth=(semp_user, semp_pass),
-            data=(json.dumps(json_data) if json_data != None else None),
-            verify=False)
+        resp = self.request(verb, url,
+            data=(json.dumps(json_data) if json_data != None else None))
         if Verbose > 2:
             print ('http_patch resp : {}'.format(resp))
-            print ("     resp text :"); pp.pprint (json.loads(resp.text))
-        json_resp = json.loads(resp.text)
+            print ("     resp text :"); pp.pprint (resp.json())
 
-        #log.info ('SEMP PATCH returned: {}'.format(json_resp))
+        log.info ('SEMP PATCH returned: {} {}'.format(resp, resp.error.get('status', 'OK')))
+        log.debug ('SEMP PATCH response: %s', LazyJson(resp.json()))
 
-        log.info ('SEMP PATCH returned: {}'.format(json.dumps(json_resp, indent=4, sort_keys=True)))
-
-        if json_resp['meta']['responseCode'] == 200:
+        if resp.response_code == 200:
             if Verbose:
-                print (' http_patch returned ', json_resp['meta']['responseCode'])            
+                print (' http_patch returned ', resp.response_code)
         else:
-            print ("         http_patch retunred {} ({}) : {}".format(json_resp['meta']['responseCode'],
-                                                          json_resp['meta']['error']['status'],
-                                                          json_resp['meta']['error']['description']))
+            print ("         http_patch retunred {} ({}) : {}".format(resp.response_code,
+                                                          resp.error['status'],
+                                                          resp.error['description']))
 
         return resp
     
@@ -162,19 +324,15 @@ class SempHandler:
         if Verbose > 2:
             print ("Entering {}:{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
         log.info('SEMP PUT url: {}'.format(url))
-        log.info('SEMP putting json-data: {}'.format(json.dumps(json_data, indent=4, sort_keys=True)))
+        log.debug('SEMP putting json-data: %s', LazyJson(json_data))
         if Verbose > 2:
             print ('posting json-data:\n', json.dumps(json_data, indent=4, sort_keys=True))
         verb = 'put'
-        semp_user = Cfg["router"]["sempUser"]
-        semp_pass = Cfg["router"]["sempPassword"]
-        resp = getattr(requests, verb)(url, 
-            headers={"content-type": "application/json"},
-            auth=(semp_user, semp_pass),
-            data=(json.dumps(json_data) if json_data != None else None),
-            verify=False)
+        resp = self.request(verb, url,
+            data=(json.dumps(json_data) if json_data != None else None))
         
-        log.info ('SEMP PUT returned: {}'.format(json.dump(resp.json(), indent=4, sort_keys=True)))
+        log.info ('SEMP PUT returned: {}'.format(resp))
+        log.debug ('SEMP PUT response: %s', LazyJson(resp.json()))
         if Verbose > 2:
             print ('http_put returning : {}'.format(resp))
         return resp
@@ -188,29 +346,24 @@ class SempHandler:
         ignore_status = ['INVALID_PATH']
 
 
-        semp_user = Cfg["router"]["sempUser"]
-        semp_pass = Cfg["router"]["sempPassword"]
+        semp_user = self.rtr_cfg["sempUser"]
         
         log.info('SEMP DELETE url: {}'.format(url))
 
         if Verbose:
             print("   DELETE URL {} ({})".format(unquote(url), semp_user))
    
-        resp = requests.delete(url, 
-            headers={"content-type": "application/json"},
-            auth=(semp_user, semp_pass),
-            data=(None),
-            verify=False)
+        resp = self.request('delete', url)
         
         log.info ('SEMP DELETE returned: {}'.format(resp))
         if Verbose:
-            print ('http_delete returning : {}'.format(json.dump(resp.json(), indent=4, sort_keys=True)))
+            print ('http_delete returning : {}'.format(json.dumps(resp.json(), indent=4, sort_keys=True)))
         if Verbose > 2:
             print('Response:\n%s',resp.json())
         if (resp.status_code != 200):
             print ('Non-200 Response text: {}'.format(resp.text))
-            status = resp.json()['meta']['error']['status']
-            desc = resp.json()['meta']['error']['description']
+            status = resp.error['status']
+            desc = resp.error['description']
 
             if status in ignore_status:
                 print (f'Ignoring non success status {status}')
@@ -220,157 +373,152 @@ class SempHandler:
     # Higer order functions for get
     #-------------------------------------------------------------
 
+    def get_semp_version (self):
+        """ return broker SEMP API version (about/api sempVersion) or None if not available """
+        url = "{}/{}/about/api".format(self.rtr_cfg["sempUrl"], Cfg["system"]["semp"]["configUrl"])
+        try:
+            resp = self.http_get(url)
+            if resp.status_code == 200:
+                return resp.data['sempVersion']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            log.info('Unable to get SEMP version: {}'.format(e))
+        return None
+
     def get_vpn_config_json (self, url):
         """ get vpn config json """
         return self.get_config_json(url)
 
-    def get_config_json (self, url, collections=False, paging=True):
-        """ get vpn object config json """
+    def get_config_json (self, url, collections=False, paging=True, select=None, where=None):
+        """ get vpn object config json
+            select: attribute names to return (SEMP select=), where: filter conditions (SEMP where=)
+        """
         if Verbose > 2:
             print ('Entering {}::{} url = {}'.format(__class__.__name__, inspect.stack()[0][3], url))
-        verb='get'
-
-        sys_cfg = Cfg['system']
-        page_size = sys_cfg["semp"]["pageSize"]
-        no_paging = sys_cfg["semp"]["noPaging"]
-
         u_url = unquote(url)
-        if collections:
-            if int(page_size) == 0:
-                paging = False
-            # some elements throw 400 not supported if page count is sent
-            if os.path.split(url)[1] in no_paging:
-                paging = False
-                if Verbose:
-                    print ("Skipping paging for element {}".format(os.path.split(u_url)[1]))
-            if paging :
-                if Verbose:
-                    print("   Get URL {} [{}] (*)".format(u_url, page_size))
-                params = {'count':page_size}
-                resp = self.http_get(url, params)
-            else:
-                if Verbose:
-                    print ("   Get URL {} (*)".format(u_url))
-                resp = self.http_get(url)
-        else:
-            # No paging for non-collection objects
-            if Verbose:
-                print("   Get URL {}".format(u_url))
-            resp = self.http_get(url) 
+        resp = self.http_get(url, self.get_params(url, collections, paging, select, where))
 
         if Verbose > 2:
             print("Get: req.json()")
             pp.pprint(resp.json())
         if (resp.status_code != 200):
-            print(f'**** Get URL {u_url} failed ****')
+            # failures are summarized at the end of the run (see NegativeCache)
+            log.info(f'**** Get URL {u_url} failed ({resp.status_code}) ****')
             if Verbose:
+                print(f'**** Get URL {u_url} failed ****')
                 print(resp.text)
-            return resp.json()
-
-            #raise RuntimeError
-        else:
-            return resp.json()
+        # decoded once in SempResponse, also for the debug print above
+        return resp.json()
 
     def process_page_links (self, json_data):
-        """ given json data, traverse thur all links in meta section 
-            calls itself recursively  
+        """ given json data, traverse thru all links in meta section
+            uses an explicit frontier of link urls instead of recursion, so stack depth
+            stays constant and each page is released once it is written
         """
         if Verbose > 2:
             print ("Entering {}::{}".format( __class__.__name__, inspect.stack()[0][3]))
-        if Verbose > 2:
-            pp.pprint (json_data)
 
-        if 'links' not in json_data:
+        frontier = deque(self.get_page_links(json_data))
+        if len(frontier) == 0:
             if Verbose:
                 print ("No Links")
             return
-
-        if type(json_data['links']) is list:
-            for link_list in json_data['links']:
-                link_keys = list(link_list.keys())
-                #print ("   got {:d} link-lists: {:s}". format(len(lkeys), lkeys))
-                if 'uri' in link_keys:
-                    link_keys.remove('uri') 
-                if len(link_keys) == 0 :
-                    if Verbose > 2:
-                        print ("No non-uri links in list")
-                    return       
-                #print ("   processing {:d} links: {:s}".format(len(lkeys), lkeys))
-                for l in link_keys:
-                    lurl = link_list[l]
-                    link_data = self.get_link_data (lurl, True)
-                    self.process_page_links(link_data)
-        else:
-            link_keys = list(json_data['links'].keys())
-            #print ("   got {:d} links: {:s}". format(len(lkeys), lkeys))
-            if 'uri' in link_keys:
-                link_keys.remove('uri') 
-            if len(link_keys) == 0 :
-                if Verbose > 2:
-                    print ("No non-uri links in non-list")
-                return       
-            #print ("   processing {:d} links: {:s}".format(len(lkeys), lkeys))
-            for link_key in link_keys:
-                link_url = json_data['links'][link_key]
-                link_data = self.get_link_data (link_url, True)
-                self.process_page_links (link_data)
-
-    def get_link_data (self, url, collection, paging=True, follow_links=True):
-        """ process one link url, calls get_config_json() & save_config_json """
-
+        while frontier:
+            link_url = frontier.popleft()
+            # depth first: links found under this link are processed next
+            frontier.extendleft(reversed(self.get_link_chain(link_url)))
+
+    def process_page_links_parallel (self, json_data, workers):
+        """ given json data, traverse thru all links with a bounded pool of workers
+            each link (with its nextPageUri chain) is fetched by one worker, in page order
+            links found on the fetched pages are submitted back to the pool
+        """
+        if Verbose > 2:
+            print ("Entering {}::{} workers = {}".format( __class__.__name__, inspect.stack()[0][3], workers))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for link_url in self.get_page_links(json_data):
+                pending.add(pool.submit(self.get_link_chain, link_url))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    for link_url in f.result():
+                        pending.add(pool.submit(self.get_link_chain, link_url))
+
+    def get_link_chain (self, url):
+        """ process one link url and its nextPageUri chain in order
+            returns list of links found on all the pages (not followed here)
+        """
         if Verbose > 2:
-            print ("Entering {}::{} url = {}, collection = {}, links = {}".format( __class__.__name__, inspect.stack()[0][3], url, collection, follow_links))
-        #ph,obj = os.path.split(url)
-
-        #path=url[url.find('/msgVpns/')+8:]
-        #if path.rfind('?')>0:
-        #    path=path[:path.rfind('?')]
-        #_,obj = os.path.split(path)
-        #path=urllib.parse.unquote(path)
-
-        p = url.partition(self.vpn)
-        path=p[2]
-        if path.rfind('?')>0:
-            path=path[:path.rfind('?')]
-        _,obj = os.path.split(path)
-        #print (f'p: {p}')
-        #print (f'old url: {url} path: {path} obj: {obj}')
-
-        if Verbose > 1:
-            print ("Processing link {}".format(url))  
-        json_data = self.get_config_json (url, collection, paging)
+            print ("Entering {}::{} url = {}".format( __class__.__name__, inspect.stack()[0][3], url))
+        if self.skip_link(url):
+            return []
+        # links of leaf collections (object uri only) are not followed
+        leaf = self.schema.is_leaf(url)
+        # a first page saved by the run being resumed is read back: no cheap pass
+        page = self.open_page (url)
+        # incremental capture: pages of the collection rebuilt from the last snapshot (empty: fetch them)
+        pages = deque([] if page[2] else self.get_incremental_pages (url) or [])
+        json_data = self.get_page_data (url, True, json_data=pages.popleft() if pages else None, page=page)
+        link_urls = [] if leaf else self.get_page_links (json_data)
+        next_page_uri = self.next_page (json_data)
+        while next_page_uri:
+            # don't use collection for nextPage. page count is part of nextPage URL already
+            json_data = self.get_page_data (next_page_uri, False, False, pages.popleft() if pages else None)
+            if not leaf:
+                link_urls.extend(self.get_page_links (json_data))
+            next_page_uri = self.next_page (json_data)
+        return link_urls
+
+    def get_incremental_pages (self, url):
+        """ list collection url with a select= pass of its key and fingerprint attributes
+            returns its full pages (rebuilt from the last snapshot), None if it has to be fetched in full
+        """
+        select = self.incremental_select (url)
+        if select is None:
+            return None
+        cheap_pages = [self.get_config_json (url, True, True, select)]
+        next_page_uri = self.next_cheap_page (cheap_pages)
+        while next_page_uri:
+            cheap_pages.append(self.get_config_json (next_page_uri))
+            next_page_uri = self.next_cheap_page (cheap_pages)
+        if cheap_pages[-1].get('meta', {}).get('responseCode') != 200:
+            return None
+        rebuilt = self.incremental.rebuild(url, cheap_pages, select)
+        if rebuilt is None:
+            return None
+        pages, changed = rebuilt
+        return self.incremental.complete(url, pages, changed, [self.get_config_json (uri) for _, _, uri in changed])
+
+    def get_page_data (self, url, collection, paging=True, json_data=None, page=None):
+        """ get one page of link url, calls get_config_json() & save_config_json
+            json_data: page already at hand (incremental capture), saved without a GET
+            page: open_page() of url, if the caller already has it
+        """
+        if Verbose > 2:
+            print ("Entering {}::{} url = {}, collection = {}".format( __class__.__name__, inspect.stack()[0][3], url, collection))
+        obj, outfile, resumed = page or self.open_page (url)
+        if resumed:
+            json_data = json_h.read_json_file (unquote(outfile))
+            self.add_page (url, outfile, json_data)
+            return json_data
+
+        if json_data is None:
+            select, where = self.page_query (url, obj, collection)
+            json_data = self.get_config_json (url, collection, paging, select, where)
+            if not self.page_fetched (url, outfile, json_data):
+                return json_data
+        elif not self.keep_page (url, outfile, json_data):
+            return json_data
 
         # Write data to file
-        fname = json_h.get_unique_fname(path, obj)
-        if Verbose > 2:
-            print ('fname: {} path: {} outdir: {}'.format(fname, path, self.out_dir))
-        outfile = '{}/{}/{}'.format(self.out_dir,path,fname)
-
-        if Verbose > 1:
-            print ("Save json to file: {}".format (outfile))
-        json_h.save_config_json (outfile, json_data )
-
-        # Process meta - look for cursor/paging
-        meta_data = json_data['meta']
-        if 'paging' in meta_data:
-            if Verbose > 2:
-                print  ("paging : {}".format(meta_data['paging']))
-            next_page_uri = meta_data['paging']['nextPageUri']
-            if Verbose > 1:
-                print ("Processig Next Page URI : %s", unquote(next_page_uri))
-            # process nextPageUri - recursively
-            next_page_data = self.get_link_data (next_page_uri, False, False, follow_links) # don't use collection for nextPage
-                                                                        # don't add page count either. Its part of nextPage URL already
-            # for next-page-uri, call parent process_page_links() *** deep recursion ***
-            self.process_page_links (next_page_data)
-            #why wouldn't you follow links ???
-            #if follow_links:
-            #    if Verbose > 1:
-            #        print ('following links')
-            #    self.process_page_links (json_data)
-            #else:
-            #    print ('follow-links is off. Not following the link')
+        on_done = self.on_saved (url, outfile, json_data)
+        if self.writer:
+            # checkpoint is marked by the writer once the file is on disk
+            self.writer.write (outfile, json_data, on_done)
         else:
-            if Verbose > 1 :
-                print ('No paging in meta-data')
-        return json_data
\ No newline at end of file
+            json_h.save_config_json (outfile, json_data )
+            if on_done:
+                on_done()
+        self.add_page (url, outfile, json_data)
+        return json_data
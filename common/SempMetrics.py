@@ -0,0 +1,157 @@
+##############################################################################
+# SempMetrics
+#   Per request SEMP metrics: latency, response size, status
+#   Aggregated per broker and endpoint (verb + object path with names
+#   replaced by *, eg: GET msgVpns/*/queues/*/subscriptions)
+#   Printed as an end of run summary (p50 / p95 / p99, req/s, bytes/s) and
+#   optionally exported as a Prometheus textfile (.prom) or json file
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import json
+import math
+import time
+import threading
+from urllib.parse import urlsplit, unquote
+
+sys.path.insert(0, os.path.abspath("."))
+from common.SempSchema import url_segments
+from common.NegativeCache import endpoint_pattern
+
+# latency histogram buckets for Prometheus export (seconds)
+Buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+def endpoint_name(verb, url):
+    """ GET http://host/SEMP/v2/config/msgVpns/v1/queues/q1/subscriptions -> GET msgVpns/*/queues/*/subscriptions """
+    path = urlsplit(url, allow_fragments=False).path
+    if '/msgVpns/' in path:
+        pattern = endpoint_pattern(url_segments(url))
+        name = 'msgVpns/*/{}'.format(pattern) if pattern else 'msgVpns/*'
+    else:
+        # about/api, msgVpns list etc: path below SEMP/v2/<config|monitor|action>
+        segs = unquote(path).strip('/').split('/')
+        name = '/'.join(segs[3:]) if segs[:2] == ['SEMP', 'v2'] else '/'.join(segs)
+    return '{} {}'.format(verb.upper(), name)
+
+def percentile(sorted_values, p):
+    """ nearest rank percentile of sorted list """
+    if not sorted_values:
+        return 0
+    return sorted_values[max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)]
+
+
+class SempMetrics():
+    """ thread safe SEMP request metrics registry """
+
+    def __init__(self):
+        self.endpoints = {}   # (broker, endpoint) -> {latencies, bytes, status: {code: n}}
+        self.start = None
+        self.end = None
+        self.lock = threading.Lock()
+
+    def record(self, broker, verb, url, latency, size, status):
+        """ record one http request. status is the http status code or an error name (eg: ReadTimeout) """
+        key = (broker, endpoint_name(verb, url))
+        now = time.time()
+        with self.lock:
+            ep = self.endpoints.get(key)
+            if ep is None:
+                ep = self.endpoints[key] = {'latencies': [], 'bytes': 0, 'status': {}}
+            ep['latencies'].append(latency)
+            ep['bytes'] += size
+            ep['status'][str(status)] = ep['status'].get(str(status), 0) + 1
+            if self.start is None or now - latency < self.start:
+                self.start = now - latency
+            self.end = now if self.end is None else max(self.end, now)
+
+    def stats(self):
+        """ per endpoint stats list, slowest (total time) first """
+        elapsed = max((self.end or 0) - (self.start or 0), 1e-6)
+        with self.lock:
+            items = [(k, dict(ep, latencies=sorted(ep['latencies']))) for k, ep in self.endpoints.items()]
+        stats = []
+        for (broker, endpoint), ep in items:
+            lat = ep['latencies']
+            n_ok = sum(n for code, n in ep['status'].items() if code.startswith('2'))
+            stats.append({
+                'broker': broker,
+                'endpoint': endpoint,
+                'count': len(lat),
+                'errors': len(lat) - n_ok,
+                'status': ep['status'],
+                'bytes': ep['bytes'],
+                'total': sum(lat),
+                'p50': percentile(lat, 50),
+                'p95': percentile(lat, 95),
+                'p99': percentile(lat, 99),
+                'max': lat[-1],
+                'rps': len(lat) / elapsed,
+                'bps': ep['bytes'] / elapsed,
+                'buckets': [sum(1 for v in lat if v <= b) for b in Buckets],
+            })
+        return sorted(stats, key=lambda s: s['total'], reverse=True)
+
+    def summary(self, top=20):
+        """ end of run summary: totals and the endpoints that took the most time """
+        stats = self.stats()
+        if not stats:
+            return 'SEMP requests: none'
+        elapsed = max((self.end or 0) - (self.start or 0), 1e-6)
+        n = sum(s['count'] for s in stats)
+        n_bytes = sum(s['bytes'] for s in stats)
+        lines = ['SEMP requests: {} in {:.1f}s ({:.1f} req/s, {:.1f} KB/s), {} errors'.format(
+                    n, elapsed, n / elapsed, n_bytes / 1024.0 / elapsed, sum(s['errors'] for s in stats)),
+                 '   {:<12} {:<48} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8} {:>10}'.format(
+                    'broker', 'endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'total s', 'KB')]
+        for s in stats[:top]:
+            lines.append('   {:<12} {:<48} {:>6} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.2f} {:>10.1f}'.format(
+                s['broker'], s['endpoint'], s['count'], s['errors'],
+                s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000, s['total'], s['bytes'] / 1024.0))
+        if len(stats) > top:
+            lines.append('   ... {} more endpoints'.format(len(stats) - top))
+        return '\n'.join(lines)
+
+    def save(self, metrics_file):
+        """ export metrics. .prom -> Prometheus textfile (node_exporter textfile collector), else json """
+        path = os.path.dirname(metrics_file)
+        if path:
+            os.makedirs(path, exist_ok=True)
+        stats = self.stats()
+        if metrics_file.endswith('.prom'):
+            text = self.prometheus_text(stats)
+        else:
+            for s in stats:
+                s['buckets'] = dict(zip([str(b) for b in Buckets], s['buckets']))
+            text = json.dumps({'start': self.start, 'end': self.end, 'endpoints': stats}, indent=4, sort_keys=True)
+        # write to temp file and rename so a collector never reads a partial file
+        with open(metrics_file + '.tmp', 'w') as fp:
+            fp.write(text)
+        os.replace(metrics_file + '.tmp', metrics_file)
+
+    def prometheus_text(self, stats):
+        lines = ['# HELP semp_request_duration_seconds SEMP request latency',
+                 '# TYPE semp_request_duration_seconds histogram']
+        for s in stats:
+            labels = 'broker="{}",endpoint="{}"'.format(s['broker'], s['endpoint'])
+            for b, n in zip(Buckets, s['buckets']):
+                lines.append('semp_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, b, n))
+            lines.append('semp_request_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, s['count']))
+            lines.append('semp_request_duration_seconds_sum{{{}}} {:.6f}'.format(labels, s['total']))
+            lines.append('semp_request_duration_seconds_count{{{}}} {}'.format(labels, s['count']))
+        lines += ['# HELP semp_requests_total SEMP requests by status',
+                  '# TYPE semp_requests_total counter']
+        for s in stats:
+            for code, n in sorted(s['status'].items()):
+                lines.append('semp_requests_total{{broker="{}",endpoint="{}",status="{}"}} {}'.format(
+                    s['broker'], s['endpoint'], code, n))
+        lines += ['# HELP semp_response_bytes_total SEMP response body bytes',
+                  '# TYPE semp_response_bytes_total counter']
+        for s in stats:
+            lines.append('semp_response_bytes_total{{broker="{}",endpoint="{}"}} {}'.format(s['broker'], s['endpoint'], s['bytes']))
+        return '\n'.join(lines) + '\n'
+
+
+# one registry per process, shared by all SempHandlers
+Metrics = SempMetrics()
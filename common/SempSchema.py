@@ -0,0 +1,151 @@
+##############################################################################
+# SempSchema
+#   SEMPv2 config object tree (see config/semp-schema.yaml)
+#   Tells the crawler up front which collections exist under which parent,
+#   which support paging (count=), which are leaves and which need a newer
+#   SEMP version, so requests the broker is known to reject are never sent
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import inspect
+import threading
+from urllib.parse import urlsplit, unquote
+
+sys.path.insert(0, os.path.abspath("."))
+from common import YamlHandler
+
+Verbose = 0
+
+def url_segments(url):
+    """ path segments below msgVpns/<vpn>: [collection, object, collection, ...] """
+    path = urlsplit(url, allow_fragments=False).path
+    p = path.partition('/msgVpns/')
+    if not p[1]:
+        return []
+    segs = [unquote(s) for s in p[2].strip('/').split('/')]
+    return segs[1:]  # drop vpn name
+
+def version_tuple(version):
+    """ "2.36" -> (2, 36) for comparing SEMP versions """
+    return tuple(int(v) for v in str(version).split('.') if v.isdigit())
+
+
+class SempSchema():
+    """ SEMPv2 object tree schema """
+
+    def __init__(self, schema_file=None, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} schema: {}'.format(__class__.__name__, inspect.stack()[0][3], schema_file))
+        self.tree = {}
+        if schema_file:
+            yaml_h = YamlHandler.YamlHandler()
+            self.tree = yaml_h.read_config_file(schema_file).get('msgVpn', {}) or {}
+        self.semp_version = None
+        self.skipped = {}  # reason -> count
+        self.lock = threading.Lock()
+
+    def set_version(self, semp_version):
+        """ set broker SEMP version (about/api sempVersion). None disables version checks """
+        self.semp_version = semp_version
+        if Verbose and semp_version:
+            print ('   Broker SEMP version: {}'.format(semp_version))
+
+    def lookup(self, url):
+        """ return schema node of the collection url points to (None if not in schema) """
+        node = None
+        children = self.tree
+        for i, seg in enumerate(url_segments(url)):
+            if i % 2 == 1:
+                continue  # object name
+            node = children.get(seg)
+            if node is None:
+                return None
+            children = node.get('children', {}) or {}
+        return node
+
+    def key(self, type_path):
+        """ identifying attributes of objects of type path [collection, child collection, ...]. None if not in schema """
+        node = None
+        children = self.tree
+        for seg in type_path:
+            node = children.get(seg)
+            if node is None:
+                return None
+            children = node.get('children', {}) or {}
+        return node.get('key')
+
+    def check(self, url):
+        """ return reason string if url must not be requested, None if ok """
+        segs = url_segments(url)
+        node = None
+        children = self.tree
+        reason = None
+        for i, seg in enumerate(segs):
+            if i % 2 == 1:
+                # object name: some objects (templates) reject child requests
+                if i < len(segs) - 1 and seg in (node.get('skipChildrenFor') or []):
+                    reason = 'children of {}'.format(seg)
+                    break
+                continue
+            node = children.get(seg)
+            if node is None:
+                return None  # not in schema. let crawler discover it
+            if node.get('skip'):
+                reason = 'skip {}'.format(seg)
+                break
+            min_version = node.get('minVersion')
+            if min_version and self.semp_version and \
+                    version_tuple(self.semp_version) < version_tuple(min_version):
+                reason = '{} needs SEMP {}'.format(seg, min_version)
+                break
+            children = node.get('children', {}) or {}
+        if reason:
+            with self.lock:
+                self.skipped[reason] = self.skipped.get(reason, 0) + 1
+            if Verbose > 1:
+                print ('   - Schema skip {} ({})'.format(unquote(url), reason))
+        return reason
+
+    def paging(self, url):
+        """ True/False if schema knows whether collection supports count=, else None """
+        node = self.lookup(url)
+        if node is None:
+            return None
+        return node.get('paging', True)
+
+    def is_leaf(self, url):
+        """ true if objects of this collection have no child collections to follow """
+        node = self.lookup(url)
+        return node is not None and node.get('leaf', False)
+
+    def plan(self):
+        """ list of collection paths the crawl will request (after skip / version checks) """
+        paths = []
+        stack = [('', self.tree)]
+        while stack:
+            base, children = stack.pop()
+            for name in sorted(children, reverse=True):
+                node = children[name] or {}
+                if node.get('skip'):
+                    continue
+                min_version = node.get('minVersion')
+                if min_version and self.semp_version and \
+                        version_tuple(self.semp_version) < version_tuple(min_version):
+                    continue
+                path = '{}{}'.format(base, name)
+                paths.append(path)
+                skip_for = node.get('skipChildrenFor')
+                obj = '*' if not skip_for else '*(not {})'.format(','.join(skip_for))
+                stack.append(('{}/{}/'.format(path, obj), node.get('children', {}) or {}))
+        return sorted(paths)
+
+    def summary(self):
+        n = sum(self.skipped.values())
+        s = 'Schema: {} requests not sent'.format(n)
+        if n:
+            s = '{} ({})'.format(s, ', '.join('{}: {}'.format(k, v) for k, v in sorted(self.skipped.items())))
+        return s
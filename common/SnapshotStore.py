@@ -0,0 +1,205 @@
+##############################################################################
+# SnapshotStore
+#   Content addressed store for VPN config snapshots (get-vpn-config --snapshot)
+#   Each SEMP object is saved once as compact json named by its sha256:
+#     <store>/objects/ab/ab12...json
+#   Each run saves a small manifest: object identity -> hash
+#     <store>/runs/<router label>/<vpn>/<run id>.json
+#   Object identity is its SEMP path below the vpn (eg: queues/Q1/subscriptions/a/>)
+#   The manifest also lists the objects of each collection, used by
+#   get-vpn-config --incremental (see IncrementalCapture), and the collections
+#   that run rebuilt from an earlier snapshot instead of reading the broker
+#   Unchanged objects are not stored again, so daily snapshots cost one full
+#   capture plus the objects that changed, and two runs are compared from their
+#   manifests alone
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import sys, os
+import json
+import glob
+import inspect
+import hashlib
+import threading
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+from common.CrawlCheckpoint import read_manifest
+from common.SempSchema import url_segments
+
+Verbose = 0
+VpnKey = 'msgVpn'   # identity of the vpn object itself
+
+def object_hash(obj):
+    """ (sha256 hex, canonical json) of a SEMP object """
+    text = json.dumps(obj, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest(), text
+
+def object_key(link, page_url, n):
+    """ identity of the n-th object of a page: its uri path below the vpn """
+    uri = link.get('uri') if isinstance(link, dict) else None
+    if uri:
+        return '/'.join(url_segments(uri)) or VpnKey
+    # no self link. fall back to position in the collection
+    return '{}#{}'.format('/'.join(url_segments(page_url)) or VpnKey, n)
+
+def collection_key(url):
+    """ identity of the collection of page url (names quoted: they may have '/' in them) """
+    return '/'.join(quote(seg, safe='') for seg in url_segments(url))
+
+def compare(old_objects, new_objects):
+    """ compare two run manifests (identity -> hash). returns {added, removed, changed} sorted key lists """
+    return {
+        'added': sorted(k for k in new_objects if k not in old_objects),
+        'removed': sorted(k for k in old_objects if k not in new_objects),
+        'changed': sorted(k for k, h in new_objects.items() if k in old_objects and old_objects[k] != h),
+    }
+
+
+class SnapshotStore():
+    """ Content addressed SEMP object store with per run manifests """
+
+    def __init__(self, store_dir, verbose=0):
+        global Verbose
+        Verbose = verbose
+        if Verbose > 2:
+            print ('Entering {}::{} store: {}'.format(__class__.__name__, inspect.stack()[0][3], store_dir))
+        self.store_dir = store_dir
+
+    #-------------------------------------------------------------
+    # objects
+    #
+    def object_file(self, h):
+        return '{}/objects/{}/{}.json'.format(self.store_dir, h[:2], h)
+
+    def put(self, obj):
+        """ store object if not already there. returns (hash, True if new) """
+        h, text = object_hash(obj)
+        obj_file = self.object_file(h)
+        if os.path.exists(obj_file):
+            return h, False
+        os.makedirs(os.path.dirname(obj_file), exist_ok=True)
+        # vpns are captured in parallel: write to own temp file, rename is atomic
+        tmp_file = '{}.{}-{}.tmp'.format(obj_file, os.getpid(), threading.get_ident())
+        with open(tmp_file, 'w') as fp:
+            fp.write(text)
+        os.replace(tmp_file, obj_file)
+        return h, True
+
+    def get(self, h):
+        with open(self.object_file(h), 'r') as fp:
+            return json.load(fp)
+
+    #-------------------------------------------------------------
+    # runs
+    #
+    def run_dir(self, router, vpn):
+        return '{}/runs/{}/{}'.format(self.store_dir, router, vpn)
+
+    def list_runs(self, router, vpn):
+        """ run ids of router / vpn, oldest first """
+        return sorted(os.path.basename(f)[:-len('.json')] for f in glob.glob('{}/*.json'.format(self.run_dir(router, vpn))))
+
+    def list_vpns(self):
+        """ (router, vpn) with saved runs """
+        return sorted(tuple(os.path.relpath(d, '{}/runs'.format(self.store_dir)).split(os.sep))
+                      for d in glob.glob('{}/runs/*/*'.format(self.store_dir)) if os.path.isdir(d))
+
+    def load_run(self, router, vpn, run_id):
+        with open('{}/{}.json'.format(self.run_dir(router, vpn), run_id), 'r') as fp:
+            return json.load(fp)
+
+    def latest_run(self, router, vpn):
+        """ last run dict of router / vpn, None if there is none """
+        runs = self.list_runs(router, vpn)
+        return self.load_run(router, vpn, runs[-1]) if runs else None
+
+    def snapshot(self, router, vpn, run_id, manifest_file):
+        """ store objects of the pages in crawl manifest as run run_id. returns run dict
+            changes are against the latest earlier run of the router / vpn
+            collections of pages rebuilt from a snapshot (meta.reused, get-vpn-config
+            --incremental) are listed in reused and fullRun is carried over
+        """
+        if Verbose > 2:
+            print ('Entering {}::{} {}/{} run: {}'.format(__class__.__name__, inspect.stack()[0][3], router, vpn, run_id))
+        json_h = JsonHandler.JsonHandler()
+        objects = {}
+        collections = {}  # collection -> identities of its objects, in page order
+        reused = {}       # collection -> reused marker of its pages
+        n_new = 0
+        for url, entry in read_manifest(manifest_file).items():
+            if entry['status'] != 'done' or not os.path.exists(entry['file']):
+                continue
+            page = json_h.read_json_file(entry['file'])
+            data = page.get('data')
+            links = page.get('links')
+            if (page.get('meta') or {}).get('reused'):
+                reused[collection_key(url)] = page['meta']['reused']
+            collection = None
+            if isinstance(data, dict):
+                data, links = [data], [links]
+            else:
+                collection = collections.setdefault(collection_key(url), [])
+            links = links or []
+            for n, obj in enumerate(data or []):
+                key = object_key(links[n] if n < len(links) else None, url, n)
+                objects[key], new = self.put(obj)
+                n_new += new
+                if collection is not None:
+                    collection.append(key)
+
+        runs = self.list_runs(router, vpn)
+        prev_id = runs[-1] if runs else None
+        # two runs in the same second get a numbered id
+        base_id, i = run_id, 0
+        while run_id in runs:
+            i += 1
+            run_id = '{}-{}'.format(base_id, i)
+        prev_run = self.load_run(router, vpn, prev_id) if prev_id else {}
+        changes = compare(prev_run.get('objects', {}), objects)
+        # fullRun: last capture that fetched every object
+        full_run = run_id
+        if reused:
+            full_run = min(m['fullRun'] for m in reused.values())
+        run = {'run': run_id, 'router': router, 'vpn': vpn, 'previous': prev_id,
+               'changes': {k: len(v) for k, v in changes.items()}, 'newObjects': n_new,
+               'incremental': bool(reused), 'fullRun': full_run, 'reused': sorted(reused),
+               'objects': objects, 'collections': collections}
+
+        run_file = '{}/{}.json'.format(self.run_dir(router, vpn), run_id)
+        os.makedirs(os.path.dirname(run_file), exist_ok=True)
+        with open(run_file + '.tmp', 'w') as fp:
+            json.dump(run, fp, indent=1, sort_keys=True)
+        os.replace(run_file + '.tmp', run_file)
+        print ('   + Snapshot {} ({} objects, {} new in store)'.format(run_file, len(objects), n_new))
+        if reused:
+            print ('     {} collections reused from snapshot (full capture {})'.format(len(reused), full_run))
+        if prev_id:
+            print ('     Since {}: {} added, {} removed, {} changed'.format(
+                prev_id, len(changes['added']), len(changes['removed']), len(changes['changed'])))
+        return run
+
+    def changes(self, router, vpn, old_id, new_id):
+        """ {added, removed, changed} object identities between two runs """
+        return compare(self.load_run(router, vpn, old_id)['objects'],
+                       self.load_run(router, vpn, new_id)['objects'])
+
+    def prune(self, keep):
+        """ keep last keep runs per router / vpn and remove objects no run refers to. returns (runs, objects) removed """
+        n_runs = 0
+        for router, vpn in self.list_vpns():
+            for run_id in self.list_runs(router, vpn)[:-keep] if keep > 0 else []:
+                os.remove('{}/{}.json'.format(self.run_dir(router, vpn), run_id))
+                n_runs += 1
+        live = set()
+        for router, vpn in self.list_vpns():
+            for run_id in self.list_runs(router, vpn):
+                live.update(self.load_run(router, vpn, run_id)['objects'].values())
+        n_objects = 0
+        for obj_file in glob.glob('{}/objects/*/*.json'.format(self.store_dir)):
+            if os.path.basename(obj_file)[:-len('.json')] not in live:
+                os.remove(obj_file)
+                n_objects += 1
+        return n_runs, n_objects
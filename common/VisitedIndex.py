@@ -0,0 +1,49 @@
+##############################################################################
+# VisitedIndex
+#   Index of SEMP urls already fetched in a crawl
+#   Urls are normalized so the same resource reached by different links
+#   (different quoting, count= page size, param order) is fetched once
+#
+# Ramesh Natarajan (nram@nram.dev)
+##############################################################################
+
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode, quote, unquote
+
+# query params that don't change which resource/page is returned
+IgnoreParams = ['count']
+
+def normalize_url(url):
+    """ normalized form of SEMP url used as visited key
+        path segments are re-quoted one by one so an encoded '/' in a name (%2F) stays in the name
+        cursor (page) and other params are kept in sorted order
+    """
+    u = urlsplit(url, allow_fragments=False) # "#acl-profile" style names are not fragments
+    path = '/'.join(quote(unquote(seg), safe='') for seg in u.path.rstrip('/').split('/'))
+    params = sorted((k, v) for k, v in parse_qsl(u.query, keep_blank_values=True) if k not in IgnoreParams)
+    key = '{}://{}{}'.format(u.scheme.lower(), u.netloc.lower(), path)
+    if params:
+        key = '{}?{}'.format(key, urlencode(params))
+    return key
+
+
+class VisitedIndex():
+    """ thread safe set of normalized urls with duplicate counter """
+
+    def __init__(self):
+        self.urls = set()
+        self.n_dups = 0
+        self.lock = threading.Lock()
+
+    def add(self, url):
+        """ add url to index. returns False if it was already visited """
+        key = normalize_url(url)
+        with self.lock:
+            if key in self.urls:
+                self.n_dups += 1
+                return False
+            self.urls.add(key)
+            return True
+
+    def summary(self):
+        return 'Visited: {} urls fetched once, {} duplicate links skipped'.format(len(self.urls), self.n_dups)
@@ -24,6 +24,8 @@
 #   python3 create-queues.py --config config/nram-local-config.yaml  --input input/nram-test-queues.csv
 # Create new or update existing queues: Use --patch option
 #   python3 create-queues.py --config private/nram/nram-dev1.yaml  --input private/abc/abc-queues-tests1.csv --patch 
+# Provision N queues at the same time: Use --workers N option
+#   python3 create-queues.py --config config/nram-local-config.yaml  --input input/nram-test-queues.csv --workers 8
 #
 # Ramesh Nataraajan (nram@nram.dev)
 # Solace PSG
@@ -38,6 +40,7 @@ from urllib.parse import unquote, quote
 sys.path.insert(0, os.path.abspath("."))
 from common import LogHandler
 from common import SempHandler
+from common import SempMetrics
 #from common import JsonHandler
 from common import QueueConfig 
 from common import YamlHandler
@@ -79,6 +82,10 @@ def main(argv):
                    help='user input csv file') 
     p.add_argument('--patch', dest="patch_it", action='store_true', required=False, default=False, 
                    help='user input csv file') 
+    p.add_argument('--workers', dest="workers", type=int, required=False, default=1,
+                   help='number of queues provisioned at the same time (default: 1). keep <= semp.session.poolMaxSize')
+    p.add_argument('--metrics-file', dest="metrics_file", required=False, default=None,
+                   help='save SEMP request metrics. .prom: Prometheus textfile, else json')
     p.add_argument( '--verbose', '-v', action="count",  required=False, default=0,
                 help='Verbose output. use -vvv for tracing')
     r = p.parse_args()
@@ -130,17 +137,27 @@ def main(argv):
         print ('DLQs')
         print (dmqs)
 
-    # create semp handler -- see common/SimpleSempHandler.py
-    semp_h = SempHandler.SempHandler(Cfg, Verbose)
+    # create semp handler -- see common/SempHandler.py
+    # all queue requests share the pooled http session of this broker
+    semp_h = SempHandler.SempHandler(Cfg, Cfg['vpn']['msgVpnNames'][0], verbose=Verbose)
 
     # create queue handlers
-    queue_h = QueueConfig.Queues(semp_h, Cfg, regularqs, Verbose)
-    dmqueue_h = QueueConfig.Queues(semp_h, Cfg, dmqs, Verbose)
+    # queues are provisioned by --workers threads, each queue's own steps in order
+    queue_h = QueueConfig.Queues(semp_h, Cfg, regularqs, Verbose, max(1, r.workers))
+    dmqueue_h = QueueConfig.Queues(semp_h, Cfg, dmqs, Verbose, max(1, r.workers))
 
     # create / update queues
     # Create DMQs followed by regular queues
+    # all DMQs are done before the first regular queue that may use them as deadMsgQueue
     dmqueue_h.create_or_update_dmqueue ( r.patch_it)
     queue_h.create_or_update_queue   ( r.patch_it)
+    SempHandler.close_sessions()
+
+    print ()
+    print (SempMetrics.Metrics.summary())
+    if r.metrics_file:
+        SempMetrics.Metrics.save(r.metrics_file)
+        print ('SEMP metrics saved to {}'.format(r.metrics_file))
     
 # Program entry point
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+# diff-vpn-config.py
+#
+# Show what changed between two VPN configs: two days of the same VPN or two
+# VPNs (eg: DEV and PROD). Objects are matched by SEMP identity (queueName,
+# aclProfileName, subscription topic under its queue, ...) and changed
+# attributes are listed. Differences are printed as they are found
+# Each config can be a <vpn>-all.json file, a vpn capture dir or its archive
+# Usage:
+#   python3 diff-vpn-config.py --config config/sample-config-local.yaml OLD NEW
+#          [--ignore ATTR] [--show] [--json] [--procs N] [-v]
+#
+# Ramesh Natarajan (nram), Solace PSG
+# nram@nram.dev
+
+import sys, os
+import argparse
+import pprint
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+from common import ConfigParser
+from common import ConfigDiff
+from common import CaptureOutput
+from common import SempSchema
+from common import YamlHandler
+
+
+me = "diff-vpn-config"
+ver = '2.0.0'
+yaml_h = YamlHandler.YamlHandler()
+json_h = JsonHandler.JsonHandler()
+
+# Globals
+Cfg = {}    # global handy config dict
+Verbose = 0
+Procs = 1   # processes decoding page files of capture dirs
+pp = pprint.PrettyPrinter(indent=4)
+
+def main(argv):
+    """ program entry drop point """
+    global Cfg, Verbose, Procs
+
+    p = argparse.ArgumentParser()
+    p.add_argument('--config', dest="config_file", required=True, help='config json file')
+    p.add_argument('old', help='old config: <vpn>-all.json, vpn capture dir or archive')
+    p.add_argument('new', help='new config: <vpn>-all.json, vpn capture dir or archive')
+    p.add_argument('--ignore', dest="ignore", action='append', required=False, default=None,
+                help='attribute to leave out of the comparison. can be repeated (default: msgVpnName)')
+    p.add_argument('--show', dest="show", action='store_true', required=False, default=False,
+                help='print json of added and removed objects')
+    p.add_argument('--json', dest="json", action='store_true', required=False, default=False,
+                help='print one json record per difference (ndjson) instead of text')
+    p.add_argument('--procs', dest="procs", type=int, required=False, default=1,
+                help='decode page files of capture dirs with N processes (default: 1)')
+    p.add_argument( '--verbose', '-v', action="count",  required=False, default=0,
+                help='Verbose output. use -vvv for tracing')
+    r = p.parse_args()
+
+    # ndjson output is for other tools: keep progress messages off stdout
+    out = sys.stderr if r.json else sys.stdout
+    print ('\n{}-{} Starting\n'.format(me,ver), file=out)
+
+    Verbose = r.verbose
+    Procs = max(1, r.procs)
+    Cfg = yaml_h.read_config_file(r.config_file)
+    sys_cfg_file = Cfg["internal"]["systemConfig"]
+    print ("Reading system config {}".format(sys_cfg_file), file=out)
+    Cfg['system'] = yaml_h.read_config_file (sys_cfg_file)
+    if Verbose > 2:
+        print ('SYSTEM CONFIG', file=out); pp.pprint (Cfg['system'])
+
+    start = time.time()
+    old_cfg = load_config(r.old, out)
+    new_cfg = load_config(r.new, out)
+    for path, cfg in ((r.old, old_cfg), (r.new, new_cfg)):
+        reused = cfg.get('meta', {}).get('incremental')
+        if reused:
+            print ("! {}: incremental capture, {} pages reused from snapshot {} (full capture {})".format(
+                path, reused['reusedPages'], reused['snapshot'], reused['fullRun']), file=out)
+            print ("  changes to attributes outside the fingerprint of those objects are not compared", file=out)
+    print ("Loaded configs ({:.1f} secs)\n".format(time.time() - start), file=out)
+
+    schema = SempSchema.SempSchema(Cfg["system"]["semp"].get("schemaFile"), Verbose)
+    cfg_diff = ConfigDiff.ConfigDiff(schema, ['msgVpnName'] if r.ignore is None else r.ignore, Verbose)
+    for d in cfg_diff.diff(old_cfg, new_cfg):
+        if r.json:
+            print (json.dumps(d, sort_keys=True))
+        else:
+            print_diff(d, r.show)
+
+    print ("\nChanges {} -> {} ({:.1f} secs)".format(r.old, r.new, time.time() - start), file=out)
+    print (cfg_diff.summary(), file=out)
+
+
+def load_config(path, out):
+    """ consolidated config from <vpn>-all.json, vpn capture dir or capture archive """
+    path = path.rstrip('/')
+    if os.path.isdir(path):
+        return parse_capture(path, out)
+    if path.endswith('.json'):
+        print ("Reading {}".format(path), file=out)
+        return JsonHandler.load_json_file(path)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp_dir:
+        print ("Extracting {}".format(path), file=out)
+        return parse_capture(CaptureOutput.extract_archive(path, tmp_dir), out)
+
+def parse_capture(vpn_dir, out):
+    print ("Parsing capture {}".format(vpn_dir), file=out)
+    vpn_json_data = json_h.read_json_data('{}/vpn.json'.format(vpn_dir))
+    if vpn_json_data is None:
+        raise RuntimeError('no data in {}/vpn.json'.format(vpn_dir))
+    cfg_p = ConfigParser.ConfigParser(Cfg, Verbose, procs=Procs)
+    return cfg_p.cfg_parse(os.path.basename(vpn_dir), vpn_dir, vpn_json_data)
+
+def print_diff(d, show):
+    """ + added, - removed, * changed (with old -> new of each changed attribute) """
+    if d['op'] == 'changed':
+        print ("* {}".format(d['id']))
+        for attr, (old, new) in d['attrs'].items():
+            print ("      {}: {} -> {}".format(attr, json.dumps(old), json.dumps(new)))
+        return
+    print ("{} {}".format('+' if d['op'] == 'added' else '-', d['id']))
+    if show:
+        print ("      {}".format(json.dumps(d['object'], sort_keys=True)))
+
+
+
+if __name__ == "__main__":
+    """ program entry point - must be  below main() """
+
+    main(sys.argv[1:])
@@ -3,30 +3,41 @@
 # Traverse Solace Message VPN configs with SEMPv2 REST post recursively
 # Store output JSONs in a dir tree
 # Usage:
-#   python3 get-vpn-config.py --config config/sample-config-local.yaml [-v]
+#   python3 get-vpn-config.py --config config/sample-config-local.yaml [--workers N] [--async] [--resume] [--plan]
+#          [--include TYPE[:GLOB],...] [--exclude TYPE[:GLOB],...]
+#          [--parallel N] [--per-broker M] [--metrics-file FILE]
+#          [--format json|compact|ndjson] [--archive none|zip|tgz|tzst] [--snapshot] [--incremental] [--assemble memory|stream|disk] [-v]
 # 
 # Ramesh Natarajan (nram), Solace PSG
 # nram@nram.dev
 
 import sys, os
 import argparse
+import asyncio
 import pprint
 import json
-import requests
 import inspect
-import shutil
-import urllib
-import pathlib
-from requests.auth import HTTPBasicAuth
-from zipfile import ZipFile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 # from os.path import basename
-from datetime import datetime
-from urllib.parse import unquote # for Python 3.7
 
 sys.path.insert(0, os.path.abspath("."))
+from common import LogHandler
 from common import JsonHandler
 from common import ConfigParser
+from common import ConfigAssembler
 from common import SempHandler
+from common import AsyncSempHandler
+from common import CrawlCheckpoint
+from common import NegativeCache
+from common import CrawlScope
+from common import JsonWriter
+from common import CaptureOutput
+from common import SempGovernor
+from common import SempMetrics
+from common import SnapshotStore
+from common import IncrementalCapture
 from common import YamlHandler
 
     
@@ -36,6 +47,20 @@ ver = '2.0.0'
 # Globals
 Cfg = {}    # global handy config dict
 Verbose = 0  
+Workers = 1  # number of parallel crawl workers
+Async = False # crawl with asyncio engine
+Resume = False # resume interrupted crawl from checkpoint
+Plan = False   # only print crawl plan from SEMP schema
+NegCaches = {}  # (router label, vpn) -> SEMP endpoints the broker doesn't support for the vpn
+Parallel = 1    # number of vpns captured at the same time
+BrokerCap = 2   # max vpns captured at the same time per broker
+Format = 'json' # capture output format (see CaptureOutput)
+Archive = 'none' # archive each vpn capture (zip, tgz, tzst)
+Assemble = 'memory' # build <vpn>-all.json from crawled pages (memory, stream) or from the output tree (disk)
+Scope = None    # crawl include / exclude filters
+Snapshots = None # content addressed snapshot store (--snapshot)
+RunId = None    # snapshot run id, same for all vpns of this run
+Incremental = False # rebuild collections that didn't change from the last snapshot (--incremental)
 pp = pprint.PrettyPrinter(indent=4)
 
 json_h = JsonHandler.JsonHandler()
@@ -43,10 +68,40 @@ yaml_h = YamlHandler.YamlHandler()
 
 def main(argv):
     """ program entry drop point """
-    global Cfg, Verbose
+    global Cfg, Verbose, Workers, Async, Resume, Plan, Scope, Parallel, BrokerCap, Format, Archive, Snapshots, RunId, Assemble, Incremental
 
     p = argparse.ArgumentParser()
     p.add_argument('--config', dest="config_file", required=True, help='config json file') 
+    p.add_argument('--workers', dest="workers", type=int, required=False, default=1,
+                help='number of parallel SEMP requests while crawling (default: 1). keep <= semp.session.poolMaxSize')
+    p.add_argument('--async', dest="use_async", action='store_true', required=False, default=False,
+                help='crawl with asyncio SEMP engine. --workers sets max requests in flight (needs aiohttp)')
+    p.add_argument('--resume', dest="resume", action='store_true', required=False, default=False,
+                help='resume interrupted crawl. pages in the checkpoint manifest are read from disk, not fetched')
+    p.add_argument('--plan', dest="plan", action='store_true', required=False, default=False,
+                help='print collections the crawl will request (from SEMP schema and broker version) and exit')
+    p.add_argument('--parallel', dest="parallel", type=int, required=False, default=1,
+                help='number of vpns captured at the same time across all routers (default: 1)')
+    p.add_argument('--per-broker', dest="per_broker", type=int, required=False, default=2,
+                help='max vpns captured at the same time on one broker (default: 2)')
+    p.add_argument('--format', dest="format", choices=CaptureOutput.Formats, required=False, default='json',
+                help='json: pretty file per page (default). compact: compact file per page. ndjson: one file per object type, one object per line')
+    p.add_argument('--archive', dest="archive", choices=list(CaptureOutput.Archives), required=False, default='none',
+                help='pack each vpn capture into one archive: zip, tgz (tar.gz) or tzst (tar.zst, needs zstandard)')
+    p.add_argument('--assemble', dest="assemble", choices=['memory', 'stream', 'disk'], required=False, default='memory',
+                help='build <vpn>-all.json from pages as they are crawled (memory, default), from crawled page links and '
+                     'files with bounded memory (stream) or by reading the output tree back (disk)')
+    p.add_argument('--snapshot', dest="snapshot", action='store_true', required=False, default=False,
+                help='also save the capture in the content addressed snapshot store (see snapshot-changes.py)')
+    p.add_argument('--incremental', dest="incremental", action='store_true', required=False, default=False,
+                help='list collections with a select= pass of their key attributes and rebuild the ones with the same '
+                     'objects as the last snapshot instead of fetching them (implies --snapshot)')
+    p.add_argument('--metrics-file', dest="metrics_file", required=False, default=None,
+                help='save SEMP request metrics. .prom: Prometheus textfile, else json')
+    p.add_argument('--include', dest="include", action='append', required=False, default=[],
+                help='only crawl these object types (and their subtree). TYPE[:NAME-GLOB],... eg: queues:ORDERS.*,aclProfiles')
+    p.add_argument('--exclude', dest="exclude", action='append', required=False, default=[],
+                help='skip these object types / objects (and their subtree). TYPE[:NAME-GLOB],... eg: queues:TEST*,replayLogs')
     p.add_argument( '--verbose', '-v', action="count",  required=False, default=0,
                 help='Verbose output. use -vvv for tracing')
     r = p.parse_args()
@@ -54,6 +109,18 @@ def main(argv):
     print ('\n{}-{} Starting\n'.format(me,ver))
 
     Verbose = r.verbose
+    Workers = max(1, r.workers)
+    Async = r.use_async
+    Resume = r.resume
+    Plan = r.plan
+    Parallel = max(1, r.parallel)
+    BrokerCap = max(1, r.per_broker)
+    Format = r.format
+    Archive = r.archive
+    Assemble = r.assemble
+    Incremental = r.incremental
+    CaptureOutput.set_page_format(Format)
+    CaptureOutput.check_archive(Archive)
 
 
     print ("Reading user config file  : {}".format(r.config_file))
@@ -69,38 +136,194 @@ def main(argv):
         print ('SYSTEM CONFIG'); pp.pprint (system_config_all)
 
     Cfg['system'] = system_config_all.copy() # store system cfg in the global Cfg dict
-
-    cfg_p = ConfigParser.ConfigParser(Cfg)
-
-    for vpn_name in Cfg["vpn"]["msgVpnNames"]:
-        print ("\nGet VPN Config for {}".format(vpn_name))
-        vpn_json_file = get_vpn_data(vpn_name)
+    Cfg['script_name'] = me
+    Cfg['verbose'] = Verbose
+
+    log_h = LogHandler.LogHandler(Cfg)
+    log = log_h.get()
+    log.info('Starting {}-{}'.format(me, ver))
+    Cfg['log_handler'] = log_h
+
+    # scope filters from command line add to the ones in user config (crawl.include / crawl.exclude)
+    crawl_cfg = Cfg.get("crawl") or {}
+    Scope = CrawlScope.CrawlScope((crawl_cfg.get("include") or []) + r.include,
+                                  (crawl_cfg.get("exclude") or []) + r.exclude, Verbose)
+    if Scope.is_set():
+        print ("Crawl scope: include {} exclude {}".format(Scope.include or 'all', Scope.exclude or 'none'))
+
+    if r.snapshot or Incremental:
+        Snapshots = SnapshotStore.SnapshotStore("{}/{}".format(Cfg["system"]["system"]["outputDir"],
+                                                Cfg["system"]["system"].get("snapshotDir", "snapshots")), Verbose)
+        RunId = LogHandler.ts()
+
+    routers = get_routers()
+
+    if Plan:
+        for rtr_cfg, _ in routers:
+            print_crawl_plan(rtr_cfg)
+        return
+
+    jobs = [(rtr_cfg, vpn_name) for rtr_cfg, vpn_names in routers for vpn_name in vpn_names]
+    # per vpn: a vpn scoped admin user may not read what another vpn has
+    neg_cfg = Cfg["system"]["semp"].get("negativeCache", {})
+    for rtr_cfg, vpn_name in jobs:
+        NegCaches[(rtr_cfg["label"], vpn_name)] = NegativeCache.NegativeCache(
+            "{}/{}/{}-{}".format(Cfg["system"]["system"]["outputDir"], rtr_cfg["label"], vpn_name, neg_cfg.get("file", "negative-cache.json")),
+            neg_cfg.get("ttl", 604800), neg_cfg.get("threshold", 3), Verbose)
+
+    start = time.time()
+    results = capture_all(jobs)
+
+    SempHandler.close_sessions()
+    print ()
+    for (label, vpn_name), neg_cache in NegCaches.items():
+        print ('{} {}: {}'.format(label, vpn_name, neg_cache.summary()))
+    if Scope.is_set():
+        print (Scope.summary())
+    print ('SEMP governor:')
+    for summary in SempGovernor.governor_summaries():
+        print ('   {}'.format(summary))
+    print ()
+    print (SempMetrics.Metrics.summary())
+    if r.metrics_file:
+        SempMetrics.Metrics.save(r.metrics_file)
+        print ('SEMP metrics saved to {}'.format(r.metrics_file))
+    save_run_report(results, time.time() - start)
+    print ('\n{} Done\n'.format(me))
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
+
+
+def get_routers():
+    """ list of (router cfg, vpn names) from user config
+        either a routers list (each router with its own msgVpnNames) or a single router with vpn.msgVpnNames
+    """
+    default_vpns = (Cfg.get("vpn") or {}).get("msgVpnNames", [])
+    if "routers" in Cfg:
+        routers = [(rtr_cfg, rtr_cfg.get("msgVpnNames", default_vpns)) for rtr_cfg in Cfg["routers"]]
+    else:
+        routers = [(Cfg["router"], default_vpns)]
+    labels = [rtr_cfg["label"] for rtr_cfg, _ in routers]
+    for label in set(labels):
+        if labels.count(label) > 1:
+            print ('**** Router label {} used more than once. Labels name the output dirs and must be unique ****'.format(label))
+            raise RuntimeError
+    return routers
+
+
+def capture_all(jobs):
+    """ capture (router, vpn) jobs. runs at most Parallel jobs at a time and at most BrokerCap per broker
+        returns one result per job, in job order
+    """
+    pending = {}   # router label -> jobs not started yet
+    for n, (rtr_cfg, vpn) in enumerate(jobs):
+        pending.setdefault(rtr_cfg["label"], deque()).append((n, rtr_cfg, vpn))
+    n_running = {label: 0 for label in pending}
+    running = {}   # future -> router label
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=Parallel) as executor:
+        while pending or running:
+            # start jobs round robin over brokers, up to the caps
+            for label in list(pending):
+                while pending[label] and len(running) < Parallel and n_running[label] < BrokerCap:
+                    n, rtr_cfg, vpn = pending[label].popleft()
+                    running[executor.submit(capture_vpn, n, rtr_cfg, vpn)] = label
+                    n_running[label] += 1
+                if not pending[label]:
+                    del pending[label]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                n_running[running.pop(f)] -= 1
+                n, result = f.result()
+                results[n] = result
+    return results
+
+
+def capture_vpn(n, rtr_cfg, vpn_name):
+    """ get vpn config tree and save vpn all config json. returns (job number, result) """
+    result = {'router': rtr_cfg["label"], 'vpn': vpn_name, 'status': 'ok', 'error': None,
+              'fetched': 0, 'resumed': 0, 'file': None, 'snapshot': None, 'incremental': False, 'unsupported': []}
+    start = time.time()
+    try:
+        print ("\nGet VPN Config for {} ({})".format(vpn_name, rtr_cfg["label"]))
+        assembler = None
+        if Assemble != 'disk':
+            assembler = ConfigAssembler.ConfigAssembler(Cfg, Verbose, stream=(Assemble == 'stream'))
+        vpn_json_file = get_vpn_data(rtr_cfg, vpn_name, result, assembler)
 
         vpn_json_data = json_h.read_json_file (vpn_json_file)
         if 'data' not in vpn_json_data:
             print ('**** No data element. Skipping invalid json file: {} ****'.format(vpn_json_file))
-            continue
-
-        # get vpn data first
-        print ('Parse VPN JSON Configs for {} ({})'. format(vpn_name, vpn_json_file))
-        vpn_json_data = json_h.read_json_data (vpn_json_file)
-
-        vpn_cfg = cfg_p.cfg_parse(vpn_name, os.path.dirname(vpn_json_file), vpn_json_data)
-
-        # save cfg to file
-        print ('Save VPN all config json')
-        vpn_allcfg_out_file = "{}/{}-all.json". format(os.path.dirname(vpn_json_file), vpn_name)
-        json_h.save_json_file(vpn_allcfg_out_file, vpn_cfg)
-
-    print ('\n{} Done\n'.format(me))
-
-
-def get_vpn_data(vpn):
-    """ process vpn recursively """
+            result['status'] = 'failed'
+            result['error'] = 'no data in {}'.format(vpn_json_file)
+        else:
+            # get vpn data first
+            print ('Parse VPN JSON Configs for {} ({})'. format(vpn_name, vpn_json_file))
+            vpn_json_data = json_h.read_json_data (vpn_json_file)
+
+            if assembler:
+                vpn_cfg = assembler.assemble(vpn_json_data)
+            else:
+                cfg_p = ConfigParser.ConfigParser(Cfg)
+                vpn_cfg = cfg_p.cfg_parse(vpn_name, os.path.dirname(vpn_json_file), vpn_json_data)
+
+            # save cfg to file
+            print ('Save VPN all config json')
+            vpn_allcfg_out_file = "{}/{}-all.json". format(os.path.dirname(vpn_json_file), vpn_name)
+            ConfigAssembler.save_config(vpn_allcfg_out_file, vpn_cfg)
+            result['file'] = vpn_allcfg_out_file
+
+            out_dir = os.path.dirname(vpn_json_file)
+            checkpoint_file = "{}/{}".format(out_dir, Cfg["system"]["system"]["checkpointFile"])
+            if Snapshots:
+                # objects are read from the page files, so before they are folded / archived
+                result['snapshot'] = Snapshots.snapshot(rtr_cfg["label"], vpn_name, RunId, checkpoint_file)['run']
+            if Format == 'ndjson':
+                CaptureOutput.write_ndjson(out_dir, checkpoint_file, Verbose)
+            if Archive != 'none':
+                result['file'] = CaptureOutput.archive_dir(out_dir, Archive)
+    except Exception as e:
+        # one broker / vpn failing doesn't stop the others. reported at the end
+        print ('**** Get VPN Config for {} ({}) failed: {} ****'.format(vpn_name, rtr_cfg["label"], e))
+        Cfg['log_handler'].get().error('Get VPN Config for {} ({}) failed: {}'.format(vpn_name, rtr_cfg["label"], e))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['secs'] = round(time.time() - start, 2)
+    return n, result
+
+
+def save_run_report(results, elapsed):
+    """ print consolidated run report and save it as json in outputDir """
+    n_ok = sum(1 for result in results if result['status'] == 'ok')
+    n_partial = sum(1 for result in results if result['status'] == 'partial')
+    n_failed = len(results) - n_ok - n_partial
+    print ('\nRun report: {} vpns on {} routers. {} ok, {} partial, {} failed ({:.1f} secs)'.format(
+        len(results), len(set(result['router'] for result in results)), n_ok, n_partial, n_failed, elapsed))
+    for result in results:
+        print ('   {:<16} {:<24} {:<7} {:>8.1f}s {:>6} fetched {:>6} resumed  {}'.format(
+            result['router'], result['vpn'], result['status'], result['secs'],
+            result['fetched'], result['resumed'], result['error'] or result['file']))
+        if result['incremental']:
+            print ('   {:<41} {} pages reused from snapshot {} (full capture {})'.format(
+                '', result['incremental']['reusedPages'], result['incremental']['snapshot'], result['incremental']['fullRun']))
+        if result['unsupported']:
+            print ('   {:<41} not supported by the broker: {}'.format('', ', '.join(result['unsupported'])))
+    report_file = "{}/{}-report-{}.json".format(Cfg["system"]["system"]["outputDir"], me, LogHandler.ts())
+    os.makedirs(os.path.dirname(report_file), exist_ok=True)
+    with open(report_file, 'w') as fp:
+        json.dump({'elapsed': round(elapsed, 2), 'ok': n_ok, 'partial': n_partial, 'failed': n_failed, 'vpns': results},
+                  fp, indent=4, sort_keys=True)
+    print ('Run report saved to {}'.format(report_file))
+
+
+def get_vpn_data(rtr_cfg, vpn, result, assembler=None):
+    """ process vpn recursively. crawl stats are added to result. crawled pages are fed to assembler """
     if Verbose > 2:
          print ('Entering {}::{} vpn = {}'.format(__name__, inspect.stack()[0][3], vpn))
 
-    rtr_cfg = Cfg["router"]
+    # Cfg is shared by all jobs. each job gets its own copy with its router
+    cfg = dict(Cfg, router=rtr_cfg)
+    neg_cache = NegCaches[(rtr_cfg["label"], vpn)]
     sys_cfg = Cfg["system"]
     if Verbose > 2:
         print ('--- ROUTER :\n', json.dumps(rtr_cfg))
@@ -109,22 +332,103 @@ def get_vpn_data(vpn):
     url = "{}/{}/{}".format(rtr_cfg["sempUrl"], sys_cfg["semp"]["vpnConfigUrl"], vpn)
     out_dir = "{}/{}/{}".format(sys_cfg["system"]["outputDir"], rtr_cfg["label"], vpn)
 
-    semp_h = SempHandler.SempHandler(Cfg, vpn, out_dir)
-    vpn_data = semp_h.get_vpn_config_json (url)
-    if Verbose > 2:
-        print ('VPN ', pp.pprint(vpn_data))
+    # a new crawl starts from an empty dir: stale pages of the last one would be parsed with it
+    if not Resume:
+        CaptureOutput.clear_capture(out_dir)
+    # every captured page is recorded in the checkpoint manifest. --resume reuses it
+    checkpoint_file = "{}/{}".format(out_dir, sys_cfg["system"]["checkpointFile"])
+    checkpoint = CrawlCheckpoint.CrawlCheckpoint(checkpoint_file, Resume, Verbose)
+
+    # SempHandlers for the same broker share one pooled http session
+    # pages are saved by background writer threads while the crawl goes on
+    writer_cfg = sys_cfg["system"].get("writer", {})
+    writer = None
+    if writer_cfg.get("queueSize", 0) > 0:
+        writer = JsonWriter.JsonWriter(writer_cfg["queueSize"], writer_cfg.get("threads", 1), Verbose)
+
+    # incremental: unchanged collections are rebuilt from the last snapshot of the vpn
+    incremental = None
+    if Incremental:
+        inc_cfg = sys_cfg["system"].get("incremental", {})
+        incremental = IncrementalCapture.IncrementalCapture(Snapshots, rtr_cfg["label"], vpn, inc_cfg.get("maxAge", 604800),
+                                                            inc_cfg.get("fingerprint"), inc_cfg.get("maxRefetch", 10), Verbose)
+        if not incremental.is_active():
+            incremental = None
+
+    semp_h = SempHandler.SempHandler(cfg, vpn, out_dir, Verbose, checkpoint, negative_cache=neg_cache, scope=Scope,
+                                     writer=writer, assembler=assembler, incremental=incremental)
+    semp_version = semp_h.get_semp_version()
+    semp_h.schema.set_version(semp_version)
+    neg_cache.set_version(semp_version)
 
     if Verbose:
         print ("Output dir: {}".format(out_dir))
     outfile = '{}/vpn.json'.format(out_dir)
-    json_h.save_config_json(outfile, vpn_data)
+    if checkpoint.is_done(url, outfile):
+        print ("   = Resuming {} from checkpoint".format(outfile))
+        vpn_data = json_h.read_json_file(outfile)
+    else:
+        vpn_data = semp_h.get_vpn_config_json (url)
+        json_h.save_config_json(outfile, vpn_data)
+        checkpoint.mark(url, outfile, vpn_data)
+    if Verbose > 2:
+        print ('VPN ', pp.pprint(vpn_data))
 
     # start from vpn links and traverse recursivey from there
-    semp_h.process_page_links(vpn_data)
-
+    visited = semp_h.visited
+    try:
+        if Async:
+            visited = asyncio.run(process_page_links_async(cfg, vpn, out_dir, vpn_data, checkpoint, semp_h.schema, neg_cache,
+                                                           writer, assembler, incremental))
+        elif Workers > 1:
+            semp_h.process_page_links_parallel(vpn_data, Workers)
+        else:
+            semp_h.process_page_links(vpn_data)
+    finally:
+        # all pages must be on disk (and in the checkpoint) before parsing
+        if writer:
+            writer.close()
+
+    checkpoint.close()
+    neg_cache.save()
+    # collections that failed or were skipped are not in the capture
+    result['unsupported'] = neg_cache.unsupported()
+    missing = neg_cache.missing()
+    if missing:
+        result['status'] = 'partial'
+        result['error'] = 'not captured: {}'.format(', '.join(missing))
+    result['fetched'] = checkpoint.n_saved
+    result['resumed'] = checkpoint.n_resumed
+    print (checkpoint.summary())
+    if incremental:
+        print (incremental.summary())
+        # objects of reused pages were not read from the broker this run
+        if incremental.counts['pages']:
+            result['incremental'] = dict(incremental.marker(), reusedPages=incremental.counts['pages'])
+    print (semp_h.schema.summary())
+    print (visited.summary())
     return outfile
 
 
+async def process_page_links_async(cfg, vpn, out_dir, vpn_data, checkpoint, schema, neg_cache, writer, assembler, incremental):
+    """ traverse vpn links with asyncio SEMP engine. returns its VisitedIndex """
+    async with AsyncSempHandler.AsyncSempHandler(cfg, vpn, out_dir, Verbose, Workers, checkpoint, schema, neg_cache, Scope,
+                                                 writer, assembler, incremental) as semp_a:
+        await semp_a.process_page_links(vpn_data)
+        return semp_a.visited
+
+
+def print_crawl_plan(rtr_cfg):
+    """ print collections the crawl will request for this broker """
+    semp_h = SempHandler.SempHandler(dict(Cfg, router=rtr_cfg), verbose=Verbose)
+    semp_h.schema.set_version(semp_h.get_semp_version())
+    print ("Crawl plan for {} (SEMP version: {})".format(rtr_cfg["label"], semp_h.schema.semp_version))
+    for path in semp_h.schema.plan():
+        if not Scope.allows_type(path):
+            continue
+        print ("   {}".format(path))
+
+
 
 if __name__ == "__main__":
     """ program entry point - must be  below main() """
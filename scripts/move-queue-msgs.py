@@ -3,6 +3,8 @@
 #  Use --copy-only to copy messages (leave messages in source queue)
 #  Default is to move messages (delete from source queue)
 #  Max Page size is 100 (SEMP limitation?). Can't move more than 100 messages in one run
+#  Use --inflight N to copy / move N messages at a time with the asyncio SEMP engine
+#   (AsyncSempHandler). Messages may then reach the destination queue out of order
 #
 # - using common functions to redude code footprint
 #
@@ -14,10 +16,14 @@ import sys, os
 import argparse
 import pprint
 import json
+import asyncio
 from urllib.parse import unquote, quote # for Python 3.7
 
 sys.path.insert(0, os.path.abspath("."))
+from common import LogHandler
 from common import SempHandler
+from common import SempCrawler
+from common import AsyncSempHandler
 from common import JsonHandler
 from common import YamlHandler
 
@@ -32,11 +38,12 @@ Cfg = {}    # global handy config dict
 Verbose = 0
 Copy_only = False # default is to move messages (delete from source queue)
 Prompt = "Moving"
+Inflight = 1 # messages copied / moved at a time. > 1 uses the asyncio engine (--inflight)
 pp = pprint.PrettyPrinter(indent=4)
 
 def main(argv):
     """ program entry drop point """
-    global Cfg, Verbose, Copy_only, Prompt
+    global Cfg, Verbose, Copy_only, Prompt, Inflight
 
     p = argparse.ArgumentParser()
     p.add_argument('--config', dest="config_file", required=True, help='config json file') 
@@ -44,6 +51,8 @@ def main(argv):
                 help='Verbose output. use -vvv for tracing')
     p.add_argument('--copy-only', dest="copy_only", action='store_true', required=False, default=False, 
                    help='Leave messages in the source queue after copy (Default: DELETE))')
+    p.add_argument('--inflight', dest="inflight", type=int, required=False, default=1,
+                   help='copy / move N messages at a time with the asyncio engine. order is not kept (Default: 1)')
     r = p.parse_args()
 
     print ('\n{}-{} Starting\n'.format(me,ver))
@@ -51,6 +60,7 @@ def main(argv):
     Verbose = r.verbose
     Copy_only = r.copy_only
     Prompt = "Copying" if Copy_only else "Moving"
+    Inflight = max(1, r.inflight)
 
     json_h = JsonHandler.JsonHandler()
 
@@ -66,28 +76,28 @@ def main(argv):
         print ('SYSTEM CONFIG'); pp.pprint (system_config_all)
 
     Cfg['system'] = system_config_all.copy() # store system cfg in the global Cfg dict
+    Cfg['script_name'] = me
+    Cfg['verbose'] = Verbose
+
+    log_h = LogHandler.LogHandler(Cfg)
+    log = log_h.get()
+    log.info('Starting {}-{}'.format(me, ver))
+    Cfg['log_handler'] = log_h
 
     vpn = Cfg["vpn"]["msgVpnNames"][0]
     src_q = Cfg["queues"]["source"]
     dest_q = Cfg["queues"]["destination"]
     print ("{} Msgs from Queue {} -> {} in VPN {}".format(Prompt, src_q, dest_q, vpn))
-    vpn_json_file = copy_or_move_msgs (vpn, src_q, dest_q)
-
-def copy_or_move_msgs (vpn, src_q, dest_q):
-
-    global Verbose, Copy_only
-
-    if Verbose:
-        print ("copy_or_move_msgs: vpn: {} src_q: {} dest_q: {}".format(vpn, src_q, dest_q))
-
+    if Inflight > 1:
+        asyncio.run(copy_or_move_msgs_async (vpn, src_q, dest_q))
+    else:
+        copy_or_move_msgs (vpn, src_q, dest_q)
+    SempHandler.close_sessions()
+
+def msg_urls (vpn, src_q, dest_q):
+    """ returns (msgs list url, its query params, copy url, action url of the vpn) """
     rtr_cfg = Cfg["router"]
     sys_cfg = Cfg["system"]
-    if Verbose > 2:
-        print ('--- ROUTER :\n', json.dumps(rtr_cfg))
-        print ('--- SYSCFG :\n', json.dumps(sys_cfg))
-
-    semp_h = SempHandler.SempHandler(Cfg, Verbose)
-
     # Get list of replicationGroupMsgId's from source queue
     page_sz = sys_cfg["semp"]["pageSize"]
     if page_sz > 100:
@@ -96,33 +106,54 @@ def copy_or_move_msgs (vpn, src_q, dest_q):
 
     m_url = "{}/{}/msgVpns/{}".format(rtr_cfg["sempUrl"], sys_cfg["semp"]["monitorUrl"], vpn )
     a_url = "{}/{}/msgVpns/{}".format(rtr_cfg["sempUrl"], sys_cfg["semp"]["actionUrl"], vpn )
-    query_url = "{}/queues/{}/msgs?select=msgId,replicationGroupMsgId&count={}".format(unquote(m_url), quote(src_q, safe=''), page_sz)
+    query_url = "{}/queues/{}/msgs".format(unquote(m_url), quote(src_q, safe=''))
+    query_params = SempCrawler.query_params(page_sz, select=['msgId', 'replicationGroupMsgId'])
     copy_url = "{}/queues/{}/copyMsgFromQueue".format(unquote(a_url), quote(dest_q, safe=''))
-
-
     if Verbose > 2:
         print("   Get URL {} (PageSize: {})".format(query_url, page_sz))
+    return query_url, query_params, copy_url, a_url
+
+def delete_url (a_url, src_q, msg_id):
+    """ action url deleting msg_id (msgId, not replicationGroupMsgId) from the source queue """
+    return "{}/queues/{}/msgs/{}/delete".format(unquote(a_url), quote(src_q, safe=''), msg_id)
 
-    resp = semp_h.http_get(query_url) 
+def copy_or_move_msgs (vpn, src_q, dest_q):
+
+    global Verbose, Copy_only
+
+    if Verbose:
+        print ("copy_or_move_msgs: vpn: {} src_q: {} dest_q: {}".format(vpn, src_q, dest_q))
+
+    rtr_cfg = Cfg["router"]
+    sys_cfg = Cfg["system"]
     if Verbose > 2:
-        print("Get: req.json()")
-        pp.pprint(resp.json()['data'])
+        print ('--- ROUTER :\n', json.dumps(rtr_cfg))
+        print ('--- SYSCFG :\n', json.dumps(sys_cfg))
+
+    semp_h = SempHandler.SempHandler(Cfg, vpn, verbose=Verbose)
+    query_url, query_params, copy_url, a_url = msg_urls(vpn, src_q, dest_q)
+
+    resp = semp_h.http_get(query_url, query_params)
     if (resp.status_code != 200):
         print(resp.text)
         raise RuntimeError
+    msgs = resp.data  # decoded once
+    if Verbose > 2:
+        print("Get: req.json()")
+        pp.pprint(msgs)
 
     # check if we got any messages to move    
-    if len(resp.json()['data']) == 0:
+    if len(msgs) == 0:
         print ("No messages to move")
         return
     
     # ok we got some msgs to move
     # build the move url
-    nmsgs = len(resp.json()['data'])
+    nmsgs = len(msgs)
     n = 1
-    print ("{} {} messages from {} -> {}".format(Prompt, len(resp.json()['data']), src_q, dest_q))
+    print ("{} {} messages from {} -> {}".format(Prompt, nmsgs, src_q, dest_q))
     # loop thru the list of replicationGroupMsgId's and move them
-    for msg in resp.json()['data']:
+    for msg in msgs:
         msg_id = msg['msgId']
         rgm_id = msg['replicationGroupMsgId']
         body = { "replicationGroupMsgId": rgm_id , "sourceQueueName": src_q }
@@ -155,12 +186,12 @@ def copy_or_move_msgs (vpn, src_q, dest_q):
         if Verbose:
             print ("   * Delete message {} from {}".format(msg_id, src_q))
 
-        delete_url = "{}/queues/{}/msgs/{}/delete".format(unquote(a_url), quote(src_q, safe=''), msg_id)
+        del_url = delete_url(a_url, src_q, msg_id)
         if Verbose > 2:
-            print("   Delete URL (PUT) {}".format(delete_url))
+            print("   Delete URL (PUT) {}".format(del_url))
         body = {}
 
-        resp = semp_h.http_put (delete_url, body)
+        resp = semp_h.http_put (del_url, body)
         if Verbose > 2:
             print("Delete: resp.json()")
             pp.pprint(resp.json())
@@ -168,6 +199,44 @@ def copy_or_move_msgs (vpn, src_q, dest_q):
             print(resp.text)
             continue
     
+async def copy_or_move_msgs_async (vpn, src_q, dest_q):
+    """ copy_or_move_msgs with up to Inflight messages in flight (AsyncSempHandler) """
+    if Verbose:
+        print ("copy_or_move_msgs_async: vpn: {} src_q: {} dest_q: {} inflight: {}".format(vpn, src_q, dest_q, Inflight))
+    query_url, query_params, copy_url, a_url = msg_urls(vpn, src_q, dest_q)
+    async with AsyncSempHandler.AsyncSempHandler(Cfg, vpn, verbose=Verbose, max_inflight=Inflight) as semp_h:
+        resp = await semp_h.http_get(query_url, query_params)
+        if (resp.status_code != 200):
+            print(resp.text)
+            raise RuntimeError
+        msgs = resp.data
+        if len(msgs) == 0:
+            print ("No messages to move")
+            return
+        print ("{} {} messages from {} -> {} ({} at a time)".format(Prompt, len(msgs), src_q, dest_q, Inflight))
+        await asyncio.gather(*(move_msg_async(semp_h, n, len(msgs), msg, src_q, dest_q, copy_url, a_url)
+                               for n, msg in enumerate(msgs, 1)))
+
+async def move_msg_async (semp_h, n, nmsgs, msg, src_q, dest_q, copy_url, a_url):
+    """ copy one message, then delete it from the source queue unless --copy-only """
+    msg_id = msg['msgId']
+    rgm_id = msg['replicationGroupMsgId']
+    body = { "replicationGroupMsgId": rgm_id , "sourceQueueName": src_q }
+    print (" - {} msg {} of {} (Msg Id: {}, ID: {})".format(Prompt, n, nmsgs, msg_id, rgm_id))
+    resp = await semp_h.http_put(copy_url, body)
+    if (resp.status_code != 200):
+        print (f"   *** Copy msg {msg_id} to {dest_q} failed. Leaving message in source queue {src_q} ***")
+        if Verbose > 2:
+            print(resp.text)
+        return
+    if Copy_only:
+        return
+    if Verbose:
+        print ("   * Delete message {} from {}".format(msg_id, src_q))
+    resp = await semp_h.http_put(delete_url(a_url, src_q, msg_id), {})
+    if (resp.status_code != 200):
+        print(resp.text)
+
 # Program entry point
 if __name__ == "__main__":
     """ program entry point - must be  below main() """
@@ -0,0 +1,100 @@
+# rebuild-vpn-config.py
+#
+# Rebuild the consolidated VPN config (<vpn>-all.json) from a capture made by
+# get-vpn-config (vpn output dir or its zip / tar.gz / tar.zst archive)
+# No broker access. ndjson captures can't be rebuilt (page links are not kept)
+# Usage:
+#   python3 rebuild-vpn-config.py --config config/sample-config-local.yaml --capture output/json/localhost/TestVPN
+#          [--out FILE] [--stream] [--procs N] [-v]
+#
+# Ramesh Natarajan (nram), Solace PSG
+# nram@nram.dev
+
+import sys, os
+import argparse
+import pprint
+import time
+import tempfile
+
+sys.path.insert(0, os.path.abspath("."))
+from common import JsonHandler
+from common import ConfigParser
+from common import ConfigAssembler
+from common import CaptureOutput
+from common import YamlHandler
+
+
+me = "rebuild-vpn-config"
+ver = '2.0.0'
+yaml_h = YamlHandler.YamlHandler()
+json_h = JsonHandler.JsonHandler()
+
+# Globals
+Cfg = {}    # global handy config dict
+Verbose = 0
+Stream = False  # keep only links in memory, write data from page files
+Procs = 1       # processes decoding page files
+pp = pprint.PrettyPrinter(indent=4)
+
+def main(argv):
+    """ program entry drop point """
+    global Cfg, Verbose, Stream, Procs
+
+    p = argparse.ArgumentParser()
+    p.add_argument('--config', dest="config_file", required=True, help='config json file')
+    p.add_argument('--capture', dest="capture", required=True, help='vpn capture dir or archive (.zip, .tar.gz, .tar.zst)')
+    p.add_argument('--out', dest="out_file", required=False, default=None,
+                help='output file (default: <vpn>-all.json in the capture dir or next to the archive)')
+    p.add_argument('--stream', dest="stream", action='store_true', required=False, default=False,
+                help='bounded memory: keep only page links in memory and write data from the page files')
+    p.add_argument('--procs', dest="procs", type=int, required=False, default=1,
+                help='decode page files with N processes (default: 1)')
+    p.add_argument( '--verbose', '-v', action="count",  required=False, default=0,
+                help='Verbose output. use -vvv for tracing')
+    r = p.parse_args()
+
+    print ('\n{}-{} Starting\n'.format(me,ver))
+
+    Verbose = r.verbose
+    Stream = r.stream
+    Procs = max(1, r.procs)
+    Cfg = yaml_h.read_config_file(r.config_file)
+    sys_cfg_file = Cfg["internal"]["systemConfig"]
+    print ("Reading system config {}".format(sys_cfg_file))
+    Cfg['system'] = yaml_h.read_config_file (sys_cfg_file)
+    if Verbose > 2:
+        print ('SYSTEM CONFIG'); pp.pprint (Cfg['system'])
+
+    capture = r.capture.rstrip('/')
+    if os.path.isdir(capture):
+        rebuild(capture, r.out_file)
+        return
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(capture))) as tmp_dir:
+        print ("Extracting {}".format(capture))
+        vpn_dir = CaptureOutput.extract_archive(capture, tmp_dir)
+        rebuild(vpn_dir, r.out_file or os.path.join(os.path.dirname(capture), '{}-all.json'.format(os.path.basename(vpn_dir))))
+
+
+def rebuild(vpn_dir, out_file=None):
+    """ parse capture in vpn_dir and save vpn all config json """
+    start = time.time()
+    vpn_json_file = '{}/vpn.json'.format(vpn_dir)
+    vpn_json_data = json_h.read_json_data (vpn_json_file)
+    if vpn_json_data is None:
+        raise RuntimeError('no data in {}'.format(vpn_json_file))
+    vpn_name = vpn_json_data['data'].get('msgVpnName', os.path.basename(vpn_dir))
+    print ('Parse VPN JSON Configs for {} ({})'.format(vpn_name, vpn_dir))
+    cfg_p = ConfigParser.ConfigParser(Cfg, Verbose, Stream, Procs)
+    vpn_cfg = cfg_p.cfg_parse(vpn_name, vpn_dir, vpn_json_data)
+    print ('   {} collection dirs, {} json files read ({:.1f} secs)'.format(len(cfg_p.index), cfg_p.n_files, time.time() - start))
+
+    out_file = out_file or '{}/{}-all.json'.format(vpn_dir, vpn_name)
+    print ('Save VPN all config json')
+    ConfigAssembler.save_config(out_file, vpn_cfg)
+
+
+
+if __name__ == "__main__":
+    """ program entry point - must be  below main() """
+
+    main(sys.argv[1:])
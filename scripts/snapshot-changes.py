@@ -0,0 +1,135 @@
+# snapshot-changes.py
+#
+# List VPN config snapshots saved by get-vpn-config --snapshot and what changed
+# between two runs (compared from the run manifests, no broker access)
+# Usage:
+#   python3 snapshot-changes.py --config config/sample-config-local.yaml [--router LABEL] [--vpn VPN]
+#          [--list] [--from RUN] [--to RUN] [--show] [--prune N] [-v]
+#   Default compares the last two runs of each router / vpn
+#
+# Ramesh Natarajan (nram), Solace PSG
+# nram@nram.dev
+
+import sys, os
+import argparse
+import pprint
+import json
+
+sys.path.insert(0, os.path.abspath("."))
+from common import SnapshotStore
+from common import YamlHandler
+
+
+me = "snapshot-changes"
+ver = '2.0.0'
+yaml_h = YamlHandler.YamlHandler()
+
+# Globals
+Cfg = {}    # global handy config dict
+Verbose = 0
+pp = pprint.PrettyPrinter(indent=4)
+
+def main(argv):
+    """ program entry drop point """
+    global Cfg, Verbose
+
+    p = argparse.ArgumentParser()
+    p.add_argument('--config', dest="config_file", required=True, help='config json file')
+    p.add_argument('--router', dest="router", required=False, default=None, help='only this router label')
+    p.add_argument('--vpn', dest="vpn", required=False, default=None, help='only this vpn')
+    p.add_argument('--list', dest="list_runs", action='store_true', required=False, default=False,
+                help='list saved runs')
+    p.add_argument('--from', dest="from_run", required=False, default=None, help='old run id (default: run before --to)')
+    p.add_argument('--to', dest="to_run", required=False, default=None, help='new run id (default: latest run)')
+    p.add_argument('--show', dest="show", action='store_true', required=False, default=False,
+                help='print old and new json of changed objects')
+    p.add_argument('--prune', dest="prune", type=int, required=False, default=None,
+                help='keep last N runs per router / vpn and remove unreferenced objects')
+    p.add_argument( '--verbose', '-v', action="count",  required=False, default=0,
+                help='Verbose output. use -vvv for tracing')
+    r = p.parse_args()
+
+    print ('\n{}-{} Starting\n'.format(me,ver))
+
+    Verbose = r.verbose
+    Cfg = yaml_h.read_config_file(r.config_file)
+    sys_cfg_file = Cfg["internal"]["systemConfig"]
+    print ("Reading system config {}".format(sys_cfg_file))
+    Cfg['system'] = yaml_h.read_config_file (sys_cfg_file)
+    if Verbose > 2:
+        print ('SYSTEM CONFIG'); pp.pprint (Cfg['system'])
+
+    sys_cfg = Cfg["system"]["system"]
+    store = SnapshotStore.SnapshotStore("{}/{}".format(sys_cfg["outputDir"], sys_cfg.get("snapshotDir", "snapshots")), Verbose)
+
+    if r.prune is not None:
+        n_runs, n_objects = store.prune(r.prune)
+        print ("Pruned {} runs, {} objects from {}".format(n_runs, n_objects, store.store_dir))
+        return
+
+    vpns = [(router, vpn) for router, vpn in store.list_vpns()
+            if r.router in (None, router) and r.vpn in (None, vpn)]
+    if not vpns:
+        print ("No snapshots in {}".format(store.store_dir))
+        return
+
+    for router, vpn in vpns:
+        runs = store.list_runs(router, vpn)
+        print ("\n{} / {}: {} runs".format(router, vpn, len(runs)))
+        if r.list_runs:
+            for run_id in runs:
+                run = store.load_run(router, vpn, run_id)
+                print ("   {:<20} {:>7} objects  {:>5} added {:>5} removed {:>5} changed  {}".format(
+                    run_id, len(run['objects']), run['changes']['added'], run['changes']['removed'], run['changes']['changed'],
+                    reuse_note(run)))
+            continue
+        print_changes(store, router, vpn, runs, r.from_run, r.to_run, r.show)
+
+
+def reuse_note(run):
+    """ full capture or which collections the run reused from an earlier snapshot """
+    if not run.get('incremental'):
+        return 'full'
+    return 'incremental: {} collections reused (full capture {})'.format(len(run.get('reused', [])), run['fullRun'])
+
+
+def print_changes(store, router, vpn, runs, from_run, to_run, show):
+    """ print objects added, removed and changed between two runs """
+    to_run = to_run or (runs[-1] if runs else None)
+    if to_run not in runs:
+        print ("   **** Run {} not found ****".format(to_run))
+        return
+    if from_run is None:
+        i = runs.index(to_run)
+        from_run = runs[i-1] if i > 0 else None
+    if from_run not in runs:
+        print ("   **** Nothing to compare {} with ****".format(to_run))
+        return
+
+    old_run = store.load_run(router, vpn, from_run)
+    new_run = store.load_run(router, vpn, to_run)
+    old_objects = old_run['objects']
+    new_objects = new_run['objects']
+    changes = SnapshotStore.compare(old_objects, new_objects)
+    print ("   Changes {} -> {}: {} added, {} removed, {} changed".format(
+        from_run, to_run, len(changes['added']), len(changes['removed']), len(changes['changed'])))
+    for run in (old_run, new_run):
+        if run.get('incremental'):
+            print ("   ! Run {} {}: other attribute changes of their objects show up at the next full capture".format(
+                run['run'], reuse_note(run)))
+    for kind, mark in (('added', '+'), ('removed', '-'), ('changed', '*')):
+        for key in changes[kind]:
+            print ("   {} {}".format(mark, key))
+            if not show:
+                continue
+            if kind != 'added':
+                print ("      old: {}".format(json.dumps(store.get(old_objects[key]), sort_keys=True)))
+            if kind != 'removed':
+                print ("      new: {}".format(json.dumps(store.get(new_objects[key]), sort_keys=True)))
+
+
+
+if __name__ == "__main__":
+    """ program entry point - must be  below main() """
+
+    main(sys.argv[1:])
@@ -0,0 +1,54 @@
+# Capture dir index of ConfigParser
+#   python3 -m pytest tests
+
+import sys, os
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import ConfigParser
+
+SempUrl = 'http://localhost:8080/SEMP/v2/config/msgVpns/TestVPN'
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        json.dump(data, fp)
+
+
+class TestIndexCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # capture made in crawl_dir, then moved to vpn_dir (eg: extracted archive)
+        crawl_dir = '/output/localhost/TestVPN'
+        self.vpn_dir = os.path.join(self.tmp_dir, 'TestVPN')
+        for f in ('vpn.json', 'queues/queues.json', 'queues/queues-1.json'):
+            write_json(os.path.join(self.vpn_dir, f), {'data': []})
+        self.manifest_file = os.path.join(self.vpn_dir, 'crawl-checkpoint.jsonl')
+        with open(self.manifest_file, 'w') as fp:
+            for url, f in ((SempUrl, 'vpn.json'), (SempUrl + '/queues', 'queues/queues.json')):
+                fp.write(json.dumps({'url': url, 'file': '{}/{}'.format(crawl_dir, f), 'status': 'done'}) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_all_pages_without_manifest(self):
+        os.remove(self.manifest_file)
+        pages = ConfigParser.manifest_pages(self.manifest_file)
+        self.assertIsNone(pages)
+        index = ConfigParser.index_capture(self.vpn_dir, pages)
+        self.assertEqual([os.path.basename(f) for f in index['queues']['queues']], ['queues.json', 'queues-1.json'])
+
+    def test_stale_page_not_indexed(self):
+        pages = ConfigParser.manifest_pages(self.manifest_file)
+        self.assertEqual(pages, {'vpn.json', 'queues/queues.json'})
+        index = ConfigParser.index_capture(self.vpn_dir, pages)
+        self.assertEqual([os.path.basename(f) for f in index['queues']['queues']], ['queues.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
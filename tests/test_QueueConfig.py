@@ -0,0 +1,64 @@
+# deadMsgQueue ordering of QueueConfig.Queues (dmq_waves)
+#   python3 -m pytest tests
+
+import sys, os
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import QueueConfig
+
+
+def job(queue, dmq=None):
+    data = {'queueName': queue}
+    if dmq:
+        data['deadMsgQueue'] = dmq
+    return (queue, data)
+
+
+class TestDmqWaves(unittest.TestCase):
+
+    def setUp(self):
+        self.queues = QueueConfig.Queues.__new__(QueueConfig.Queues)
+
+    def wave_of(self, waves):
+        """ [(queue, wave)] in job order of each wave """
+        return [(j[0], w) for w, wave in enumerate(waves) for j in wave]
+
+    def assert_ordered(self, jobs, waves):
+        """ every job runs after all jobs of its deadMsgQueue and after the earlier rows of its queue """
+        wave = {id(j): w for w, js in enumerate(waves) for j in js}
+        self.assertEqual(len(wave), len(jobs))
+        for i, (queue, data) in enumerate(jobs):
+            for j, (other, _) in enumerate(jobs):
+                if other == data.get('deadMsgQueue') and other != queue:
+                    self.assertGreater(wave[id(jobs[i])], wave[id(jobs[j])])
+                if other == queue and j < i:
+                    self.assertGreater(wave[id(jobs[i])], wave[id(jobs[j])])
+
+    def test_no_dmq(self):
+        jobs = [job('A'), job('B'), job('C')]
+        self.assertEqual(self.queues.dmq_waves(jobs), [jobs])
+
+    def test_shared_dmq_different_depths(self):
+        # D is the dmq of A (depth 1) and of C, which is the dmq of B (depth 2). D has two rows
+        jobs = [job('A', 'D'), job('D'), job('D'), job('B', 'C'), job('C', 'D')]
+        waves = self.queues.dmq_waves(jobs)
+        self.assert_ordered(jobs, waves)
+        self.assertEqual(dict(self.wave_of(waves)), {'D': 1, 'A': 2, 'C': 2, 'B': 3})
+        self.assertEqual(waves[0], [jobs[1]])
+        self.assertEqual(waves[1], [jobs[2]])
+
+    def test_dmq_after_its_queue_in_input(self):
+        jobs = [job('B', 'C'), job('C', 'D'), job('A', 'D'), job('D')]
+        waves = self.queues.dmq_waves(jobs)
+        self.assert_ordered(jobs, waves)
+        self.assertEqual(len(waves), 3)
+
+    def test_dmq_loop(self):
+        jobs = [job('A', 'B'), job('B', 'A'), job('C', 'C')]
+        waves = self.queues.dmq_waves(jobs)
+        self.assertEqual(sorted(j[0] for wave in waves for j in wave), ['A', 'B', 'C'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# Retry policy of SempGovernor / SempHandler.request, in-flight slots
+#   python3 -m pytest tests
+
+import sys, os
+import asyncio
+import logging
+import threading
+import unittest
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import SempGovernor
+from common import SempHandler
+
+
+class FakeSession():
+    """ requests session raising exc on every request """
+
+    def __init__(self, exc):
+        self.exc = exc
+        self.calls = []
+
+    def request(self, verb, url, **kwargs):
+        self.calls.append((verb, url))
+        raise self.exc
+
+
+def make_handler(session):
+    """ SempHandler with only what request() needs """
+    SempHandler.log = logging.getLogger('test')
+    semp_h = SempHandler.SempHandler.__new__(SempHandler.SempHandler)
+    semp_h.rtr_cfg = {'label': 'test'}
+    semp_h.session = session
+    semp_h.timeout = 1
+    semp_h.governor = SempGovernor.SempGovernor('test', {'backoffBase': 0, 'backoffMax': 0})
+    return semp_h
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.gov = SempGovernor.SempGovernor('test', {})
+
+    def test_get_retried(self):
+        self.assertTrue(self.gov.should_retry(0, 'get', timeout=True))
+        self.assertTrue(self.gov.should_retry(0, 'get', 504))
+
+    def test_unsafe_verbs_not_retried_after_send(self):
+        for verb in ('post', 'put', 'patch', 'delete'):
+            self.assertFalse(self.gov.should_retry(0, verb, timeout=True), verb)
+            self.assertFalse(self.gov.should_retry(0, verb, 502), verb)
+            self.assertFalse(self.gov.should_retry(0, verb, 504), verb)
+
+    def test_unsafe_verbs_retried_when_refused(self):
+        for verb in ('post', 'put'):
+            self.assertTrue(self.gov.should_retry(0, verb, 429), verb)
+            self.assertTrue(self.gov.should_retry(0, verb, 503), verb)
+            self.assertTrue(self.gov.should_retry(0, verb, connect_error=True), verb)
+
+    def test_action_put_timeout_not_retried(self):
+        session = FakeSession(requests.ReadTimeout('read timed out'))
+        semp_h = make_handler(session)
+        url = 'http://localhost/SEMP/v2/action/msgVpns/v/queues/q/copyMsgFromQueue'
+        with self.assertRaises(requests.ReadTimeout):
+            semp_h.request('put', url, data='{}')
+        self.assertEqual(len(session.calls), 1)
+
+    def test_action_put_cut_after_send_not_retried(self):
+        session = FakeSession(requests.ConnectionError('Connection aborted.'))
+        semp_h = make_handler(session)
+        with self.assertRaises(requests.ConnectionError):
+            semp_h.request('put', 'http://localhost/SEMP/v2/action/msgVpns/v/queues/q/copyMsgFromQueue', data='{}')
+        self.assertEqual(len(session.calls), 1)
+
+    def test_get_timeout_retried(self):
+        session = FakeSession(requests.ReadTimeout('read timed out'))
+        semp_h = make_handler(session)
+        with self.assertRaises(requests.ReadTimeout):
+            semp_h.request('get', 'http://localhost/SEMP/v2/config/msgVpns/v')
+        self.assertEqual(len(session.calls), semp_h.governor.retries + 1)
+
+
+class TestInflight(unittest.TestCase):
+
+    def setUp(self):
+        self.gov = SempGovernor.SempGovernor('test', {'initialInflight': 1, 'maxInflight': 1})
+
+    def test_async_waiters_woken_by_thread_release(self):
+        order = []
+
+        async def task(n):
+            await self.gov.acquire_async()
+            order.append(n)
+            self.gov.release(0)
+
+        async def run():
+            tasks = [asyncio.create_task(task(n)) for n in range(3)]
+            await asyncio.sleep(0.05)
+            # slot still held: tasks wait, nothing is polled in the meantime
+            self.assertEqual(order, [])
+            self.assertEqual(len(self.gov.waiters), 3)
+            threading.Thread(target=self.gov.release, args=(0,)).start()
+            await asyncio.wait_for(asyncio.gather(*tasks), 2)
+
+        self.gov.acquire()
+        asyncio.run(run())
+        self.assertEqual(sorted(order), [0, 1, 2])
+        self.assertEqual(self.gov.inflight, 0)
+        self.assertEqual(self.gov.waiters, [])
+
+    def test_cancelled_waiter_removed(self):
+        async def run():
+            t = asyncio.create_task(self.gov.acquire_async())
+            await asyncio.sleep(0.01)
+            t.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await t
+
+        self.gov.acquire()
+        asyncio.run(run())
+        self.assertEqual(self.gov.waiters, [])
+        self.assertEqual(self.gov.inflight, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()